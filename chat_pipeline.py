@@ -0,0 +1,356 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, Hashable, Optional, Tuple
+
+from chatbot import LLMCallCounter, TravelChatbot
+from clustering import EngineState, TravelRecommendationEngine
+from llm_cache import normalize_message
+from resilience import Deadline
+from session_store import SessionStore
+from single_flight import SingleFlight
+
+ANALYSIS_MODES = ('separate', 'combined')
+RESPONSE_MODES = ('llm', 'template')
+
+
+class ChatPipeline:
+    """
+    Xử lý một tin nhắn chat (phạm vi một request): kiểm tra chủ đề, trích xuất preferences,
+    lấy recommendations và tạo phản hồi, mỗi bước chạy đúng một lần và truyền kết quả cho bước sau.
+
+    analysis_mode:
+    - 'separate': kiểm tra chủ đề và trích xuất bằng hai lần gọi LLM
+    - 'combined': gộp kiểm tra chủ đề và trích xuất vào một lần gọi LLM
+
+    run() dùng client OpenAI sync (cho script); arun() dùng client async cho web server,
+    chạy trích xuất song song (đầu cơ) với kiểm tra chủ đề và hủy trích xuất khi bị từ chối.
+
+    local_first_confidence: nếu đặt, phân tích bằng luật trước và bỏ qua LLM (kiểm tra chủ đề, trích xuất,
+    câu từ chối) khi confidence của luật đạt ngưỡng; phản hồi giới thiệu địa điểm vẫn do LLM viết.
+
+    budget: thời gian tối đa (giây) cho cả request. Mỗi bước gọi LLM nhận một phần (BUDGET_SHARES) thời gian
+    còn lại làm timeout; hết thời gian thì bước đó dùng fallback (regex, preferences mặc định, phản hồi soạn sẵn).
+
+    response_mode:
+    - 'llm': LLM viết phản hồi giới thiệu địa điểm
+    - 'template': phản hồi dựng từ template (TemplateResponder), không gọi LLM ở bước tạo phản hồi
+
+    session_store / session_id: hội thoại nhiều lượt. Nếu session đã có preferences từ lượt trước, tin nhắn được
+    phân tích như câu tiếp nối (chỉ trích xuất phần thay đổi, gộp vào preferences đã lưu) và recommendations
+    tính lại từ preferences đã gộp; preferences của lượt du lịch được lưu lại cho lượt sau.
+    """
+
+    # Phần thời gian còn lại dành cho từng bước khi bước đó bắt đầu
+    # (analyze: kiểm tra chủ đề và trích xuất chạy đồng thời hoặc gộp một lần gọi)
+    BUDGET_SHARES = {'topic': 0.3, 'extract': 0.5, 'analyze': 0.45, 'followup': 0.45, 'generate': 1.0}
+
+    def __init__(self, chatbot: TravelChatbot, engine: TravelRecommendationEngine,
+                 state: Optional[EngineState] = None, rank_by: str = 'hci', top_k: int = 5,
+                 analysis_mode: str = 'separate', local_first_confidence: Optional[float] = None,
+                 budget: Optional[float] = None, response_mode: str = 'llm',
+                 session_store: Optional[SessionStore] = None, session_id: Optional[str] = None):
+        if analysis_mode not in ANALYSIS_MODES:
+            raise ValueError(f"analysis_mode must be one of {ANALYSIS_MODES}")
+        if response_mode not in RESPONSE_MODES:
+            raise ValueError(f"response_mode must be one of {RESPONSE_MODES}")
+        self.chatbot = chatbot
+        self.engine = engine
+        self.state = state or engine.state
+        self.rank_by = rank_by
+        self.top_k = top_k
+        self.analysis_mode = analysis_mode
+        self.local_first_confidence = local_first_confidence
+        self.budget = budget
+        self.response_mode = response_mode
+        self.session_store = session_store
+        self.session_id = session_id
+        self.deadline = None
+
+        self.user_message = None
+        self.topic_result = {}
+        self.is_travel_related = False
+        self.preferences = {}
+        # Preferences đã gộp của các lượt trước trong session (None nếu là lượt đầu) và phần thay đổi của lượt này
+        self.previous_preferences = None
+        self.preference_delta = None
+        self.ranked = None
+        self.recommendations = []
+        self.response = None
+        # Trích xuất chạy đầu cơ bị hủy vì câu hỏi bị từ chối
+        self.extraction_cancelled = False
+        # Phân tích bằng luật, không gọi LLM (local-first)
+        self.analyzed_locally = False
+        # Thời gian từng bước (ms)
+        self.timings = {}
+        # Số lần gọi LLM của request (chỉ đếm khi chạy async: arun, astream)
+        self.llm_calls = LLMCallCounter()
+
+    def _timed(self, stage: str, started: float):
+        self.timings[stage] = (time.perf_counter() - started) * 1000
+
+    def _start(self, user_message: str):
+        self.user_message = user_message
+        self.deadline = Deadline(self.budget) if self.budget is not None else None
+        self.llm_calls = LLMCallCounter()
+        if self.session_store is not None:
+            self.previous_preferences = self.session_store.get(self.session_id)
+
+    def _remember(self):
+        """Lưu preferences đã gộp cho lượt sau của session"""
+        if self.session_store is not None and self.is_travel_related and self.preferences:
+            self.session_store.set(self.session_id, self.preferences)
+
+    def _apply_followup(self, topic_result: Dict, delta: Optional[Dict]):
+        self.topic_result = topic_result
+        self.is_travel_related = delta is not None
+        self.preference_delta = delta
+        self.preferences = self.chatbot.apply_preference_delta(self.previous_preferences, delta) \
+            if delta is not None else {}
+
+    def _timeout(self, stage: str) -> Optional[float]:
+        """Timeout cho lần gọi LLM của một bước, None nếu không giới hạn thời gian"""
+        return self.deadline.share(self.BUDGET_SHARES[stage]) if self.deadline is not None else None
+
+    def _analyze_locally(self) -> bool:
+        """Phân tích bằng luật; True nếu confidence đạt ngưỡng local-first và không cần gọi LLM"""
+        if self.local_first_confidence is None:
+            return False
+        started = time.perf_counter()
+        if self.previous_preferences is not None:
+            topic_result, delta = self.chatbot.analyze_followup_locally(self.user_message)
+        else:
+            topic_result, preferences = self.chatbot.analyze_locally(self.user_message)
+        self._timed('local', started)
+        if topic_result['confidence'] < self.local_first_confidence:
+            return False
+        self.analyzed_locally = True
+        if self.previous_preferences is not None:
+            self._apply_followup(topic_result, delta)
+            return True
+        self.topic_result = topic_result
+        self.is_travel_related = preferences is not None
+        self.preferences = preferences or {}
+        return True
+
+    def analyze(self):
+        """Kiểm tra chủ đề và trích xuất preferences (nếu liên quan đến du lịch)"""
+        if self._analyze_locally():
+            return
+        started = time.perf_counter()
+        if self.previous_preferences is not None:
+            self._apply_followup(*self.chatbot.analyze_followup(self.user_message, self.previous_preferences,
+                                                                self._timeout('followup')))
+            self._timed('followup', started)
+            return
+        if self.analysis_mode == 'combined':
+            self.topic_result, preferences = self.chatbot.analyze_user_input(self.user_message,
+                                                                             self._timeout('analyze'))
+            self.is_travel_related = preferences is not None
+            self._timed('analyze', started)
+        else:
+            self.topic_result = self.chatbot.check_travel_topic(self.user_message, self._timeout('topic'))
+            self.is_travel_related = not self.chatbot.is_confident_refusal(self.topic_result)
+            self._timed('topic', started)
+            preferences = None
+            if self.is_travel_related:
+                started = time.perf_counter()
+                preferences = self.chatbot.extract_travel_preferences(self.user_message, self._timeout('extract'))
+                self._timed('extract', started)
+        self.preferences = preferences or {}
+
+    async def aanalyze(self):
+        """Như analyze nhưng gọi LLM bất đồng bộ, kiểm tra chủ đề và trích xuất chạy đồng thời"""
+        if self._analyze_locally():
+            return
+        started = time.perf_counter()
+        if self.previous_preferences is not None:
+            self._apply_followup(*await self.chatbot.aanalyze_followup(self.user_message, self.previous_preferences,
+                                                                       self._timeout('followup'), self.llm_calls))
+            self._timed('followup', started)
+            return
+        if self.analysis_mode == 'combined':
+            self.topic_result, preferences = await self.chatbot.aanalyze_user_input(self.user_message,
+                                                                                    self._timeout('analyze'),
+                                                                                    self.llm_calls)
+            self.is_travel_related = preferences is not None
+            self._timed('analyze', started)
+            self.preferences = preferences or {}
+            return
+
+        timeout = self._timeout('analyze')
+        extraction = asyncio.create_task(self.chatbot.aextract_travel_preferences(self.user_message, timeout,
+                                                                                  self.llm_calls))
+        try:
+            self.topic_result = await self.chatbot.acheck_travel_topic(self.user_message, timeout, self.llm_calls)
+        except BaseException:
+            extraction.cancel()
+            raise
+        self._timed('topic', started)
+        self.is_travel_related = not self.chatbot.is_confident_refusal(self.topic_result)
+
+        if self.is_travel_related:
+            self.preferences = await extraction
+            # Tính từ lúc bắt đầu vì trích xuất chạy song song với kiểm tra chủ đề
+            self._timed('extract', started)
+        else:
+            # Bị từ chối chắc chắn: bỏ kết quả trích xuất (hủy nếu chưa xong)
+            self.extraction_cancelled = extraction.cancel()
+            self.preferences = {}
+
+    def recommend(self):
+        """Lấy recommendations từ preferences đã trích xuất"""
+        started = time.perf_counter()
+        self.ranked = self.engine.recommend(self.preferences, top_k=self.top_k, state=self.state,
+                                            rank_by=self.rank_by)
+        self.recommendations = self.ranked.to_dicts()
+        self._timed('recommend', started)
+
+    def generate(self):
+        """Tạo phản hồi: giới thiệu địa điểm hoặc từ chối lịch sự"""
+        started = time.perf_counter()
+        if self.is_travel_related and self.response_mode == 'template':
+            self.response = self.chatbot.render_response(self.user_message, self.recommendations)
+        elif self.is_travel_related:
+            self.response = self.chatbot.compose_response(self.user_message, self.recommendations,
+                                                          self._timeout('generate'))
+        elif self.analyzed_locally:
+            self.response = self.chatbot.local_refusal(self.topic_result)
+        else:
+            self.response = self.chatbot.generate_polite_refusal(self.user_message, self.topic_result,
+                                                                 self._timeout('generate'))
+        self._timed('generate', started)
+
+    async def agenerate(self):
+        """Như generate nhưng gọi LLM bất đồng bộ"""
+        started = time.perf_counter()
+        if self.is_travel_related and self.response_mode == 'template':
+            self.response = self.chatbot.render_response(self.user_message, self.recommendations)
+        elif self.is_travel_related:
+            self.response = await self.chatbot.acompose_response(self.user_message, self.recommendations,
+                                                                 self._timeout('generate'), self.llm_calls)
+        elif self.analyzed_locally:
+            self.response = self.chatbot.local_refusal(self.topic_result)
+        else:
+            self.response = await self.chatbot.agenerate_polite_refusal(self.user_message, self.topic_result,
+                                                                        self._timeout('generate'), self.llm_calls)
+        self._timed('generate', started)
+
+    def run(self, user_message: str) -> 'ChatPipeline':
+        """Chạy toàn bộ pipeline cho một tin nhắn"""
+        self._start(user_message)
+        self.analyze()
+        self._remember()
+        if self.is_travel_related:
+            self.recommend()
+        self.generate()
+        return self
+
+    async def astream(self, user_message: str) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Chạy pipeline và trả về các sự kiện (tên, dữ liệu) ngay khi có:
+        'analysis' (chủ đề, preferences), 'recommendations' (JSON dựng sẵn), rồi 'token' cho từng đoạn phản hồi.
+        Phản hồi đầy đủ được gom vào self.response.
+        """
+        self._start(user_message)
+        await self.aanalyze()
+        self._remember()
+        yield 'analysis', {'is_travel_related': self.is_travel_related, 'preferences': self.preferences}
+
+        if self.is_travel_related:
+            self.recommend()
+            yield 'recommendations', self.recommendations_json
+            if self.response_mode == 'template':
+                tokens = self._single_token(self.chatbot.render_response(self.user_message, self.recommendations))
+            else:
+                tokens = self.chatbot.astream_response(self.user_message, self.recommendations,
+                                                       self._timeout('generate'), self.llm_calls)
+        elif self.analyzed_locally:
+            tokens = self._single_token(self.chatbot.local_refusal(self.topic_result))
+        else:
+            tokens = self.chatbot.astream_polite_refusal(self.user_message, self.topic_result,
+                                                         self._timeout('generate'), self.llm_calls)
+
+        started = time.perf_counter()
+        parts = []
+        async for text in tokens:
+            if not parts:
+                self._timed('first_token', started)
+            parts.append(text)
+            yield 'token', text
+        self.response = ''.join(parts)
+        self._timed('generate', started)
+
+    @staticmethod
+    async def _single_token(text: str) -> AsyncIterator[str]:
+        yield text
+
+    async def arun(self, user_message: str) -> 'ChatPipeline':
+        """Chạy toàn bộ pipeline với client async (không chặn event loop)"""
+        self._start(user_message)
+        await self.aanalyze()
+        self._remember()
+        if self.is_travel_related:
+            self.recommend()
+        await self.agenerate()
+        return self
+
+    def coalesce_key(self, user_message: str) -> Hashable:
+        """
+        Key của các request cho cùng kết quả: tin nhắn đã chuẩn hóa, các tùy chọn của pipeline,
+        phiên bản dataset và preferences của session (câu tiếp nối phụ thuộc lượt trước).
+        Tính trước khi chạy pipeline, không thay đổi trạng thái của pipeline.
+        """
+        previous = self.session_store.get(self.session_id) if self.session_store is not None else None
+        previous = json.dumps(previous, sort_keys=True, ensure_ascii=False) if previous is not None else None
+        return (normalize_message(user_message), self.rank_by, self.top_k, self.analysis_mode,
+                self.response_mode, self.local_first_confidence, self.state.version, previous)
+
+    def adopt(self, leader: 'ChatPipeline'):
+        """Nhận kết quả của pipeline leader (cùng coalesce_key) và lưu preferences cho session của mình"""
+        self.topic_result = dict(leader.topic_result)
+        self.is_travel_related = leader.is_travel_related
+        self.preferences = dict(leader.preferences)
+        self.preference_delta = leader.preference_delta
+        self.ranked = leader.ranked
+        self.recommendations = leader.recommendations
+        self.response = leader.response
+        self.analyzed_locally = leader.analyzed_locally
+        self.extraction_cancelled = leader.extraction_cancelled
+        self._remember()
+
+    @property
+    def recommendations_json(self) -> bytes:
+        """Recommendations dạng JSON ghép từ payload đã serialize sẵn"""
+        return self.ranked.to_json() if self.ranked is not None else b"[]"
+
+
+class ChatSingleFlight:
+    """
+    Single-flight cho ChatPipeline.arun: các request đồng thời cùng coalesce_key chờ một lần chạy pipeline
+    (kiểm tra chủ đề, trích xuất, gợi ý, tạo phản hồi) thay vì mỗi request tự gọi LLM. Mỗi request vẫn giữ
+    pipeline, session_id và bản ghi lịch sử chat của riêng mình. saved_llm_calls đếm số lần gọi LLM tiết kiệm được
+    (theo bộ đếm llm_calls của pipeline leader; lần gọi trích xuất theo lô chỉ tính phần của leader).
+    """
+
+    def __init__(self):
+        self.flight = SingleFlight()
+        self.saved_llm_calls = 0.0
+
+    async def arun(self, pipeline: ChatPipeline, user_message: str) -> ChatPipeline:
+        """Chạy pipeline, hoặc nhận kết quả của pipeline giống hệt đang chạy"""
+        started = time.perf_counter()
+        leader, shared = await self.flight.do(pipeline.coalesce_key(user_message),
+                                              lambda: pipeline.arun(user_message))
+        if shared:
+            # Pipeline của request đi theo không chạy: chỉ khởi tạo để nhận kết quả và lưu session
+            pipeline._start(user_message)
+            pipeline.adopt(leader)
+            pipeline._timed('coalesced', started)
+            self.saved_llm_calls += leader.llm_calls.calls
+        return pipeline
+
+    def stats(self) -> Dict:
+        stats = self.flight.stats()
+        stats['saved_llm_calls'] = round(self.saved_llm_calls, 2)
+        return stats
@@ -1,24 +1,70 @@
 import openai
+import asyncio
+import copy
 import json
 import re
-from typing import Dict, List
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import os
 from dotenv import load_dotenv
 
+from intent_classifier import IntentClassifier
+from llm_cache import LLMResponseCache, prompt_version
+from llm_schemas import JSON_RESPONSE_FORMAT, PromptStats, parse_batch_response, parse_response
+from micro_batch import MicroBatcher
+from resilience import CircuitBreaker, LLMUnavailableError
+from response_templates import TemplateResponder
+from rule_extractor import RuleExtractor
+from session_store import merge_preferences
+
 load_dotenv()
 
-class TravelChatbot:
+def _compact_prompt(text: str) -> str:
+    """Bỏ thụt lề và dòng trống liên tiếp của prompt viết trong code (khoảng trắng thừa cũng tốn token)"""
+    lines = [line.strip() for line in text.strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+class LLMCallCounter:
+    """
+    Số lần gọi LLM của một request, truyền tường minh vào các hàm async của TravelChatbot.
+    Lần gọi trích xuất theo lô (micro-batch) chia đều cho các request trong lô nên calls có thể là số lẻ.
+    """
+
     def __init__(self):
-        # Khởi tạo OpenAI client
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.calls = 0.0
 
-        # Template prompt để kiểm tra chủ đề
-        self.topic_check_prompt = """
-        Bạn là một AI chuyên phân tích chủ đề câu hỏi của người dùng.
-        Hãy xác định xem câu hỏi sau có liên quan đến du lịch Việt Nam hay không.
+    def add(self, calls: float = 1.0):
+        self.calls += calls
 
-        Câu hỏi: "{user_input}"
 
+class TravelChatbot:
+    # Phản hồi khi liên quan đến du lịch nhưng không tìm được địa điểm
+    NO_RECOMMENDATIONS_RESPONSE = "Tôi hiểu yêu cầu của bạn, nhưng hiện tại chưa tìm được địa điểm phù hợp. Bạn có thể cung cấp thêm thông tin cụ thể về thời gian, địa điểm, hoặc điều kiện thời tiết mong muốn không?"
+
+    # Timeout (giây) nhỏ hơn mức này thì không gọi LLM mà dùng fallback ngay
+    MIN_LLM_TIMEOUT = 0.2
+
+    def __init__(self, cache: Optional[LLMResponseCache] = None,
+                 intent_classifier: Optional[IntentClassifier] = None, intent_min_confidence: float = 0.9,
+                 llm_timeout: float = 20.0, llm_max_retries: int = 0, breaker: Optional[CircuitBreaker] = None,
+                 base_url: Optional[str] = None, extraction_batch_size: int = 1,
+                 extraction_batch_window: float = 0.01):
+        # Khởi tạo OpenAI client: sync cho script, async cho web server (không chặn event loop).
+        # llm_timeout là timeout mặc định của mỗi lần gọi (khi caller không truyền timeout riêng);
+        # không retry trong SDK để timeout của từng bước không bị nhân lên.
+        # base_url (mặc định OPENAI_BASE_URL) trỏ sang server tương thích OpenAI khác, ví dụ openai_stub.py
+        self.llm_timeout = llm_timeout
+        base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url, timeout=llm_timeout,
+                                    max_retries=llm_max_retries)
+        self.async_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url,
+                                               timeout=llm_timeout, max_retries=llm_max_retries)
+        # Ngắt mạch: lỗi liên tiếp thì ngừng gọi API một thời gian, các bước dùng fallback
+        self.breaker = breaker or CircuitBreaker()
+
+        # Tiêu chí chủ đề (dùng chung cho prompt kiểm tra chủ đề và các prompt phân tích)
+        self.topic_rules = """
         Các chủ đề ĐƯỢC CHẤP NHẬN (liên quan đến du lịch):
         - Hỏi về địa điểm du lịch, thành phố, tỉnh thành Việt Nam
         - Hỏi về thời tiết, khí hậu cho du lịch
@@ -41,27 +87,10 @@ class TravelChatbot:
         - Mua sắm (trừ khi hỏi về mua sắm du lịch)
         - Người nổi tiếng, hoặc khi hỏi về danh tính của một nhân vật nào đó
         - Các câu hỏi chung chung không rõ ràng
-
-        Trả về JSON với format:
-        {
-            "is_travel_related": true/false,
-            "confidence": 0.0-1.0,
-            "reason": "lý do ngắn gọn"
-        }
-
-        Chỉ trả về JSON, không có text khác.
         """
 
-        # Template prompt để trích xuất thông tin
-        self.extraction_prompt = """
-        Bạn là một AI chuyên phân tích yêu cầu du lịch của người dùng.
-        Hãy phân tích câu hỏi sau và trích xuất thông tin về điều kiện thời tiết mong muốn, vùng miền, địa hình, và thời gian.
-
-        Câu hỏi: "{user_input}"
-
-        QUAN TRỌNG: Hãy chú ý đặc biệt đến THÁNG được đề cập trong câu hỏi.
-
-        Hãy trả về kết quả dưới dạng JSON với các trường sau:
+        # Các trường cần trích xuất và quy tắc (dùng chung cho các prompt trích xuất)
+        self.extraction_rules = """
         - avgtemp_c: nhiệt độ trung bình mong muốn (°C) - số thực từ 15-35
         - maxwind_kph: tốc độ gió tối đa mong muốn (km/h) - số thực từ 5-30
         - totalprecip_mm: lượng mưa mong muốn (mm) - số thực từ 0-30
@@ -135,161 +164,444 @@ class TravelChatbot:
         - "đồng bằng", "bằng phẳng", "đồng ruộng", "nông thôn", "cánh đồng", "thôn quê" -> "đồng bằng"
 
         Ví dụ:
-        - "Tôi muốn đi chơi vào tháng 11" -> {{"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": 11, "region": null, "terrain": null, "preferences": "du lịch tháng 11"}}
-        - "Tôi muốn nơi mát mẻ 20 độ C vào tháng 12" -> {{"avgtemp_c": 20, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 70, "cloud_cover_mean": 40, "month": 12, "region": null, "terrain": null, "preferences": "nơi mát mẻ 20°C tháng 12"}}
-        - "Du lịch biển miền Trung mùa hè" -> {{"avgtemp_c": 28, "maxwind_kph": 20, "totalprecip_mm": 30, "avghumidity": 75, "cloud_cover_mean": 60, "month": null, "region": "Bắc Trung Bộ và Duyên hải miền Trung", "terrain": "ven biển", "preferences": "du lịch biển miền Trung mùa hè"}}
-        - "Tôi thích leo núi ở Tây Nguyên" -> {{"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": null, "region": "Tây Nguyên", "terrain": "miền núi", "preferences": "leo núi Tây Nguyên"}}
-        - "Nơi đồng bằng miền Nam, khô ráo" -> {{"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 55, "cloud_cover_mean": 30, "month": null, "region": "Đồng bằng sông Cửu Long", "terrain": "đồng bằng", "preferences": "đồng bằng miền Nam khô ráo"}}
-        - "Tôi muốn đi biển ở miền Bắc" -> {{"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": null, "region": "Bắc Trung Bộ và Duyên hải miền Trung", "terrain": "ven biển", "preferences": "biển miền Bắc"}}
-        - "Nơi nóng 30 độ, ít mưa, trời quang" -> {{"avgtemp_c": 30, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 60, "cloud_cover_mean": 20, "month": null, "region": null, "terrain": null, "preferences": "nóng 30°C, ít mưa, trời quang"}}
+        - "Tôi muốn đi chơi vào tháng 11" -> {"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": 11, "region": null, "terrain": null, "preferences": "du lịch tháng 11"}
+        - "Tôi muốn nơi mát mẻ 20 độ C vào tháng 12" -> {"avgtemp_c": 20, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 70, "cloud_cover_mean": 40, "month": 12, "region": null, "terrain": null, "preferences": "nơi mát mẻ 20°C tháng 12"}
+        - "Du lịch biển miền Trung mùa hè" -> {"avgtemp_c": 28, "maxwind_kph": 20, "totalprecip_mm": 30, "avghumidity": 75, "cloud_cover_mean": 60, "month": null, "region": "Bắc Trung Bộ và Duyên hải miền Trung", "terrain": "ven biển", "preferences": "du lịch biển miền Trung mùa hè"}
+        - "Tôi thích leo núi ở Tây Nguyên" -> {"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": null, "region": "Tây Nguyên", "terrain": "miền núi", "preferences": "leo núi Tây Nguyên"}
+        - "Nơi đồng bằng miền Nam, khô ráo" -> {"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 55, "cloud_cover_mean": 30, "month": null, "region": "Đồng bằng sông Cửu Long", "terrain": "đồng bằng", "preferences": "đồng bằng miền Nam khô ráo"}
+        - "Tôi muốn đi biển ở miền Bắc" -> {"avgtemp_c": 25, "maxwind_kph": 15, "totalprecip_mm": 20, "avghumidity": 70, "cloud_cover_mean": 50, "month": null, "region": "Bắc Trung Bộ và Duyên hải miền Trung", "terrain": "ven biển", "preferences": "biển miền Bắc"}
+        - "Nơi nóng 30 độ, ít mưa, trời quang" -> {"avgtemp_c": 30, "maxwind_kph": 15, "totalprecip_mm": 10, "avghumidity": 60, "cloud_cover_mean": 20, "month": null, "region": null, "terrain": null, "preferences": "nóng 30°C, ít mưa, trời quang"}
+        """
+
+        # System prompt cố định của từng loại gọi: toàn bộ hướng dẫn tĩnh nằm trong system prompt, tin nhắn user
+        # chỉ gồm phần thay đổi theo request (câu hỏi, yêu cầu trước đó) nên prefix giống hệt nhau giữa các lần gọi
+        # (provider cache được prefix). Các prompt trích xuất mở đầu bằng cùng một khối vai trò + quy tắc.
+        # Câu trả lời ở JSON mode và được kiểm tra bằng schema trong llm_schemas
+        extraction_prefix = """
+        Bạn là một AI chuyên phân tích yêu cầu du lịch Việt Nam của người dùng.
+        Các trường thông tin du lịch và quy tắc trích xuất:
+        """ + self.extraction_rules
+        self.system_prompts = {
+            'topic': _compact_prompt("""
+        Bạn là một AI chuyên phân tích chủ đề câu hỏi của người dùng.
+        Hãy xác định câu hỏi có liên quan đến du lịch Việt Nam hay không.
+        """ + self.topic_rules + """
+        Trả về object JSON: {"is_travel_related": true/false, "confidence": 0.0-1.0, "reason": "lý do ngắn gọn"}
+        """),
+            'extraction': _compact_prompt(extraction_prefix + """
+        Nhiệm vụ: trích xuất các trường trên từ câu hỏi của người dùng.
+        QUAN TRỌNG: Hãy chú ý đặc biệt đến THÁNG được đề cập trong câu hỏi.
+        Trả về object JSON gồm các trường trên.
+        """),
+            'batch_extraction': _compact_prompt(extraction_prefix + """
+        Nhiệm vụ: tin nhắn gồm nhiều câu hỏi độc lập của các người dùng khác nhau, mỗi câu có một số thứ tự (id).
+        Với TỪNG câu hỏi, trích xuất các trường trên.
+        QUAN TRỌNG: Hãy chú ý đặc biệt đến THÁNG của từng câu hỏi, không lấy thông tin của câu này cho câu khác.
+        Trả về object JSON {"results": [...]}, mỗi câu hỏi một phần tử theo thứ tự: object gồm "id" (số thứ tự
+        của câu hỏi) và các trường trên.
+        """),
+            'analysis': _compact_prompt(extraction_prefix + self.topic_rules + """
+        Nhiệm vụ: Hãy làm hai việc: (1) xác định câu hỏi có liên quan đến du lịch Việt Nam hay không,
+        (2) nếu có, trích xuất các trường trên.
+        QUAN TRỌNG: Hãy chú ý đặc biệt đến THÁNG được đề cập trong câu hỏi.
+        Trả về object JSON: {"is_travel_related": true/false, "confidence": 0.0-1.0, "reason": "lý do ngắn gọn",
+        "preferences": object gồm các trường trên nếu liên quan đến du lịch, null nếu không}
+        """),
+            'followup': _compact_prompt(extraction_prefix + self.topic_rules + """
+        Nhiệm vụ: tin nhắn gồm yêu cầu du lịch người dùng đã nêu ở các lượt trước (tổng hợp) và Tin nhắn mới
+        trong cuộc hội thoại nhiều lượt.
+        Hãy làm hai việc: (1) xác định tin nhắn mới có tiếp tục hoặc điều chỉnh yêu cầu du lịch trên không
+        (câu ngắn như "còn tháng 7 thì sao?", "ở miền Bắc thì sao?" vẫn là liên quan đến du lịch),
+        (2) nếu có, CHỈ trích xuất các trường mà tin nhắn mới thay đổi hoặc bổ sung, không lặp lại trường giữ nguyên.
+        Trả về object JSON: {"is_travel_related": true/false, "confidence": 0.0-1.0, "reason": "lý do ngắn gọn",
+        "changes": object chỉ gồm các trường thay đổi ({} nếu không đổi gì), null nếu không liên quan du lịch}
+        """)
+        }
+        # Thống kê token và lỗi parse của từng loại gọi LLM
+        self.prompt_stats = PromptStats()
+
+        # Trích xuất theo lô (client async): các tin nhắn đến trong extraction_batch_window giây, tối đa
+        # extraction_batch_size tin, dùng chung một lần gọi LLM. extraction_batch_size <= 1 để tắt
+        self.extraction_batcher = MicroBatcher(self._aextract_batch, extraction_batch_size, extraction_batch_window) \
+            if extraction_batch_size > 1 else None
+
+        # Luật từ khóa/regex (fallback khi LLM lỗi và phân tích local-first), biên dịch một lần
+        self.rules = RuleExtractor()
+        # Template biên dịch sẵn cho chế độ phản hồi không gọi LLM
+        self.templates = TemplateResponder()
+
+        # Mô hình intent train offline: trả lời kiểm tra chủ đề khi đủ chắc chắn, còn lại mới hỏi LLM
+        self.intent_classifier = intent_classifier
+        self.intent_min_confidence = intent_min_confidence
+
+        # Cache kết quả LLM theo tin nhắn đã chuẩn hóa (None để tắt); key gồm phiên bản prompt
+        # nên sửa prompt/model/temperature sẽ bỏ qua kết quả cũ
+        self.cache = cache
+        self.prompt_versions = {
+            'topic': prompt_version(self._topic_check_request('{user_input}')),
+            'analysis': prompt_version(self._analysis_request('{user_input}')),
+            'extraction': prompt_version(self._extraction_request('{user_input}')),
+            'refusal': prompt_version(self._refusal_request('{user_input}')),
+            'followup': prompt_version(self._followup_request('{user_input}', {}))
+        }
+
+    def _call_timeout(self, timeout: Optional[float]) -> float:
+        """
+        Timeout cho một lần gọi LLM; LLMUnavailableError nếu không còn đủ thời gian
+        """
+        if timeout is not None and timeout < self.MIN_LLM_TIMEOUT:
+            raise LLMUnavailableError(f"latency budget exhausted ({timeout:.3f}s left)")
+        return self.llm_timeout if timeout is None else min(timeout, self.llm_timeout)
+
+    def _complete(self, request: Dict, timeout: Optional[float] = None, kind: Optional[str] = None):
+        """Gọi chat completion (client sync) với timeout và circuit breaker; kind để thống kê token"""
+        timeout = self._call_timeout(timeout)
+        if not self.breaker.allow():
+            raise LLMUnavailableError("circuit breaker open")
+        try:
+            response = self.client.chat.completions.create(**request, timeout=timeout)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        if kind is not None:
+            self.prompt_stats.record_usage(kind, getattr(response, 'usage', None))
+        return response
 
-        Chỉ trả về JSON, không có text khác.
+    async def _acomplete(self, request: Dict, timeout: Optional[float] = None, kind: Optional[str] = None,
+                         counter: Optional[LLMCallCounter] = None):
         """
+        Như _complete nhưng dùng client async; thời gian chờ bị chặn cứng bằng asyncio.wait_for.
+        counter: bộ đếm số lần gọi LLM của request (nếu có)
+        """
+        timeout = self._call_timeout(timeout)
+        if not self.breaker.allow():
+            raise LLMUnavailableError("circuit breaker open")
+        if counter is not None:
+            counter.add()
+        try:
+            response = await asyncio.wait_for(self.async_client.chat.completions.create(**request, timeout=timeout),
+                                              timeout)
+        except asyncio.CancelledError:
+            # Bị hủy (ví dụ trích xuất đầu cơ): không tính là lỗi của upstream
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        if kind is not None:
+            self.prompt_stats.record_usage(kind, getattr(response, 'usage', None))
+        return response
 
-    def check_travel_topic(self, user_input: str) -> Dict:
+    def _json_request(self, kind: str, user_content: str, max_tokens: int) -> Dict:
+        """Tham số gọi LLM trả về JSON: system prompt cố định của kind, JSON mode"""
+        return dict(
+            model="gpt-3.5-turbo-0125",
+            messages=[
+                {"role": "system", "content": self.system_prompts[kind]},
+                {"role": "user", "content": user_content}
+            ],
+            temperature=0.1,  # Giảm temperature để có kết quả ổn định hơn
+            max_tokens=max_tokens,
+            response_format=JSON_RESPONSE_FORMAT
+        )
+
+    def _parse_response(self, kind: str, response) -> Optional[Dict]:
+        """Object JSON của response đã kiểm tra theo schema của kind, None (tính là lỗi parse) nếu không hợp lệ"""
+        result = parse_response(kind, response.choices[0].message.content)
+        self.prompt_stats.record_parse(kind, result is not None)
+        return result
+
+    def prompt_report(self) -> Dict:
+        """Độ dài system prompt cố định và thống kê token, lỗi parse của từng loại gọi LLM"""
+        report = {kind: {'system_chars': len(prompt)} for kind, prompt in self.system_prompts.items()}
+        for kind, stats in self.prompt_stats.stats().items():
+            report.setdefault(kind, {}).update(stats)
+        return report
+
+    def _classify_topic(self, user_input: str) -> Optional[Dict]:
+        """Kết quả kiểm tra chủ đề từ mô hình intent, None nếu không có mô hình hoặc chưa đủ chắc chắn"""
+        if self.intent_classifier is None:
+            return None
+        return self.intent_classifier.classify(user_input, self.intent_min_confidence)
+
+    def _cache_key(self, kind: str, user_input: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.make_key(kind, self.prompt_versions[kind], user_input)
+
+    def _cache_get(self, kind: str, user_input: str):
+        key = self._cache_key(kind, user_input)
+        return self.cache.get(key) if key is not None else None
+
+    async def _acache_get(self, kind: str, user_input: str):
+        key = self._cache_key(kind, user_input)
+        return await self.cache.aget(key) if key is not None else None
+
+    def _cache_set(self, kind: str, user_input: str, value):
+        key = self._cache_key(kind, user_input)
+        if key is not None:
+            self.cache.set(key, kind, value)
+
+    async def _acache_set(self, kind: str, user_input: str, value):
+        key = self._cache_key(kind, user_input)
+        if key is not None:
+            await self.cache.aset(key, kind, value)
+
+    def _topic_check_request(self, user_input: str) -> Dict:
+        """Tham số gọi LLM để kiểm tra chủ đề"""
+        return self._json_request('topic', f'Câu hỏi: "{user_input}"', 200)
+
+    def check_travel_topic(self, user_input: str, timeout: Optional[float] = None) -> Dict:
         """
         Kiểm tra xem câu hỏi có liên quan đến du lịch hay không
         """
+        result = self._classify_topic(user_input) or self._cache_get('topic', user_input)
+        if result is not None:
+            return result
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[
-                    {"role": "system", "content": "Bạn là một AI chuyên phân tích chủ đề câu hỏi."},
-                    {"role": "user", "content": self.topic_check_prompt.format(user_input=user_input)}
-                ],
-                temperature=0.1,
-                max_tokens=200
-            )
-
-            content = response.choices[0].message.content.strip()
-
-            # Trích xuất JSON từ response
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                # Làm sạch JSON string
-                json_str = re.sub(r'\n\s*', ' ', json_str)  # Loại bỏ newline và whitespace thừa
-                json_str = re.sub(r',\s*}', '}', json_str)  # Loại bỏ dấu phay thừa
-                try:
-                    result = json.loads(json_str)
-                    return result
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}, content: {json_str}")
-                    return self._check_travel_topic_fallback(user_input)
-            else:
-                # Fallback: sử dụng regex để kiểm tra
-                return self._check_travel_topic_fallback(user_input)
+            response = self._complete(self._topic_check_request(user_input), timeout, 'topic')
+            result = self._parse_response('topic', response)
+        except Exception as e:
+            print(f"Error in check_travel_topic: {e}")
+        if result is None:
+            # Fallback: sử dụng regex để kiểm tra (không cache)
+            return self._check_travel_topic_fallback(user_input)
+        self._cache_set('topic', user_input, result)
+        return result
 
+    async def acheck_travel_topic(self, user_input: str, timeout: Optional[float] = None,
+                                  counter: Optional[LLMCallCounter] = None) -> Dict:
+        """
+        Như check_travel_topic nhưng dùng client async (không chặn event loop)
+        """
+        result = self._classify_topic(user_input) or await self._acache_get('topic', user_input)
+        if result is not None:
+            return result
+        try:
+            response = await self._acomplete(self._topic_check_request(user_input), timeout, 'topic', counter)
+            result = self._parse_response('topic', response)
         except Exception as e:
             print(f"Error in check_travel_topic: {e}")
-            # Fallback: sử dụng regex để kiểm tra
+        if result is None:
             return self._check_travel_topic_fallback(user_input)
+        await self._acache_set('topic', user_input, result)
+        return result
+
+    def _analysis_request(self, user_input: str) -> Dict:
+        """Tham số gọi LLM phân tích gộp (chủ đề + trích xuất)"""
+        return self._json_request('analysis', f'Câu hỏi: "{user_input}"', 600)
+
+    def _analysis_result(self, result: Optional[Dict], user_input: str) -> Tuple[Dict, Optional[Dict]]:
+        if result is None:
+            # Fallback: regex cho cả chủ đề và preferences (không gọi thêm LLM)
+            topic_result = self._check_travel_topic_fallback(user_input)
+            if self.is_confident_refusal(topic_result):
+                return topic_result, None
+            return topic_result, self._get_default_preferences_with_fallback(user_input)
+
+        preferences = result.pop('preferences', None)
+        if self.is_confident_refusal(result):
+            return result, None
+        if not isinstance(preferences, dict):
+            return result, self._get_default_preferences_with_fallback(user_input)
+        return result, self._complete_preferences(preferences, user_input)
+
+    def analyze_user_input(self, user_input: str,
+                           timeout: Optional[float] = None) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Kiểm tra chủ đề và trích xuất preferences trong một lần gọi LLM.
+        Returns: (topic_result, preferences) - preferences là None nếu câu hỏi bị từ chối
+        """
+        # Mô hình intent đã chắc chắn về chủ đề: chỉ cần trích xuất (hoặc từ chối ngay)
+        topic_result = self._classify_topic(user_input)
+        if topic_result is not None:
+            if self.is_confident_refusal(topic_result):
+                return topic_result, None
+            return topic_result, self.extract_travel_preferences(user_input, timeout)
+
+        result = self._cache_get('analysis', user_input)
+        if result is None:
+            try:
+                response = self._complete(self._analysis_request(user_input), timeout, 'analysis')
+                result = self._parse_response('analysis', response)
+            except Exception as e:
+                print(f"Error in analyze_user_input: {e}")
+            if result is not None:
+                self._cache_set('analysis', user_input, result)
+        return self._analysis_result(result, user_input)
+
+    async def aanalyze_user_input(self, user_input: str, timeout: Optional[float] = None,
+                                  counter: Optional[LLMCallCounter] = None) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Như analyze_user_input nhưng dùng client async
+        """
+        topic_result = self._classify_topic(user_input)
+        if topic_result is not None:
+            if self.is_confident_refusal(topic_result):
+                return topic_result, None
+            return topic_result, await self.aextract_travel_preferences(user_input, timeout, counter)
+
+        result = await self._acache_get('analysis', user_input)
+        if result is None:
+            try:
+                response = await self._acomplete(self._analysis_request(user_input), timeout, 'analysis', counter)
+                result = self._parse_response('analysis', response)
+            except Exception as e:
+                print(f"Error in analyze_user_input: {e}")
+            if result is not None:
+                await self._acache_set('analysis', user_input, result)
+        return self._analysis_result(result, user_input)
+
+    def analyze_locally(self, user_input: str) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Kiểm tra chủ đề và trích xuất preferences chỉ bằng luật (không gọi LLM).
+        Returns: (topic_result, preferences) như analyze_user_input; confidence của câu liên quan đến du lịch
+        tăng theo số trường trích xuất được để caller quyết định có cần hỏi LLM không
+        """
+        topic_result = self.rules.topic(user_input)
+        if not topic_result['is_travel_related']:
+            return topic_result, None
+        extracted = sum(value is not None for value in self.rules.extract(user_input).values())
+        topic_result['confidence'] = round(min(0.99, topic_result['confidence'] + 0.05 * extracted), 2)
+        return topic_result, self._get_default_preferences_with_fallback(user_input)
+
+    def _followup_request(self, user_input: str, previous: Dict) -> Dict:
+        """Tham số gọi LLM phân tích tin nhắn tiếp nối (chủ đề + phần preferences thay đổi)"""
+        previous = json.dumps(previous, ensure_ascii=False)
+        user_content = f'Yêu cầu du lịch trước đó: {previous}\nTin nhắn mới: "{user_input}"'
+        return self._json_request('followup', user_content, 300)
+
+    @staticmethod
+    def _followup_cache_input(user_input: str, previous: Dict) -> str:
+        # Kết quả phụ thuộc cả yêu cầu trước đó nên key cache gồm tin nhắn và preferences đã có
+        return user_input + "\n" + json.dumps(previous, sort_keys=True, ensure_ascii=False)
+
+    def _followup_result(self, result: Optional[Dict], user_input: str) -> Tuple[Dict, Optional[Dict]]:
+        if result is None:
+            return self.analyze_followup_locally(user_input)
+        changes = result.pop('changes', None)
+        if self.is_confident_refusal(result):
+            return result, None
+        delta = {field: value for field, value in changes.items() if value is not None} \
+            if isinstance(changes, dict) else {}
+        # Trường LLM bỏ sót nhưng luật tìm thấy trong tin nhắn mới
+        for field, value in self.rules.extract(user_input).items():
+            if value is not None:
+                delta.setdefault(field, value)
+        return result, delta
 
-    def _check_travel_topic_fallback(self, user_input: str) -> Dict:
+    def analyze_followup(self, user_input: str, previous: Dict,
+                         timeout: Optional[float] = None) -> Tuple[Dict, Optional[Dict]]:
         """
-        Fallback method để kiểm tra chủ đề bằng regex
-        Chỉ chấp nhận câu có từ khóa du lịch rõ ràng
+        Phân tích tin nhắn tiếp nối một hội thoại đã có preferences (một lần gọi LLM, không dùng mô hình intent
+        vì câu tiếp nối ngắn thường chỉ có nghĩa khi biết lượt trước).
+        Returns: (topic_result, delta) - delta chỉ gồm các trường thay đổi, None nếu câu hỏi bị từ chối
         """
-        user_input_lower = user_input.lower().strip()
-
-        # Kiểm tra độ dài câu
-        word_count = len(user_input_lower.split())
-
-        # Từ khóa liên quan đến du lịch - mở rộng và chi tiết hơn
-        travel_keywords = [
-            # Từ khóa du lịch chung (cụ thể hơn)
-            r'du\s*lịch', r'đi\s*chơi', r'nghỉ\s*dưỡng', r'tham\s*quan', r'tour',
-            r'địa\s*điểm\s*du\s*lịch', r'nơi\s*du\s*lịch', r'điểm\s*đến',
-
-            # Địa danh và vùng miền
-            r'thành\s*phố', r'tỉnh', r'vùng', r'khu\s*vực',
-            r'miền\s*bắc', r'miền\s*trung', r'miền\s*nam', r'tây\s*nguyên',
-            r'bắc\s*bộ', r'trung\s*bộ', r'nam\s*bộ',
-
-            # Địa hình và cảnh quan
-            r'biển', r'núi', r'đồng\s*bằng', r'ven\s*biển', r'bãi\s*biển',
-            r'leo\s*núi', r'tắm\s*biển', r'ngắm\s*cảnh', r'phong\s*cảnh',
-
-            # Thời tiết và khí hậu cho du lịch
-            r'thời\s*tiết.*du\s*lịch', r'khí\s*hậu.*du\s*lịch',
-            r'thời\s*tiết.*tháng', r'khí\s*hậu.*tháng',
-            r'mát\s*mẻ', r'nóng.*du\s*lịch', r'lạnh.*du\s*lịch',
-            r'mùa\s*khô', r'mùa\s*mưa', r'mùa\s*xuân', r'mùa\s*hè', r'mùa\s*thu', r'mùa\s*đông',
-
-            # Tên địa danh cụ thể
-            r'hà\s*nội', r'sài\s*gòn', r'tp\s*hồ\s*chí\s*minh', r'đà\s*nẵng',
-            r'huế', r'nha\s*trang', r'hạ\s*long', r'sapa', r'đà\s*lạt',
-            r'phú\s*quốc', r'cần\s*thơ', r'hội\s*an', r'vũng\s*tàu',
-
-            # Hoạt động du lịch
-            r'khách\s*sạn', r'resort', r'homestay', r'lưu\s*trú',
-            r'ăn\s*uống.*du\s*lịch', r'món\s*ngon.*địa\s*phương', r'đặc\s*sản', r'ẩm\s*thực.*du\s*lịch',
-            r'lễ\s*hội', r'văn\s*hóa.*du\s*lịch', r'truyền\s*thống.*du\s*lịch',
-
-            # Từ khóa gợi ý cụ thể về du lịch
-            r'gợi\s*ý.*du\s*lịch', r'gợi\s*ý.*địa\s*điểm', r'khuyên.*du\s*lịch',
-            r'nên\s*đi.*đâu', r'đi\s*đâu.*du\s*lịch', r'ở\s*đâu.*du\s*lịch',
-            r'muốn\s*đi.*biển', r'muốn\s*đi.*núi', r'muốn\s*đi.*du\s*lịch'
-        ]
-
-        # Từ khóa ngắn cần có context (chỉ chấp nhận khi có từ khóa khác)
-        short_keywords = [
-            r'\btháng\b', r'\bmùa\b', r'\bgió\b', r'\bđộ\s*ẩm\b', r'\bnhiệt\s*độ\b',
-            r'\bthời\s*tiết\b', r'\bkhí\s*hậu\b'
-        ]
-
-        # Kiểm tra có từ khóa du lịch chính không
-        has_main_travel_keywords = any(re.search(keyword, user_input_lower) for keyword in travel_keywords)
-
-        # Kiểm tra có từ khóa ngắn không
-        has_short_keywords = any(re.search(keyword, user_input_lower) for keyword in short_keywords)
-
-        # Nếu có từ khóa du lịch chính rõ ràng
-        if has_main_travel_keywords:
+        cache_input = self._followup_cache_input(user_input, previous)
+        result = self._cache_get('followup', cache_input)
+        if result is None:
+            try:
+                response = self._complete(self._followup_request(user_input, previous), timeout, 'followup')
+                result = self._parse_response('followup', response)
+            except Exception as e:
+                print(f"Error in analyze_followup: {e}")
+            if result is not None:
+                self._cache_set('followup', cache_input, result)
+        return self._followup_result(result, user_input)
+
+    async def aanalyze_followup(self, user_input: str, previous: Dict, timeout: Optional[float] = None,
+                                counter: Optional[LLMCallCounter] = None) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Như analyze_followup nhưng dùng client async
+        """
+        cache_input = self._followup_cache_input(user_input, previous)
+        result = await self._acache_get('followup', cache_input)
+        if result is None:
+            try:
+                response = await self._acomplete(self._followup_request(user_input, previous), timeout, 'followup',
+                                                 counter)
+                result = self._parse_response('followup', response)
+            except Exception as e:
+                print(f"Error in analyze_followup: {e}")
+            if result is not None:
+                await self._acache_set('followup', cache_input, result)
+        return self._followup_result(result, user_input)
+
+    def analyze_followup_locally(self, user_input: str) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Như analyze_followup nhưng chỉ bằng luật: tin nhắn có trường preferences nào thì là điều chỉnh yêu cầu
+        du lịch (confidence tăng theo số trường), nếu không thì kiểm tra chủ đề bằng từ khóa
+        """
+        delta = {field: value for field, value in self.rules.extract(user_input).items() if value is not None}
+        if delta:
             return {
                 "is_travel_related": True,
-                "confidence": 0.8,
-                "reason": "Chứa từ khóa du lịch rõ ràng"
-            }
+                "confidence": round(min(0.99, 0.8 + 0.05 * len(delta)), 2),
+                "reason": "Điều chỉnh yêu cầu du lịch trước đó"
+            }, delta
+        topic_result = self.rules.topic(user_input)
+        return topic_result, ({} if topic_result['is_travel_related'] else None)
 
-        # Nếu chỉ có từ khóa ngắn và câu đủ dài (có thể là về du lịch)
-        if has_short_keywords and word_count >= 4:
-            return {
-                "is_travel_related": True,
-                "confidence": 0.6,
-                "reason": "Có từ khóa liên quan, có thể về du lịch"
-            }
+    def apply_preference_delta(self, previous: Dict, delta: Dict) -> Dict:
+        """Preferences của hội thoại sau tin nhắn mới: previous ghi đè bởi delta, đã validate"""
+        return self._validate_preferences(merge_preferences(previous, delta))
 
-        # Nếu câu quá ngắn (dưới 3 từ)
-        if word_count < 3:
-            return {
-                "is_travel_related": False,
-                "confidence": 0.9,
-                "reason": "Câu quá ngắn, cần nói rõ hơn về du lịch"
-            }
+    def local_refusal(self, topic_result: Dict) -> str:
+        """Câu từ chối soạn sẵn (không gọi LLM) cho câu hỏi bị từ chối bằng luật"""
+        return self._get_default_refusal(topic_result.get('reason', ''))
 
-        # Nếu câu dài nhưng không có từ khóa du lịch
-        return {
-            "is_travel_related": False,
-            "confidence": 0.7,
-            "reason": "Không chứa từ khóa du lịch"
-        }
+    def is_confident_refusal(self, topic_result: Dict) -> bool:
+        """Câu hỏi bị từ chối khi không liên quan đến du lịch với confidence cao"""
+        return not topic_result.get('is_travel_related', False) and topic_result.get('confidence', 0) > 0.6
 
-    def generate_polite_refusal(self, user_input: str, topic_result: Dict) -> str:
+    def _check_travel_topic_fallback(self, user_input: str) -> Dict:
+        """
+        Fallback method để kiểm tra chủ đề bằng regex
+        Chỉ chấp nhận câu có từ khóa du lịch rõ ràng
+        """
+        return self.rules.topic(user_input)
+
+    def _refusal_request(self, user_input: str) -> Dict:
+        """Tham số gọi LLM để tạo câu từ chối"""
+        return dict(
+            model="gpt-3.5-turbo-0125",
+            messages=[
+                {"role": "system", "content": "Bạn là trợ lý du lịch Việt Nam. Từ chối lịch sự câu hỏi không liên quan và hướng dẫn về du lịch."},
+                {"role": "user", "content": f"Câu hỏi: '{user_input}' không liên quan du lịch. Hãy từ chối lịch sự và hướng dẫn."}
+            ],
+            temperature=0.7,
+            max_tokens=200
+        )
+
+    def generate_polite_refusal(self, user_input: str, topic_result: Dict,
+                                timeout: Optional[float] = None) -> str:
         """Tạo câu trả lời từ chối lịch sự"""
+        refusal = self._cache_get('refusal', user_input)
+        if refusal is not None:
+            return refusal
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[
-                    {"role": "system", "content": "Bạn là trợ lý du lịch Việt Nam. Từ chối lịch sự câu hỏi không liên quan và hướng dẫn về du lịch."},
-                    {"role": "user", "content": f"Câu hỏi: '{user_input}' không liên quan du lịch. Hãy từ chối lịch sự và hướng dẫn."}
-                ],
-                temperature=0.7,
-                max_tokens=200
-            )
-            return response.choices[0].message.content.strip()
-        except:
+            response = self._complete(self._refusal_request(user_input), timeout, 'refusal')
+            refusal = response.choices[0].message.content.strip()
+        except Exception:
+            return self._get_default_refusal(topic_result.get('reason', ''))
+        self._cache_set('refusal', user_input, refusal)
+        return refusal
+
+    async def agenerate_polite_refusal(self, user_input: str, topic_result: Dict, timeout: Optional[float] = None,
+                                       counter: Optional[LLMCallCounter] = None) -> str:
+        """Như generate_polite_refusal nhưng dùng client async"""
+        refusal = await self._acache_get('refusal', user_input)
+        if refusal is not None:
+            return refusal
+        try:
+            response = await self._acomplete(self._refusal_request(user_input), timeout, 'refusal', counter)
+            refusal = response.choices[0].message.content.strip()
+        except Exception:
             return self._get_default_refusal(topic_result.get('reason', ''))
+        await self._acache_set('refusal', user_input, refusal)
+        return refusal
 
     def _get_default_refusal(self, reason: str = "") -> str:
         """Câu trả lời từ chối mặc định"""
@@ -320,7 +632,7 @@ class TravelChatbot:
         topic_result = self.check_travel_topic(user_input)
 
         # Nếu không liên quan đến du lịch và confidence cao
-        if not topic_result.get('is_travel_related', False) and topic_result.get('confidence', 0) > 0.6:
+        if self.is_confident_refusal(topic_result):
             refusal_response = self.generate_polite_refusal(user_input, topic_result)
             return False, refusal_response
 
@@ -328,64 +640,108 @@ class TravelChatbot:
         preferences = self.extract_travel_preferences(user_input)
         return True, preferences
 
-    def extract_travel_preferences(self, user_input: str) -> Dict:
+    def _extraction_request(self, user_input: str) -> Dict:
+        """Tham số gọi LLM để trích xuất preferences"""
+        return self._json_request('extraction', f'Câu hỏi: "{user_input}"', 500)
+
+    def _batch_extraction_request(self, messages: List[str]) -> Dict:
+        """Tham số gọi LLM để trích xuất preferences của nhiều tin nhắn, id là số thứ tự bắt đầu từ 1"""
+        questions = "\n".join(f'{index}. "{message}"' for index, message in enumerate(messages, 1))
+        return self._json_request('batch_extraction', questions, 300 * len(messages))
+
+    async def _aextract_batch(self, items: List[Tuple[str, Optional[LLMCallCounter]]],
+                              timeout: Optional[float] = None) -> List[Optional[Dict]]:
         """
-        Sử dụng OpenAI để trích xuất thông tin du lịch từ input của user
+        JSON preferences do LLM trích xuất cho từng tin nhắn (tin nhắn, bộ đếm của request) trong lô (một lần gọi),
+        None nếu thiếu; lần gọi được chia đều cho bộ đếm của các request trong lô
         """
+        messages = [message for message, _ in items]
+        batch_counter = LLMCallCounter()
+        # Tin nhắn trùng nhau trong lô chỉ gửi một lần
+        unique = list(dict.fromkeys(messages))
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[
-                    {"role": "system", "content": "Bạn là một AI chuyên phân tích yêu cầu du lịch."},
-                    {"role": "user", "content": self.extraction_prompt.format(user_input=user_input)}
-                ],
-                temperature=0.1,  # Giảm temperature để có kết quả ổn định hơn
-                max_tokens=500
-            )
-
-            # Trích xuất JSON từ response
-            content = response.choices[0].message.content.strip()
-
-            # Tìm JSON trong response
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                # Làm sạch JSON string
-                json_str = re.sub(r'\n\s*', ' ', json_str)  # Loại bỏ newline và whitespace thừa
-                json_str = re.sub(r',\s*}', '}', json_str)  # Loại bỏ dấu phay thừa
-                try:
-                    preferences = json.loads(json_str)
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error in extract_travel_preferences: {e}")
-                    return self._get_default_preferences_with_fallback(user_input)
-
-                # Fallback extractions using unified method
-                fallback_map = {
-                    'month': ('month', None),
-                    'avgtemp_c': ('temperature', (15, 35)),
-                    'maxwind_kph': ('wind', (5, 30)),
-                    'avghumidity': ('humidity', (50, 90)),
-                    'totalprecip_mm': ('precipitation', (0, 30)),
-                    'cloud_cover_mean': ('cloud_cover', (0, 100)),
-                    'region': ('region', None),
-                    'terrain': ('terrain', None)
-                }
-
-                for pref_key, (extract_type, valid_range) in fallback_map.items():
-                    if preferences.get(pref_key) is None or (valid_range and not (valid_range[0] <= preferences.get(pref_key, 0) <= valid_range[1])):
-                        fallback_value = self._extract_fallback(user_input, extract_type)
-                        if fallback_value is not None:
-                            preferences[pref_key] = fallback_value
-
-                # Validate và set default values
-                preferences = self._validate_preferences(preferences)
-                return preferences
+            if len(unique) == 1:
+                response = await self._acomplete(self._extraction_request(unique[0]), timeout, 'extraction',
+                                                 batch_counter)
+                extracted = [self._parse_response('extraction', response)]
             else:
-                return self._get_default_preferences_with_fallback(user_input)
-
-        except Exception as e:
-            print(f"Error in extract_travel_preferences: {e}")
+                response = await self._acomplete(self._batch_extraction_request(unique), timeout, 'batch_extraction',
+                                                 batch_counter)
+                extracted = parse_batch_response(response.choices[0].message.content, len(unique))
+                for preferences in extracted:
+                    self.prompt_stats.record_parse('batch_extraction', preferences is not None)
+        finally:
+            for _, counter in items:
+                if counter is not None:
+                    counter.add(batch_counter.calls / len(items))
+        by_message = dict(zip(unique, extracted))
+        return [copy.deepcopy(by_message[message]) for message in messages]
+
+    def _extraction_result(self, preferences: Optional[Dict], user_input: str) -> Dict:
+        if preferences is None:
             return self._get_default_preferences_with_fallback(user_input)
+        return self._complete_preferences(preferences, user_input)
+
+    def extract_travel_preferences(self, user_input: str, timeout: Optional[float] = None) -> Dict:
+        """
+        Sử dụng OpenAI để trích xuất thông tin du lịch từ input của user
+        """
+        # Cache lưu JSON do LLM trả về; bổ sung bằng regex luôn chạy trên tin nhắn gốc
+        preferences = self._cache_get('extraction', user_input)
+        if preferences is None:
+            try:
+                response = self._complete(self._extraction_request(user_input), timeout, 'extraction')
+                preferences = self._parse_response('extraction', response)
+            except Exception as e:
+                print(f"Error in extract_travel_preferences: {e}")
+            if preferences is not None:
+                self._cache_set('extraction', user_input, preferences)
+        return self._extraction_result(preferences, user_input)
+
+    async def aextract_travel_preferences(self, user_input: str, timeout: Optional[float] = None,
+                                          counter: Optional[LLMCallCounter] = None) -> Dict:
+        """
+        Như extract_travel_preferences nhưng dùng client async
+        """
+        preferences = await self._acache_get('extraction', user_input)
+        if preferences is None:
+            try:
+                if self.extraction_batcher is not None:
+                    # Tin nhắn không có trong kết quả lô (None) dùng fallback bằng luật như khi LLM lỗi
+                    preferences = await self.extraction_batcher.submit((user_input, counter), timeout)
+                else:
+                    response = await self._acomplete(self._extraction_request(user_input), timeout, 'extraction',
+                                                     counter)
+                    preferences = self._parse_response('extraction', response)
+            except Exception as e:
+                print(f"Error in extract_travel_preferences: {e}")
+            if preferences is not None:
+                await self._acache_set('extraction', user_input, preferences)
+        return self._extraction_result(preferences, user_input)
+
+    def _complete_preferences(self, preferences: Dict, user_input: str) -> Dict:
+        """Bổ sung trường thiếu/ngoài khoảng bằng regex rồi validate preferences do LLM trích xuất"""
+        # Fallback extractions: giá trị tìm bằng luật trong một lần quét, dùng khi LLM thiếu hoặc ngoài khoảng
+        fallback_ranges = {
+            'month': None,
+            'avgtemp_c': (15, 35),
+            'maxwind_kph': (5, 30),
+            'avghumidity': (50, 90),
+            'totalprecip_mm': (0, 30),
+            'cloud_cover_mean': (0, 100),
+            'region': None,
+            'terrain': None
+        }
+
+        extracted = self.rules.extract(user_input)
+        for pref_key, valid_range in fallback_ranges.items():
+            if preferences.get(pref_key) is None or (valid_range and not (valid_range[0] <= preferences.get(pref_key, 0) <= valid_range[1])):
+                fallback_value = extracted[pref_key]
+                if fallback_value is not None:
+                    preferences[pref_key] = fallback_value
+
+        # Validate và set default values
+        return self._validate_preferences(preferences)
     
     def _validate_preferences(self, preferences: Dict) -> Dict:
         """Validate và điều chỉnh các giá trị preferences với thuộc tính mới"""
@@ -421,109 +777,6 @@ class TravelChatbot:
 
         return validated
     
-    def _extract_fallback(self, user_input: str, extract_type: str):
-        """Unified fallback method để trích xuất thông tin bằng regex"""
-        user_input_lower = user_input.lower()
-
-        if extract_type == "month":
-            month_patterns = {
-                12: [r'tháng\s*12\b', r'tháng\s*mười\s*hai\b'],
-                11: [r'tháng\s*11\b', r'tháng\s*mười\s*một\b'],
-                10: [r'tháng\s*10\b', r'tháng\s*mười\b(?!\s*(một|hai))'],
-                1: [r'tháng\s*1\b', r'tháng\s*một\b'], 2: [r'tháng\s*2\b', r'tháng\s*hai\b'],
-                3: [r'tháng\s*3\b', r'tháng\s*ba\b'], 4: [r'tháng\s*4\b', r'tháng\s*tư\b'],
-                5: [r'tháng\s*5\b', r'tháng\s*năm\b'], 6: [r'tháng\s*6\b', r'tháng\s*sáu\b'],
-                7: [r'tháng\s*7\b', r'tháng\s*bảy\b'], 8: [r'tháng\s*8\b', r'tháng\s*tám\b'],
-                9: [r'tháng\s*9\b', r'tháng\s*chín\b']
-            }
-            for month, patterns in month_patterns.items():
-                if any(re.search(p, user_input_lower) for p in patterns):
-                    return month
-
-        elif extract_type == "temperature":
-            # Tìm số + đơn vị
-            for pattern in [r'(\d+(?:\.\d+)?)\s*(?:độ|°)\s*c?\b', r'nhiệt\s*độ\s*(\d+(?:\.\d+)?)']:
-                match = re.search(pattern, user_input_lower)
-                if match:
-                    temp = float(match.group(1))
-                    if 15 <= temp <= 35: return temp
-            # Từ khóa
-            if re.search(r'mát\s*mẻ|lạnh', user_input_lower): return 20.0
-            if re.search(r'nóng|ấm\s*áp', user_input_lower): return 30.0
-            if re.search(r'ôn\s*hòa|dễ\s*chịu', user_input_lower): return 25.0
-
-        elif extract_type == "wind":
-            # Tìm số + đơn vị
-            for pattern in [r'(\d+(?:\.\d+)?)\s*km/h\b', r'gió\s*(\d+(?:\.\d+)?)']:
-                match = re.search(pattern, user_input_lower)
-                if match:
-                    wind = float(match.group(1))
-                    if 5 <= wind <= 30: return wind
-            # Từ khóa
-            if re.search(r'không\s*thích\s*gió|ít\s*gió', user_input_lower): return 6.0
-            if re.search(r'gió\s*nhẹ', user_input_lower): return 8.0
-            if re.search(r'gió\s*mạnh', user_input_lower): return 25.0
-
-        elif extract_type == "humidity":
-            # Tìm số + đơn vị
-            for pattern in [r'(\d+(?:\.\d+)?)\s*%\b', r'độ\s*ẩm\s*(\d+(?:\.\d+)?)']:
-                match = re.search(pattern, user_input_lower)
-                if match:
-                    humidity = float(match.group(1))
-                    if 50 <= humidity <= 90: return humidity
-            # Từ khóa
-            if re.search(r'khô\s*ráo|khô', user_input_lower): return 55.0
-            if re.search(r'ẩm\s*ướt|ẩm', user_input_lower): return 80.0
-            if re.search(r'vừa\s*phải', user_input_lower): return 70.0
-
-        elif extract_type == "precipitation":
-            # Tìm số + đơn vị
-            for pattern in [r'(\d+(?:\.\d+)?)\s*mm\b', r'mưa\s*(\d+(?:\.\d+)?)']:
-                match = re.search(pattern, user_input_lower)
-                if match:
-                    precip = float(match.group(1))
-                    if 0 <= precip <= 30: return precip
-            # Từ khóa
-            if re.search(r'không\s*mưa', user_input_lower): return 0.0
-            if re.search(r'ít\s*mưa|khô\s*ráo', user_input_lower): return 10.0
-            if re.search(r'mưa\s*vừa|bình\s*thường', user_input_lower): return 20.0
-            if re.search(r'mưa\s*nhiều|mùa\s*mưa', user_input_lower): return 30.0
-
-        elif extract_type == "cloud_cover":
-            # Tìm số + đơn vị
-            for pattern in [r'(\d+(?:\.\d+)?)\s*%\s*mây', r'mây\s*(\d+(?:\.\d+)?)']:
-                match = re.search(pattern, user_input_lower)
-                if match:
-                    cloud = float(match.group(1))
-                    if 0 <= cloud <= 100: return cloud
-            # Từ khóa
-            if re.search(r'trời\s*quang|ít\s*mây', user_input_lower): return 20.0
-            if re.search(r'nhiều\s*mây|u\s*ám', user_input_lower): return 80.0
-            if re.search(r'mây\s*vừa|bình\s*thường', user_input_lower): return 50.0
-
-        elif extract_type == "region":
-            regions = {
-                "Tây Nguyên": [r'tây\s*nguyên', r'đà\s*lạt'],
-                "Đồng bằng sông Hồng": [r'hà\s*nội', r'hải\s*phòng', r'miền\s*bắc'],
-                "Đồng bằng sông Cửu Long": [r'cần\s*thơ', r'miền\s*nam', r'miền\s*tây'],
-                "Bắc Trung Bộ và Duyên hải miền Trung": [r'miền\s*trung', r'huế', r'đà\s*nẵng', r'nha\s*trang']
-            }
-            for region, patterns in regions.items():
-                if any(re.search(p, user_input_lower) for p in patterns):
-                    return region
-
-        elif extract_type == "terrain":
-            terrains = {
-                "ven biển": [r'biển', r'bãi\s*biển', r'tắm\s*biển'],
-                "miền núi": [r'núi', r'leo\s*núi', r'vùng\s*núi'],
-                "đồng bằng": [r'đồng\s*bằng', r'nông\s*thôn']
-            }
-            for terrain, patterns in terrains.items():
-                if any(re.search(p, user_input_lower) for p in patterns):
-                    return terrain
-
-        return None
-
     def _has_specific_wind_pattern(self, user_input: str) -> bool:
         """Kiểm tra xem có pattern gió cụ thể không"""
         return bool(re.search(r'(không\s*thích\s*gió|ít\s*gió|gió\s*nhẹ|gió\s*mạnh|\d+\s*km/h)', user_input.lower()))
@@ -546,17 +799,8 @@ class TravelChatbot:
         """Trả về preferences mặc định với fallback extractions"""
         preferences = self._get_default_preferences()
 
-        # Extract all using unified method
-        extractions = {
-            'month': self._extract_fallback(user_input, 'month'),
-            'avgtemp_c': self._extract_fallback(user_input, 'temperature'),
-            'maxwind_kph': self._extract_fallback(user_input, 'wind'),
-            'avghumidity': self._extract_fallback(user_input, 'humidity'),
-            'totalprecip_mm': self._extract_fallback(user_input, 'precipitation'),
-            'cloud_cover_mean': self._extract_fallback(user_input, 'cloud_cover'),
-            'region': self._extract_fallback(user_input, 'region'),
-            'terrain': self._extract_fallback(user_input, 'terrain')
-        }
+        # Tất cả trường được trích xuất trong một lần quét
+        extractions = self.rules.extract(user_input)
 
         # Update preferences with extracted values
         for key, value in extractions.items():
@@ -579,65 +823,174 @@ class TravelChatbot:
 
         return preferences
     
-    def generate_response(self, user_input: str, recommendations: List[Dict] = None) -> str:
+    def generate_response(self, user_input: str, recommendations: List[Dict] = None,
+                          analysis: Optional[Tuple[bool, object]] = None) -> str:
         """
-        Tạo response tự nhiên - có thể là gợi ý du lịch hoặc từ chối lịch sự
+        Tạo response tự nhiên - có thể là gợi ý du lịch hoặc từ chối lịch sự.
+        analysis: kết quả process_user_input đã có của tin nhắn này, dùng lại thay vì kiểm tra chủ đề và trích xuất
+        lần nữa; nếu không truyền thì chỉ kiểm tra chủ đề (recommendations đã có nên không trích xuất preferences).
+        Caller đã kiểm tra chủ đề theo cách khác (như ChatPipeline) nên gọi compose_response.
         """
-        # Kiểm tra chủ đề trước
-        is_travel_related, result = self.process_user_input(user_input)
+        if analysis is None:
+            topic_result = self.check_travel_topic(user_input)
+            if self.is_confident_refusal(topic_result):
+                return self.generate_polite_refusal(user_input, topic_result)
+        else:
+            is_travel_related, result = analysis
+            # Nếu không liên quan đến du lịch, trả về câu từ chối
+            if not is_travel_related:
+                return result  # result là câu từ chối
+
+        return self.compose_response(user_input, recommendations)
 
-        # Nếu không liên quan đến du lịch, trả về câu từ chối
-        if not is_travel_related:
-            return result  # result là câu từ chối
+    def _response_request(self, user_input: str, recommendations: List[Dict]) -> Dict:
+        """Tham số gọi LLM để viết phản hồi giới thiệu các địa điểm"""
+        # Tạo context từ recommendations
+        locations_text = ""
+        for i, rec in enumerate(recommendations[:5], 1):
+            locations_text += f"{i}. {rec['city']}, {rec['province']} ({rec['region']}) - Tháng {rec['month']}\n"
+            locations_text += f"   Nhiệt độ: {rec['avgtemp_c']:.1f}°C, Gió: {rec['maxwind_kph']:.1f}km/h, "
+            locations_text += f"Mưa: {rec['totalprecip_mm']:.1f}mm, Độ ẩm: {rec['avghumidity']:.1f}%, "
+            locations_text += f"Mây: {rec['cloud_cover_mean']:.1f}%\n"
+            locations_text += f"   Điểm phù hợp: {rec['score']:.2f}\n\n"
+
+        response_prompt = f"""
+        Dựa trên yêu cầu du lịch: "{user_input}"
+
+        Tôi đã tìm được những địa điểm phù hợp sau:
+
+        {locations_text}
+
+        Hãy viết một phản hồi tự nhiên, thân thiện để giới thiệu những địa điểm này cho người dùng.
+        Phản hồi nên:
+        - Bắt đầu bằng lời chào thân thiện
+        - Giải thích ngắn gọn tại sao những địa điểm này phù hợp
+        - Mô tả đặc điểm thời tiết của từng nơi
+        - Kết thúc bằng lời khuyên hoặc câu hỏi để tiếp tục hỗ trợ
+        - CHỈ tập trung vào du lịch Việt Nam
+        Viết bằng tiếng Việt, tối đa 300 từ.
+        """
 
+        return dict(
+            model="gpt-3.5-turbo-0125",
+            messages=[
+                {"role": "system", "content": "Bạn là một chuyên gia tư vấn du lịch Việt Nam thân thiện. Chỉ trả lời về du lịch trong nước."},
+                {"role": "user", "content": response_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=800
+        )
+
+    def compose_response(self, user_input: str, recommendations: List[Dict] = None,
+                         timeout: Optional[float] = None) -> str:
+        """
+        Viết phản hồi giới thiệu các địa điểm gợi ý (một lần gọi LLM, không kiểm tra lại chủ đề)
+        """
         # Nếu liên quan đến du lịch nhưng không có recommendations, tạo response chung
-        if recommendations is None or len(recommendations) == 0:
-            return "Tôi hiểu yêu cầu của bạn, nhưng hiện tại chưa tìm được địa điểm phù hợp. Bạn có thể cung cấp thêm thông tin cụ thể về thời gian, địa điểm, hoặc điều kiện thời tiết mong muốn không?"
+        if not recommendations:
+            return self.NO_RECOMMENDATIONS_RESPONSE
 
         # Tạo response cho gợi ý du lịch
         try:
-            # Tạo context từ recommendations
-            locations_text = ""
-            for i, rec in enumerate(recommendations[:5], 1):
-                locations_text += f"{i}. {rec['city']}, {rec['province']} ({rec['region']}) - Tháng {rec['month']}\n"
-                locations_text += f"   Nhiệt độ: {rec['avgtemp_c']:.1f}°C, Gió: {rec['maxwind_kph']:.1f}km/h, "
-                locations_text += f"Mưa: {rec['totalprecip_mm']:.1f}mm, Độ ẩm: {rec['avghumidity']:.1f}%, "
-                locations_text += f"Mây: {rec['cloud_cover_mean']:.1f}%\n"
-                locations_text += f"   Điểm phù hợp: {rec['score']:.2f}\n\n"
-
-            response_prompt = f"""
-            Dựa trên yêu cầu du lịch: "{user_input}"
-
-            Tôi đã tìm được những địa điểm phù hợp sau:
-
-            {locations_text}
-
-            Hãy viết một phản hồi tự nhiên, thân thiện để giới thiệu những địa điểm này cho người dùng.
-            Phản hồi nên:
-            - Bắt đầu bằng lời chào thân thiện
-            - Giải thích ngắn gọn tại sao những địa điểm này phù hợp
-            - Mô tả đặc điểm thời tiết của từng nơi
-            - Kết thúc bằng lời khuyên hoặc câu hỏi để tiếp tục hỗ trợ
-            - CHỈ tập trung vào du lịch Việt Nam
-            Viết bằng tiếng Việt, tối đa 300 từ.
-            """
-
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[
-                    {"role": "system", "content": "Bạn là một chuyên gia tư vấn du lịch Việt Nam thân thiện. Chỉ trả lời về du lịch trong nước."},
-                    {"role": "user", "content": response_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=800
-            )
-
+            response = self._complete(self._response_request(user_input, recommendations), timeout, 'response')
             return response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Error in generate_response: {e}")
+            return self._get_default_response(recommendations)
+
+    async def acompose_response(self, user_input: str, recommendations: List[Dict] = None,
+                                timeout: Optional[float] = None, counter: Optional[LLMCallCounter] = None) -> str:
+        """
+        Như compose_response nhưng dùng client async
+        """
+        if not recommendations:
+            return self.NO_RECOMMENDATIONS_RESPONSE
 
+        try:
+            response = await self._acomplete(self._response_request(user_input, recommendations), timeout,
+                                             'response', counter)
+            return response.choices[0].message.content.strip()
         except Exception as e:
             print(f"Error in generate_response: {e}")
             return self._get_default_response(recommendations)
-    
+
+    def render_response(self, user_input: str, recommendations: List[Dict] = None) -> str:
+        """
+        Viết phản hồi giới thiệu các địa điểm bằng template (không gọi LLM)
+        """
+        if not recommendations:
+            return self.NO_RECOMMENDATIONS_RESPONSE
+        return self.templates.render(user_input, recommendations)
+
+    async def _astream_completion(self, request: Dict, fallback: str, caller: str, timeout: Optional[float] = None,
+                                  cache_kind: Optional[str] = None, user_input: str = None,
+                                  counter: Optional[LLMCallCounter] = None) -> AsyncIterator[str]:
+        """
+        Gọi LLM ở chế độ stream và trả về từng đoạn text; nếu lỗi trước khi có text thì trả về fallback.
+        timeout giới hạn cả stream: hết giờ thì dừng ở đoạn text đã có.
+        cache_kind: cache toàn bộ text khi stream kết thúc không lỗi
+        """
+        parts = []
+        try:
+            expires_at = time.monotonic() + self._call_timeout(timeout)
+            stream = await self._acomplete(dict(request, stream=True), timeout, counter=counter)
+        except Exception as e:
+            print(f"Error in {caller}: {e!r}")
+            yield fallback
+            return
+
+        # Luôn đóng stream (kể cả khi hết giờ, lỗi hoặc client ngắt kết nối) để trả kết nối HTTP về pool
+        try:
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, expires_at - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    # Lỗi hoặc hết giờ giữa chừng: giữ phần text đã gửi
+                    self.breaker.record_failure()
+                    print(f"Error in {caller}: {e!r}")
+                    if not parts:
+                        yield fallback
+                    return
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+        if cache_kind is not None and parts:
+            await self._acache_set(cache_kind, user_input, ''.join(parts).strip())
+
+    async def astream_response(self, user_input: str, recommendations: List[Dict] = None,
+                               timeout: Optional[float] = None,
+                               counter: Optional[LLMCallCounter] = None) -> AsyncIterator[str]:
+        """
+        Như acompose_response nhưng trả về phản hồi theo từng token khi LLM sinh ra
+        """
+        if not recommendations:
+            yield self.NO_RECOMMENDATIONS_RESPONSE
+            return
+        async for text in self._astream_completion(self._response_request(user_input, recommendations),
+                                                   self._get_default_response(recommendations),
+                                                   "generate_response", timeout, counter=counter):
+            yield text
+
+    async def astream_polite_refusal(self, user_input: str, topic_result: Dict, timeout: Optional[float] = None,
+                                     counter: Optional[LLMCallCounter] = None) -> AsyncIterator[str]:
+        """
+        Như agenerate_polite_refusal nhưng trả về câu từ chối theo từng token
+        """
+        refusal = await self._acache_get('refusal', user_input)
+        if refusal is not None:
+            yield refusal
+            return
+        async for text in self._astream_completion(self._refusal_request(user_input),
+                                                   self._get_default_refusal(topic_result.get('reason', '')),
+                                                   "generate_polite_refusal", timeout, 'refusal', user_input,
+                                                   counter):
+            yield text
+
     def _get_default_response(self, recommendations: List[Dict]) -> str:
         """Tạo response mặc định khi OpenAI không khả dụng"""
         if not recommendations:
@@ -655,12 +1008,13 @@ class TravelChatbot:
         response += "Bạn có muốn biết thêm thông tin về địa điểm nào không?"
         return response
 
-    def chat(self, user_input: str, recommendations: List[Dict] = None) -> str:
+    def chat(self, user_input: str, recommendations: List[Dict] = None,
+             analysis: Optional[Tuple[bool, object]] = None) -> str:
         """
         Phương thức chính để chat với người dùng
-        Tự động kiểm tra chủ đề và trả về phản hồi phù hợp
+        Tự động kiểm tra chủ đề (hoặc dùng analysis của process_user_input) và trả về phản hồi phù hợp
         """
-        return self.generate_response(user_input, recommendations)
+        return self.generate_response(user_input, recommendations, analysis)
 
 # Main entry point for testing
 if __name__ == "__main__":
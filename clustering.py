@@ -1,162 +1,742 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, List
-from sklearn.metrics.pairwise import euclidean_distances
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional
+from sklearn.neighbors import KDTree
 from sklearn.preprocessing import StandardScaler
 
-class TravelRecommendationEngine:
-    def __init__(self, data_path: str = "df_ranking.csv"):
+import json_codec
+from cache_utils import LRUCache
+from geo_index import GeoGridIndex
+from search_index import LocationSearchIndex
+from snapshot import MANIFEST_FILE, default_snapshot_path, file_sha256, is_snapshot_fresh, load_snapshot
+from trip_planner import TripPlanner, month_sequence
+
+class RecommendationResult:
+    """
+    Kết quả đã xếp hạng: thứ hạng các dòng cùng các trường bổ sung theo từng dòng (ví dụ khoảng cách).
+    Dict và JSON được dựng từ payload của từng dòng đã serialize sẵn khi nạp dữ liệu.
+    """
+
+    __slots__ = ('state', 'ranks', 'extras')
+
+    def __init__(self, state: 'EngineState', ranks, extras: Optional[Dict[str, list]] = None):
+        self.state = state
+        self.ranks = tuple(int(rank) for rank in ranks)
+        self.extras = extras or {}
+
+    def __len__(self) -> int:
+        return len(self.ranks)
+
+    def _extra_fields(self, position: int) -> Dict:
+        return {name: values[position] for name, values in self.extras.items()}
+
+    def to_dicts(self) -> List[Dict]:
+        """Danh sách dict (bản sao, caller có thể sửa)"""
+        row_dicts = self.state._row_dicts
+        results = []
+        for position, rank in enumerate(self.ranks):
+            row = dict(row_dicts[rank])
+            row.update(self._extra_fields(position))
+            results.append(row)
+        return results
+
+    def to_json(self) -> bytes:
+        """Mảng JSON ghép từ các đoạn JSON đã serialize sẵn"""
+        row_json = self.state._row_json
+        if not self.extras:
+            return json_codec.join_array(row_json[rank] for rank in self.ranks)
+        return json_codec.join_array(
+            json_codec.extend_object(row_json[rank], self._extra_fields(position))
+            for position, rank in enumerate(self.ranks)
+        )
+
+
+class EngineState:
+    """
+    Snapshot bất biến của dataset: dữ liệu, scaler, centroids và các index truy vấn.
+    Engine giữ một tham chiếu tới snapshot hiện tại và hoán đổi nguyên tử khi nạp lại,
+    nên request đang chạy luôn hoàn tất trên snapshot nó đã bắt đầu.
+    """
+
+    # Trọng số các features (theo thứ tự features) khi xếp hạng theo độ giống thời tiết
+    SIMILARITY_WEIGHTS = (2.0, 1.0, 0.5, 1.0, 0.5)
+    # Tập ứng viên nhỏ hơn ngưỡng này (sau khi lọc region/terrain) được tính trực tiếp thay vì qua KD-tree
+    SIMILARITY_BRUTE_FORCE_RATIO = 0.25
+    # Kích thước ô lưới (độ) của index địa lý
+    GEO_CELL_DEG = 0.5
+
+    def __init__(self, data_path: str, snapshot_path: str, features: List[str]):
         """
-        Khởi tạo recommendation engine với dataset mới
+        Đọc dataset (snapshot memory-map hoặc CSV), chuẩn hóa và xây dựng các index
         """
-        self.df = pd.read_csv(data_path)
-        self.scaler = StandardScaler()
-        # Cập nhật features với thuộc tính thời tiết mới
-        self.features = ['avgtemp_c', 'maxwind_kph', 'totalprecip_mm', 'avghumidity', 'cloud_cover_mean']
+        started = time.perf_counter()
+        self.features = list(features)
+        if is_snapshot_fresh(snapshot_path, data_path):
+            self.df, self.scaler = load_snapshot(snapshot_path)
+            self.data_source = snapshot_path
+        else:
+            self.df = pd.read_csv(data_path)
+            self.scaler = StandardScaler().fit(self.df[self.features])
+            self.data_source = data_path
+        self._df_scaled = None
 
-        # Chuẩn hóa dữ liệu
-        self.df_scaled = self.df.copy()
-        self.df_scaled[self.features] = self.scaler.fit_transform(self.df[self.features])
+        # Phiên bản dataset: hash nội dung nguồn đã nạp
+        self.version = self._source_digest(self.data_source)
+        self.loaded_at = time.time()
 
         # Lấy centroids (cập nhật tên cột)
         self.centroids = self.df[self.df['is_centroid'] == True].copy()
-        print(f"Loaded {len(self.df)} records with {len(self.centroids)} centroids")
+
+        # Cache ma trận centroid đã chuẩn hóa cho find_best_clusters
+        self._feature_mean = self.scaler.mean_
+        self._feature_scale = self.scaler.scale_
+        self._centroid_matrix = np.ascontiguousarray(
+            self.scaler.transform(self.centroids[self.features]), dtype=np.float64
+        )
+        self._centroid_clusters = self.centroids['cluster'].to_numpy()
+
+        # Xây dựng index truy vấn một lần duy nhất
+        self._build_query_index()
+        self._build_row_payloads()
+        self._build_search_index()
+        self._build_cluster_summaries()
+        self._build_similarity_index()
+        self._build_geo_index()
+        self._build_city_tensor()
+        self._frozen = True
+        print(f"Loaded {len(self.df)} records with {len(self.centroids)} centroids "
+              f"from {self.data_source} in {(time.perf_counter() - started) * 1000:.1f} ms "
+              f"(dataset version {self.version})")
         print(f"Weather features: {self.features}")
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"EngineState is immutable, cannot set '{name}'")
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def _source_digest(path: str) -> str:
+        """Hash ngắn nội dung CSV nguồn (với snapshot thì lấy hash CSV ghi trong manifest)"""
+        if os.path.isdir(path):
+            with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+                manifest = json.load(f)
+            digest = manifest.get('source', {}).get('sha256') or file_sha256(os.path.join(path, MANIFEST_FILE))
+        else:
+            digest = file_sha256(path)
+        return digest[:12]
+
+    @property
+    def df_scaled(self) -> pd.DataFrame:
+        """Dữ liệu với các features đã chuẩn hóa (tạo khi cần lần đầu)"""
+        if self._df_scaled is None:
+            df_scaled = self.df.copy()
+            df_scaled[self.features] = self.scaler.transform(self.df[self.features])
+            object.__setattr__(self, '_df_scaled', df_scaled)
+        return self._df_scaled
+
+    def _build_query_index(self):
+        """
+        Xây dựng index cho get_recommendations: các dòng được sắp xếp sẵn theo hci giảm dần,
+        mỗi giá trị (month, region, terrain, cluster) có một posting list chứa thứ hạng của dòng.
+        Posting list luôn tăng dần nên phép giao vẫn giữ đúng thứ tự hci.
+        """
+        # Thứ tự ổn định theo hci giảm dần (hòa điểm giữ thứ tự gốc)
+        self._hci_order = np.argsort(-self.df['hci'].to_numpy(), kind='stable')
+        self._all_ranks = np.arange(len(self._hci_order))
+
+        # Mã hóa từng cột theo thứ hạng để lọc theo lô bằng phép so sánh ma trận
+        self._postings = {}
+        self._rank_codes = {}
+        self._code_lookup = {}
+        for column in ('month', 'region', 'terrain', 'cluster'):
+            codes, uniques = pd.factorize(self.df[column].to_numpy()[self._hci_order])
+            self._rank_codes[column] = codes
+            self._code_lookup[column] = {value: code for code, value in enumerate(uniques)}
+            self._postings[column] = {
+                value: np.flatnonzero(codes == code) for code, value in enumerate(uniques)
+            }
+
+    def _build_row_payloads(self):
+        """
+        Chuyển từng dòng (theo thứ tự hci) sang dict kết quả và đoạn JSON một lần khi nạp dữ liệu
+        """
+        ranked = self.df.iloc[self._hci_order]
+        columns = {
+            'city': ranked['name'].tolist(), 'province': ranked['province'].tolist(),
+            'region': ranked['region'].tolist(), 'terrain': ranked['terrain'].tolist(),
+            'lat': ranked['lat'].astype(float).tolist(), 'lon': ranked['lon'].astype(float).tolist(),
+            'month': ranked['month'].astype(int).tolist(),
+        }
+        for feature in self.features:
+            columns[feature] = ranked[feature].astype(float).tolist()
+        columns['score'] = ranked['hci'].astype(float).tolist()
+        columns['cluster'] = ranked['cluster'].astype(int).tolist()
+
+        keys = list(columns)
+        self._row_dicts = [dict(zip(keys, values)) for values in zip(*columns.values())]
+        self._row_json = [json_codec.dumps(row) for row in self._row_dicts]
+
+    def _build_search_index(self):
+        """
+        Xây dựng index tìm kiếm địa điểm (bỏ dấu, tiền tố, gần đúng) trên các dòng theo thứ tự hci
+        """
+        ranked = self.df.iloc[self._hci_order]
+        cities = ranked.drop_duplicates('name').sort_values('name', key=lambda names: names.astype(str))
+        self.search_index = LocationSearchIndex(
+            ranked['name'].tolist(),
+            ranked['province'].tolist(),
+            cities=[
+                {'city': row['name'], 'province': row['province'], 'region': row['region'],
+                 'terrain': row['terrain'], 'lat': float(row['lat']), 'lon': float(row['lon'])}
+                for _, row in cities.iterrows()
+            ]
+        )
+
+    def _build_cluster_summaries(self):
+        """
+        Tính tóm tắt các cluster bằng một lần groupby, kèm payload JSON và ETag dựng sẵn
+        """
+        aggregated = self.df.groupby('cluster').agg(
+            total_locations=('cluster', 'size'),
+            avg_temp=('avgtemp_c', 'mean'),
+            avg_wind=('maxwind_kph', 'mean'),
+            avg_precipitation=('totalprecip_mm', 'mean'),
+            avg_humidity=('avghumidity', 'mean'),
+            avg_cloud_cover=('cloud_cover_mean', 'mean'),
+            avg_hci=('hci', 'mean'),  # Chỉ số du lịch
+        )
+        centroids = self.centroids.drop_duplicates('cluster').set_index('cluster')
+
+        self._cluster_summaries = {}
+        for cluster_id, row in aggregated.iterrows():
+            summary = {'cluster_id': int(cluster_id), 'total_locations': int(row['total_locations'])}
+            for column in ('avg_temp', 'avg_wind', 'avg_precipitation', 'avg_humidity',
+                           'avg_cloud_cover', 'avg_hci'):
+                summary[column] = float(row[column])
+            summary['centroid_location'] = {
+                'city': str(centroids.loc[cluster_id, 'name']),
+                'province': str(centroids.loc[cluster_id, 'province'])
+            } if cluster_id in centroids.index else {}
+            self._cluster_summaries[int(cluster_id)] = summary
+
+        # Payload đã serialize (danh sách clusters) và ETag mạnh theo nội dung
+        self.clusters_summary_json = json.dumps(
+            self.get_all_clusters_summary(), ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+        self.clusters_summary_etag = f'"{hashlib.sha256(self.clusters_summary_json).hexdigest()[:32]}"'
+
+    def _build_similarity_index(self):
+        """
+        Xây dựng KD-tree cho từng tháng (và cho toàn bộ dữ liệu) trên không gian features
+        đã chuẩn hóa và nhân trọng số, các dòng theo thứ tự hci
+        """
+        self._similarity_weights = np.sqrt(np.asarray(self.SIMILARITY_WEIGHTS, dtype=np.float64))
+        scaled = (self.df[self.features].to_numpy(dtype=np.float64) - self._feature_mean) / self._feature_scale
+        self._weighted_features = np.ascontiguousarray(scaled[self._hci_order] * self._similarity_weights)
+
+        self._similarity_trees = {None: (KDTree(self._weighted_features), self._all_ranks)}
+        for month, ranks in self._postings['month'].items():
+            self._similarity_trees[month] = (KDTree(self._weighted_features[ranks]), ranks)
+
+    def _build_geo_index(self):
+        """
+        Xây dựng index lưới lat/lon; _geo_point_of_rank[rank] là điểm tọa độ của dòng có thứ hạng rank
+        """
+        ranked = self.df.iloc[self._hci_order]
+        self.geo_index = GeoGridIndex(ranked['lat'].to_numpy(), ranked['lon'].to_numpy(), self.GEO_CELL_DEG)
+        self._geo_point_of_rank = self.geo_index.point_of
+
+    def _build_city_tensor(self):
+        """
+        Dựng lưới dày đặc city x month thành tensor [city, month, feature] (features thời tiết + hci),
+        thông tin thành phố lấy từ dòng của tháng sớm nhất
+        """
+        self.tensor_features = self.features + ['hci']
+        city_codes, city_names = pd.factorize(self.df['name'], sort=True)
+        month_codes = self.df['month'].to_numpy().astype(np.int64) - 1
+
+        self.city_tensor = np.full((len(city_names), 12, len(self.tensor_features)), np.nan)
+        self.city_tensor[city_codes, month_codes] = self.df[self.tensor_features].to_numpy(dtype=np.float64)
+        self.city_tensor.flags.writeable = False
+
+        first_rows = self.df.assign(_city=city_codes).sort_values(['_city', 'month']).drop_duplicates('_city')
+        cities = [
+            {'city': row['name'], 'province': row['province'], 'region': row['region'],
+             'terrain': row['terrain'], 'lat': float(row['lat']), 'lon': float(row['lon'])}
+            for _, row in first_rows.iterrows()
+        ]
+        self.trip_planner = TripPlanner(self.city_tensor, self.tensor_features, cities)
+
+    def _filter_ranks(self, ranks: np.ndarray, column: str, value) -> np.ndarray:
+        """Giao tập thứ hạng hiện tại với posting list của (column, value)"""
+        posting = self._postings[column].get(value)
+        if posting is None:
+            return ranks[:0]
+        if len(ranks) == len(self._all_ranks):
+            return posting
+        return np.intersect1d(ranks, posting, assume_unique=True)
     
     def find_best_cluster(self, preferences: Dict) -> int:
         """
         Tìm cluster có centroid gần nhất với preferences của user
         """
-        # Tạo vector từ preferences với thuộc tính mới
-        user_data = pd.DataFrame({
-            'avgtemp_c': [preferences['avgtemp_c']],
-            'maxwind_kph': [preferences['maxwind_kph']],
-            'totalprecip_mm': [preferences.get('totalprecip_mm', 20.0)],  # Default precipitation
-            'avghumidity': [preferences['avghumidity']],
-            'cloud_cover_mean': [preferences.get('cloud_cover_mean', 50.0)]  # Default cloud cover
-        })
-
-        # Chuẩn hóa user vector
-        user_vector_scaled = self.scaler.transform(user_data)
-
-        # Tính khoảng cách đến các centroids
-        centroid_features = self.centroids[self.features].values
-        centroid_features_scaled = self.scaler.transform(centroid_features)
-
-        distances = euclidean_distances(user_vector_scaled, centroid_features_scaled)[0]
-
-        # Tìm centroid gần nhất
-        closest_centroid_idx = np.argmin(distances)
-        best_cluster = self.centroids.iloc[closest_centroid_idx]['cluster']
-
-        return int(best_cluster)
-
-    def _row_to_dict(self, row) -> Dict:
-        """Convert DataFrame row to recommendation dict"""
-        return {
-            'city': row['name'], 'province': row['province'], 'region': row['region'],
-            'terrain': row['terrain'], 'lat': row['lat'], 'lon': row['lon'],
-            'month': int(row['month']), 'avgtemp_c': float(row['avgtemp_c']),
-            'maxwind_kph': float(row['maxwind_kph']), 'totalprecip_mm': float(row['totalprecip_mm']),
-            'avghumidity': float(row['avghumidity']), 'cloud_cover_mean': float(row['cloud_cover_mean']),
-            'score': float(row['hci']), 'cluster': int(row['cluster'])
-        }
+        return int(self.find_best_clusters([preferences])[0])
+
+    def _scaled_preference_matrix(self, preferences_list: List[Dict]) -> np.ndarray:
+        """Ma trận (n, features) đã chuẩn hóa từ preferences, giá trị mặc định cho mưa và mây"""
+        user_matrix = np.array([
+            [preferences['avgtemp_c'], preferences['maxwind_kph'],
+             preferences.get('totalprecip_mm', 20.0),  # Default precipitation
+             preferences['avghumidity'],
+             preferences.get('cloud_cover_mean', 50.0)]  # Default cloud cover
+            for preferences in preferences_list
+        ], dtype=np.float64).reshape(-1, len(self.features))
 
-    def get_recommendations(self, preferences: Dict, top_k: int = 5) -> List[Dict]:
+        # Chuẩn hóa user vectors bằng tham số của scaler đã cache
+        return (user_matrix - self._feature_mean) / self._feature_scale
+
+    def find_best_clusters(self, preferences_list: List[Dict]) -> np.ndarray:
         """
-        Lấy top K recommendations dựa trên preferences
+        Tìm cluster gần nhất cho nhiều preferences cùng lúc bằng một phép tính ma trận
         """
-        # Bắt đầu với toàn bộ dữ liệu
-        filtered_data = self.df.copy()
+        user_matrix_scaled = self._scaled_preference_matrix(preferences_list)
+
+        # Bình phương khoảng cách Euclid đến các centroids đã chuẩn hóa sẵn (n, số centroid)
+        diff = user_matrix_scaled[:, np.newaxis, :] - self._centroid_matrix[np.newaxis, :, :]
+        distances = np.einsum('ijk,ijk->ij', diff, diff)
 
-        # Lọc theo tháng nếu có
-        if preferences.get('month') is not None:
-            month_data = filtered_data[filtered_data['month'] == preferences['month']]
-            if len(month_data) > 0:
-                filtered_data = month_data
+        # Tìm centroid gần nhất cho từng dòng
+        return self._centroid_clusters[np.argmin(distances, axis=1)]
 
-        # Lọc theo region nếu có
-        if preferences.get('region') is not None:
-            region_data = filtered_data[filtered_data['region'] == preferences['region']]
-            if len(region_data) > 0:
-                filtered_data = region_data
+    def compute_recommendations(self, preferences: Dict, top_k: int) -> RecommendationResult:
+        """
+        Tính top K recommendations dựa trên preferences
+        """
+        # Bắt đầu với toàn bộ dữ liệu (thứ hạng theo hci)
+        ranks = self._all_ranks
 
-        # Lọc theo terrain nếu có
-        if preferences.get('terrain') is not None:
-            terrain_data = filtered_data[filtered_data['terrain'] == preferences['terrain']]
-            if len(terrain_data) > 0:
-                filtered_data = terrain_data
+        # Lọc lần lượt theo tháng, region, terrain nếu có; bỏ qua bộ lọc làm rỗng kết quả
+        for column in ('month', 'region', 'terrain'):
+            if preferences.get(column) is not None:
+                filtered_ranks = self._filter_ranks(ranks, column, preferences[column])
+                if len(filtered_ranks) > 0:
+                    ranks = filtered_ranks
 
         # Nếu sau khi lọc không còn dữ liệu, fallback về cluster
-        if len(filtered_data) == 0:
+        if len(ranks) == 0:
             best_cluster = self.find_best_cluster(preferences)
-            filtered_data = self.df[self.df['cluster'] == best_cluster].copy()
+            ranks = self._postings['cluster'].get(best_cluster, ranks)
         else:
             # Nếu còn dữ liệu, tìm cluster tốt nhất trong dữ liệu đã lọc
-            if len(filtered_data) > top_k * 2:  # Chỉ dùng cluster nếu có đủ dữ liệu
+            if len(ranks) > top_k * 2:  # Chỉ dùng cluster nếu có đủ dữ liệu
                 best_cluster = self.find_best_cluster(preferences)
-                cluster_data = filtered_data[filtered_data['cluster'] == best_cluster]
-                if len(cluster_data) > 0:
-                    filtered_data = cluster_data
+                cluster_ranks = self._filter_ranks(ranks, 'cluster', best_cluster)
+                if len(cluster_ranks) > 0:
+                    ranks = cluster_ranks
 
-        # Sắp xếp theo hci (chỉ số du lịch) giảm dần thay vì score
-        filtered_data = filtered_data.sort_values('hci', ascending=False)
+        # Thứ hạng đã theo hci giảm dần, chỉ cần lấy top K
+        return RecommendationResult(self, ranks[:top_k])
+    
+    def compute_similar_recommendations(self, preferences: Dict, top_k: int) -> RecommendationResult:
+        """
+        Tính top K recommendations xếp theo độ giống thời tiết mong muốn (khoảng cách có trọng số
+        trong không gian đã chuẩn hóa) thay vì theo hci
+        """
+        query = self._scaled_preference_matrix([preferences]) * self._similarity_weights
 
-        # Lấy top K
-        recommendations = filtered_data.head(top_k)
+        # Lọc theo tháng bằng cây của tháng đó; tháng không có dữ liệu thì dùng toàn bộ
+        tree, tree_ranks = self._similarity_trees.get(preferences.get('month'), self._similarity_trees[None])
+
+        # Lọc region, terrain; bỏ qua bộ lọc làm rỗng kết quả
+        ranks = tree_ranks
+        for column in ('region', 'terrain'):
+            if preferences.get(column) is not None:
+                filtered_ranks = np.intersect1d(ranks, self._postings[column].get(preferences[column], ranks[:0]),
+                                                assume_unique=True)
+                if len(filtered_ranks) > 0:
+                    ranks = filtered_ranks
+
+        top_k = min(top_k, len(ranks))
+        if top_k == 0:
+            return RecommendationResult(self, ranks[:0])
+
+        if len(ranks) < len(tree_ranks) * self.SIMILARITY_BRUTE_FORCE_RATIO:
+            # Tập ứng viên nhỏ: tính trực tiếp rồi chọn từng phần (argpartition) thay vì sắp xếp toàn bộ
+            distances = np.sqrt(((self._weighted_features[ranks] - query) ** 2).sum(axis=1))
+            nearest = np.argpartition(distances, top_k - 1)[:top_k]
+            nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+            selected, selected_distances = ranks[nearest], distances[nearest]
+        else:
+            # Hỏi KD-tree với k tăng dần cho đến khi đủ K ứng viên thỏa bộ lọc
+            k = top_k
+            while True:
+                distances, positions = tree.query(query, k=min(k, len(tree_ranks)))
+                candidates = tree_ranks[positions[0]]
+                keep = np.isin(candidates, ranks, assume_unique=True)
+                if keep.sum() >= top_k or k >= len(tree_ranks):
+                    selected = candidates[keep][:top_k]
+                    selected_distances = distances[0][keep][:top_k]
+                    break
+                k *= 4
+
+        return RecommendationResult(self, selected, {'distance': selected_distances.astype(float).tolist()})
+
+    def nearby(self, lat: float, lon: float, radius_km: float, month: Optional[int] = None,
+               top_k: int = 10, sort_by: str = 'hci') -> RecommendationResult:
+        """
+        Các dòng trong bán kính radius_km quanh (lat, lon), lọc theo tháng nếu có,
+        xếp theo hci giảm dần (sort_by='hci') hoặc theo khoảng cách (sort_by='distance')
+        """
+        point_distances = self.geo_index.within(lat, lon, radius_km)
+
+        ranks = self._all_ranks if month is None else self._postings['month'].get(month, self._all_ranks[:0])
+        distances = point_distances[self._geo_point_of_rank[ranks]]
+        inside = np.isfinite(distances)
+        ranks, distances = ranks[inside], distances[inside]
+
+        # ranks đã theo thứ tự hci; sắp theo khoảng cách thì giữ hci làm thứ tự phụ
+        if sort_by == 'distance':
+            order = np.argsort(distances, kind='stable')[:top_k]
+        else:
+            order = np.arange(min(top_k, len(ranks)))
+
+        return RecommendationResult(self, ranks[order],
+                                    {'distance_km': [round(float(distance), 3) for distance in distances[order]]})
+
+    def get_recommendations_batch(self, preferences_list: List[Dict], top_k: int = 5,
+                                  chunk_size: int = 4096) -> List[RecommendationResult]:
+        """
+        Tính top K recommendations cho nhiều preferences cùng lúc (không gọi LLM).
+        Cùng quy tắc lọc với get_recommendations nhưng tính cho cả lô bằng các phép toán ma trận.
+        """
+        results = []
+        for start in range(0, len(preferences_list), chunk_size):
+            chunk = preferences_list[start:start + chunk_size]
+            results.extend(RecommendationResult(self, ranks) for ranks in self._batch_top_ranks(chunk, top_k))
+        return results
+
+    def _query_codes(self, preferences_list: List[Dict], column: str) -> np.ndarray:
+        """Mã của giá trị lọc cho từng query: -1 nếu không lọc, -2 nếu giá trị không tồn tại"""
+        lookup = self._code_lookup[column]
+        return np.array([
+            -1 if preferences.get(column) is None else lookup.get(preferences[column], -2)
+            for preferences in preferences_list
+        ], dtype=np.int64)
+
+    def _batch_top_ranks(self, preferences_list: List[Dict], top_k: int) -> List[np.ndarray]:
+        """Tính thứ hạng (theo hci) của top K kết quả cho từng query trong lô"""
+        n_queries = len(preferences_list)
+        if n_queries == 0:
+            return []
+
+        # Ma trận (query, thứ hạng) đánh dấu các dòng còn được giữ lại
+        mask = np.ones((n_queries, len(self._all_ranks)), dtype=bool)
+
+        # Lọc lần lượt theo tháng, region, terrain; bỏ qua bộ lọc làm rỗng kết quả
+        for column in ('month', 'region', 'terrain'):
+            query_codes = self._query_codes(preferences_list, column)
+            filtered = mask & (self._rank_codes[column][np.newaxis, :] == query_codes[:, np.newaxis])
+            apply = (query_codes != -1) & filtered.any(axis=1)
+            mask = np.where(apply[:, np.newaxis], filtered, mask)
+
+        # Chỉ tìm cluster cho các query cần đến (rỗng hoặc còn nhiều hơn top_k * 2 dòng)
+        counts = mask.sum(axis=1)
+        needs_cluster = (counts == 0) | (counts > top_k * 2)
+        best_clusters = np.full(n_queries, -1, dtype=np.int64)
+        cluster_queries = np.flatnonzero(needs_cluster)
+        if len(cluster_queries) > 0:
+            best_clusters[cluster_queries] = self.find_best_clusters(
+                [preferences_list[i] for i in cluster_queries]
+            )
+        cluster_codes = self._query_codes([{'cluster': c} for c in best_clusters.tolist()], 'cluster')
+        cluster_mask = self._rank_codes['cluster'][np.newaxis, :] == cluster_codes[:, np.newaxis]
+
+        refined = mask & cluster_mask
+        apply = (counts > top_k * 2) & refined.any(axis=1)
+        mask = np.where(apply[:, np.newaxis], refined, mask)
+        mask = np.where((counts == 0)[:, np.newaxis], cluster_mask, mask)
+
+        # Các cột đã theo hci giảm dần: giữ K vị trí True đầu tiên của mỗi dòng
+        mask &= np.cumsum(mask, axis=1) <= top_k
+        _, ranks = np.nonzero(mask)
+        return np.split(ranks, np.cumsum(mask.sum(axis=1))[:-1])
 
-        return [self._row_to_dict(row) for _, row in recommendations.iterrows()]
-    
     def get_cluster_info(self, cluster_id: int) -> Dict:
         """
-        Lấy thông tin về một cluster với thuộc tính mới
-        """
-        cluster_data = self.df[self.df['cluster'] == cluster_id]
-        centroid = self.centroids[self.centroids['cluster'] == cluster_id]
-
-        if len(cluster_data) == 0:
-            return {}
-
-        return {
-            'cluster_id': int(cluster_id),
-            'total_locations': int(len(cluster_data)),
-            'avg_temp': float(cluster_data['avgtemp_c'].mean()),
-            'avg_wind': float(cluster_data['maxwind_kph'].mean()),
-            'avg_precipitation': float(cluster_data['totalprecip_mm'].mean()),
-            'avg_humidity': float(cluster_data['avghumidity'].mean()),
-            'avg_cloud_cover': float(cluster_data['cloud_cover_mean'].mean()),
-            'avg_hci': float(cluster_data['hci'].mean()),  # Chỉ số du lịch
-            'centroid_location': {
-                'city': str(centroid.iloc[0]['name']) if len(centroid) > 0 else 'Unknown',
-                'province': str(centroid.iloc[0]['province']) if len(centroid) > 0 else 'Unknown'
-            } if len(centroid) > 0 else {}
-        }
+        Lấy thông tin về một cluster với thuộc tính mới (đã tính sẵn khi nạp dữ liệu)
+        """
+        info = self._cluster_summaries.get(int(cluster_id))
+        return copy.deepcopy(info) if info else {}
     
-    def search_by_location(self, location_name: str, top_k: int = 5) -> List[Dict]:
+    def search_by_location(self, location_name: str, top_k: int = 5) -> RecommendationResult:
         """
         Tìm kiếm theo tên địa điểm với dataset mới
         """
-        # Tìm kiếm không phân biệt hoa thường
-        location_name = location_name.lower()
+        # Tìm trong name và province (không phân biệt hoa thường và dấu, chấp nhận gõ sai nhẹ);
+        # index trả về thứ hạng theo hci nên chỉ cần lấy K phần tử đầu
+        return RecommendationResult(self, self.search_index.search_rows(location_name)[:top_k])
 
-        # Tìm trong name và province
-        mask = (
-            self.df['name'].str.lower().str.contains(location_name, na=False) |
-            self.df['province'].str.lower().str.contains(location_name, na=False)
-        )
-
-        # Sắp xếp theo hci
-        results = self.df[mask].sort_values('hci', ascending=False).head(top_k)
-
-        return [self._row_to_dict(row) for _, row in results.iterrows()]
+    def autocomplete(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Gợi ý thành phố (không trùng lặp) theo tiền tố cho ô tìm kiếm
+        """
+        return self.search_index.autocomplete(query, limit=limit)
     
     def get_all_clusters_summary(self) -> List[Dict]:
         """
         Lấy tóm tắt về tất cả các clusters
         """
-        clusters = []
-        for cluster_id in sorted(self.df['cluster'].unique()):
-            info = self.get_cluster_info(cluster_id)
-            if info:
-                clusters.append(info)
-        return clusters
+        return [copy.deepcopy(info) for _, info in sorted(self._cluster_summaries.items())]
+
+
+class TravelRecommendationEngine:
+    # Các thuộc tính thời tiết dùng cho phân cụm
+    FEATURES = ['avgtemp_c', 'maxwind_kph', 'totalprecip_mm', 'avghumidity', 'cloud_cover_mean']
+
+    # Bước làm tròn các thuộc tính thời tiết: dùng cho key cache và cho chính phép tính (recommend và
+    # recommend_batch cùng làm tròn) để cùng preferences luôn cho cùng kết quả dù qua /chat hay endpoint lô
+    CACHE_QUANTUM = 0.1
+
+    # Các cách xếp hạng kết quả của get_recommendations
+    RANKING_MODES = ('hci', 'weather')
+    # Các cách sắp xếp kết quả của nearby
+    NEARBY_SORTS = ('hci', 'distance')
+
+    def __init__(self, data_path: str = "df_ranking.csv", cache_size: int = 1024,
+                 cache_ttl: Optional[float] = None, snapshot_path: Optional[str] = None):
+        """
+        Khởi tạo recommendation engine với dataset mới.
+        Nếu có snapshot nhị phân (xem snapshot.py) còn mới thì nạp bằng memory-map, ngược lại đọc CSV.
+        """
+        self.data_path = data_path
+        self.snapshot_path = snapshot_path or default_snapshot_path(data_path)
+        # Cập nhật features với thuộc tính thời tiết mới
+        self.features = list(self.FEATURES)
+
+        # Cache kết quả get_recommendations theo preferences đã lượng tử hóa
+        self._result_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+        self._reload_lock = threading.Lock()
+        self._state = EngineState(self.data_path, self.snapshot_path, self.features)
+
+    @property
+    def state(self) -> EngineState:
+        """Snapshot dataset hiện tại; giữ tham chiếu này để cả request dùng cùng một phiên bản"""
+        return self._state
+
+    @property
+    def version(self) -> str:
+        return self._state.version
+
+    def reload(self, data_path: Optional[str] = None) -> EngineState:
+        """
+        Nạp lại dataset thành snapshot mới rồi hoán đổi nguyên tử và xóa cache kết quả.
+        Hàm chạy đồng bộ (có thể gọi trong thread riêng); các request đang chạy vẫn dùng snapshot cũ.
+        """
+        with self._reload_lock:
+            if data_path is not None:
+                self.data_path = data_path
+                self.snapshot_path = default_snapshot_path(data_path)
+            state = EngineState(self.data_path, self.snapshot_path, self.features)
+            self._state = state
+            self._result_cache.clear()
+            return state
+
+    def source_mtimes(self) -> tuple:
+        """mtime của CSV và manifest snapshot, dùng để phát hiện dataset thay đổi"""
+        mtimes = []
+        for path in (self.data_path, os.path.join(self.snapshot_path, MANIFEST_FILE)):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    # Thuộc tính của snapshot hiện tại (giữ tương thích với code cũ)
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._state.df
+
+    @property
+    def df_scaled(self) -> pd.DataFrame:
+        return self._state.df_scaled
+
+    @property
+    def scaler(self) -> StandardScaler:
+        return self._state.scaler
+
+    @property
+    def centroids(self) -> pd.DataFrame:
+        return self._state.centroids
+
+    @property
+    def search_index(self) -> LocationSearchIndex:
+        return self._state.search_index
+
+    @property
+    def clusters_summary_json(self) -> bytes:
+        return self._state.clusters_summary_json
+
+    @property
+    def clusters_summary_etag(self) -> str:
+        return self._state.clusters_summary_etag
+
+    def find_best_cluster(self, preferences: Dict, state: Optional[EngineState] = None) -> int:
+        """
+        Tìm cluster có centroid gần nhất với preferences của user
+        """
+        return (state or self._state).find_best_cluster(preferences)
+
+    def find_best_clusters(self, preferences_list: List[Dict],
+                           state: Optional[EngineState] = None) -> np.ndarray:
+        """
+        Tìm cluster gần nhất cho nhiều preferences cùng lúc bằng một phép tính ma trận
+        """
+        return (state or self._state).find_best_clusters(preferences_list)
+
+    def _quantize(self, preferences: Dict) -> Dict:
+        """Bản sao preferences với các thuộc tính thời tiết làm tròn theo CACHE_QUANTUM"""
+        quantized = dict(preferences)
+        for feature in self.features:
+            if preferences.get(feature) is not None:
+                quantized[feature] = round(round(float(preferences[feature]) / self.CACHE_QUANTUM)
+                                           * self.CACHE_QUANTUM, 6)
+        return quantized
+
+    def _cache_key(self, quantized: Dict, top_k: int, version: str, rank_by: str) -> tuple:
+        """Key cache: các thuộc tính thời tiết đã làm tròn, cùng month/region/terrain, top_k,
+        cách xếp hạng và phiên bản dataset"""
+        weather = tuple(quantized.get(feature) for feature in self.features)
+        return weather + (quantized.get('month'), quantized.get('region'),
+                          quantized.get('terrain'), top_k, rank_by, version)
+
+    def get_recommendations(self, preferences: Dict, top_k: int = 5,
+                            state: Optional[EngineState] = None, rank_by: str = 'hci') -> List[Dict]:
+        """
+        Lấy top K recommendations dựa trên preferences (có cache LRU/TTL).
+        rank_by: 'hci' (mặc định, xếp theo chỉ số du lịch trong cluster phù hợp) hoặc
+        'weather' (xếp theo độ giống thời tiết mong muốn, kèm trường 'distance')
+        """
+        return self.recommend(preferences, top_k, state, rank_by).to_dicts()
+
+    def recommend(self, preferences: Dict, top_k: int = 5, state: Optional[EngineState] = None,
+                  rank_by: str = 'hci') -> RecommendationResult:
+        """
+        Như get_recommendations nhưng trả về RecommendationResult (dùng to_json() để lấy payload dựng sẵn)
+        """
+        if rank_by not in self.RANKING_MODES:
+            raise ValueError(f"rank_by must be one of {self.RANKING_MODES}")
+        state = state or self._state
+        # Tính trên preferences đã lượng tử hóa để mọi query cùng key có cùng kết quả
+        quantized = self._quantize(preferences)
+        key = self._cache_key(quantized, top_k, state.version, rank_by)
+        cached = self._result_cache.get(key)
+        if cached is None:
+            if rank_by == 'weather':
+                cached = state.compute_similar_recommendations(quantized, top_k)
+            else:
+                cached = state.compute_recommendations(quantized, top_k)
+            self._result_cache.set(key, cached)
+        return cached
+
+    def cache_stats(self) -> Dict:
+        """
+        Thống kê hit/miss/eviction của cache kết quả
+        """
+        return self._result_cache.stats()
+
+    def get_recommendations_batch(self, preferences_list: List[Dict], top_k: int = 5,
+                                  chunk_size: int = 4096,
+                                  state: Optional[EngineState] = None) -> List[List[Dict]]:
+        """
+        Lấy top K recommendations cho nhiều preferences cùng lúc (không gọi LLM)
+        """
+        return [result.to_dicts() for result in self.recommend_batch(preferences_list, top_k, chunk_size, state)]
+
+    def recommend_batch(self, preferences_list: List[Dict], top_k: int = 5, chunk_size: int = 4096,
+                        state: Optional[EngineState] = None) -> List[RecommendationResult]:
+        """
+        Như get_recommendations_batch nhưng trả về RecommendationResult cho từng preferences.
+        Preferences được làm tròn như recommend nên kết quả giống hệt khi gọi recommend từng cái
+        """
+        quantized = [self._quantize(preferences) for preferences in preferences_list]
+        return (state or self._state).get_recommendations_batch(quantized, top_k, chunk_size)
+
+    def get_cluster_info(self, cluster_id: int, state: Optional[EngineState] = None) -> Dict:
+        """
+        Lấy thông tin về một cluster
+        """
+        return (state or self._state).get_cluster_info(cluster_id)
+
+    def search_by_location(self, location_name: str, top_k: int = 5,
+                           state: Optional[EngineState] = None) -> List[Dict]:
+        """
+        Tìm kiếm theo tên địa điểm
+        """
+        return self.search(location_name, top_k, state).to_dicts()
+
+    def search(self, location_name: str, top_k: int = 5,
+               state: Optional[EngineState] = None) -> RecommendationResult:
+        """
+        Như search_by_location nhưng trả về RecommendationResult
+        """
+        return (state or self._state).search_by_location(location_name, top_k)
+
+    def nearby(self, lat: float, lon: float, radius_km: float, month: Optional[int] = None,
+               top_k: int = 10, sort_by: str = 'hci', state: Optional[EngineState] = None) -> List[Dict]:
+        """
+        Tìm các địa điểm trong bán kính radius_km quanh (lat, lon), mỗi kết quả kèm distance_km
+        """
+        return self.find_nearby(lat, lon, radius_km, month, top_k, sort_by, state).to_dicts()
+
+    def find_nearby(self, lat: float, lon: float, radius_km: float, month: Optional[int] = None,
+                    top_k: int = 10, sort_by: str = 'hci',
+                    state: Optional[EngineState] = None) -> RecommendationResult:
+        """
+        Như nearby nhưng trả về RecommendationResult
+        """
+        if not -90.0 <= lat <= 90.0 or not -180.0 <= lon <= 180.0:
+            raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+        if not radius_km > 0:
+            raise ValueError("radius_km must be positive")
+        if sort_by not in self.NEARBY_SORTS:
+            raise ValueError(f"sort_by must be one of {self.NEARBY_SORTS}")
+        return (state or self._state).nearby(lat, lon, radius_km, month, top_k, sort_by)
+
+    def plan_trip(self, start_date: date, end_date: date, cities: Optional[List[str]] = None,
+                  region: Optional[str] = None, terrain: Optional[str] = None,
+                  max_travel_hours: Optional[float] = None, travel_penalty_per_hour: float = 0.0,
+                  state: Optional[EngineState] = None) -> Dict:
+        """
+        Lập lịch trình (city, month) tốt nhất cho khoảng ngày, trong các thành phố ứng viên,
+        với giới hạn thời gian di chuyển giữa hai tháng liên tiếp
+        """
+        if max_travel_hours is not None and max_travel_hours < 0:
+            raise ValueError("max_travel_hours must not be negative")
+        if travel_penalty_per_hour < 0:
+            raise ValueError("travel_penalty_per_hour must not be negative")
+        planner = (state or self._state).trip_planner
+        months = month_sequence(start_date, end_date)
+        mask = planner.candidate_mask(cities, region, terrain)
+        plan = planner.plan(months, mask, max_travel_hours, travel_penalty_per_hour)
+        plan['months'] = months
+        return plan
+
+    def autocomplete(self, query: str, limit: int = 10, state: Optional[EngineState] = None) -> List[Dict]:
+        """
+        Gợi ý thành phố (không trùng lặp) theo tiền tố cho ô tìm kiếm
+        """
+        return (state or self._state).autocomplete(query, limit)
+
+    def get_all_clusters_summary(self, state: Optional[EngineState] = None) -> List[Dict]:
+        """
+        Lấy tóm tắt về tất cả các clusters
+        """
+        return (state or self._state).get_all_clusters_summary()
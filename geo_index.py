@@ -0,0 +1,102 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+# Bán kính trung bình của Trái Đất (km)
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Khoảng cách đường tròn lớn (km) từ một điểm tới nhiều điểm, tính theo vector
+    """
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (np.sin((lat2 - lat1) / 2.0) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_haversine_km(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Ma trận khoảng cách đường tròn lớn (km) giữa mọi cặp điểm
+    """
+    lat, lon = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    a = (np.sin((lat[np.newaxis, :] - lat[:, np.newaxis]) / 2.0) ** 2
+         + np.cos(lat)[:, np.newaxis] * np.cos(lat)[np.newaxis, :]
+         * np.sin((lon[np.newaxis, :] - lon[:, np.newaxis]) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoGridIndex:
+    """
+    Index lưới theo độ (lat/lon) cho truy vấn bán kính.
+
+    Các tọa độ trùng nhau được gộp thành một điểm; mỗi ô lưới chứa danh sách điểm nằm trong ô.
+    Truy vấn chỉ tính haversine cho các điểm trong những ô giao với hình bao của bán kính.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, cell_deg: float = 0.5):
+        """
+        lats, lons: tọa độ của từng phần tử; point_of[i] là chỉ số điểm (tọa độ duy nhất) của phần tử i
+        """
+        self.cell_deg = cell_deg
+        self._lon_cells = int(math.ceil(360.0 / cell_deg))
+        coords = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)])
+        points, self.point_of = np.unique(coords, axis=0, return_inverse=True)
+        self.point_of = self.point_of.reshape(-1)
+        self.lats = np.ascontiguousarray(points[:, 0])
+        self.lons = np.ascontiguousarray(points[:, 1])
+
+        cells = {}
+        for point_id, (lat, lon) in enumerate(points):
+            cells.setdefault(self._cell(lat, lon), []).append(point_id)
+        self._cells = {cell: np.array(ids, dtype=np.int64) for cell, ids in cells.items()}
+        self._all_points = np.arange(len(points))
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_deg)),
+                int(math.floor(lon / self.cell_deg)) % self._lon_cells)
+
+    def _candidate_points(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Các điểm trong những ô lưới giao với hình bao (theo độ) của vòng tròn bán kính"""
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_min, lat_max = lat - lat_delta, lat + lat_delta
+        if lat_min <= -90.0 or lat_max >= 90.0:
+            return self._all_points
+        # Độ rộng kinh độ lớn nhất của vòng tròn ở vĩ độ xa xích đạo nhất trong hình bao
+        cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+        lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)) if cos_lat > 0 else 180.0
+        if lon_delta >= 180.0:
+            return self._all_points
+
+        row_min, row_max = (int(math.floor(lat_min / self.cell_deg)), int(math.floor(lat_max / self.cell_deg)))
+        col_min, col_max = (int(math.floor((lon - lon_delta) / self.cell_deg)),
+                            int(math.floor((lon + lon_delta) / self.cell_deg)))
+        # Bán kính lớn (nhiều ô hơn số ô có dữ liệu): tính trên toàn bộ điểm
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._cells):
+            return self._all_points
+
+        found = []
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                ids = self._cells.get((row, col % self._lon_cells))
+                if ids is not None:
+                    found.append(ids)
+        return np.concatenate(found) if found else self._all_points[:0]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """
+        Khoảng cách (km) tới từng điểm, np.inf với điểm nằm ngoài bán kính (hoặc ngoài các ô ứng viên)
+        """
+        distances = np.full(len(self.lats), np.inf)
+        candidates = self._candidate_points(lat, lon, radius_km)
+        if len(candidates):
+            candidate_distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+            inside = candidate_distances <= radius_km
+            distances[candidates[inside]] = candidate_distances[inside]
+        return distances
@@ -0,0 +1,284 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+ARTIFACT_FORMAT_VERSION = 1
+DEFAULT_MODEL_PATH = "intent_model.json"
+NGRAM_RANGE = (2, 4)
+
+_WHITESPACE = re.compile(r'\s\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa trước khi tách n-gram (dùng chung khi train và khi phân loại)"""
+    return unicodedata.normalize('NFC', str(text)).lower()
+
+
+def char_wb_ngrams(text: str, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> List[str]:
+    """
+    N-gram ký tự trong từng từ (có khoảng trắng hai đầu), giống analyzer='char_wb' của scikit-learn
+    """
+    min_n, max_n = ngram_range
+    ngrams = []
+    for word in _WHITESPACE.sub(' ', text).split():
+        word = ' ' + word + ' '
+        word_len = len(word)
+        for n in range(min_n, max_n + 1):
+            offset = 0
+            ngrams.append(word[offset:offset + n])
+            while offset + n < word_len:
+                offset += 1
+                ngrams.append(word[offset:offset + n])
+            if offset == 0:  # từ ngắn hơn n
+                break
+    return ngrams
+
+
+class IntentClassifier:
+    """
+    Phân loại câu hỏi có liên quan đến du lịch hay không: TF-IDF n-gram ký tự + hồi quy logistic.
+
+    Mô hình được train offline (python intent_classifier.py) và lưu dạng JSON (từ điển n-gram, idf, hệ số);
+    khi chạy chỉ cần tra bảng và tính một tích vô hướng nên không phụ thuộc scikit-learn và mất vài chục µs.
+    """
+
+    def __init__(self, weights: Dict[str, Tuple[float, float]], intercept: float,
+                 ngram_range: Tuple[int, int] = NGRAM_RANGE, metadata: Optional[Dict] = None):
+        """weights: n-gram -> (idf, hệ số của mô hình tuyến tính)"""
+        self.weights = weights
+        self.intercept = intercept
+        self.ngram_range = tuple(ngram_range)
+        self.metadata = metadata or {}
+
+    @classmethod
+    def load(cls, path: str) -> 'IntentClassifier':
+        with open(path, encoding='utf-8') as f:
+            artifact = json.load(f)
+        if artifact.get('format_version') != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported intent model format: {artifact.get('format_version')}")
+        weights = {ngram: (idf, coef) for ngram, idf, coef in artifact['ngrams']}
+        metadata = {key: value for key, value in artifact.items() if key != 'ngrams'}
+        return cls(weights, artifact['intercept'], artifact['ngram_range'], metadata)
+
+    def travel_probability(self, text: str) -> float:
+        """Xác suất câu hỏi liên quan đến du lịch"""
+        counts = Counter(char_wb_ngrams(normalize_text(text), self.ngram_range))
+        score, norm = 0.0, 0.0
+        for ngram, count in counts.items():
+            entry = self.weights.get(ngram)
+            if entry is None:
+                continue
+            # sublinear tf (1 + log tf) nhân idf, chuẩn hóa L2 như TfidfVectorizer
+            value = (1.0 + math.log(count)) * entry[0]
+            score += value * entry[1]
+            norm += value * value
+        if norm > 0:
+            score /= math.sqrt(norm)
+        return 1.0 / (1.0 + math.exp(-(score + self.intercept)))
+
+    def classify(self, text: str, min_confidence: float) -> Optional[Dict]:
+        """
+        Kết quả kiểm tra chủ đề (cùng format với check_travel_topic) nếu mô hình đủ chắc chắn, None nếu không
+        """
+        probability = self.travel_probability(text)
+        confidence = max(probability, 1.0 - probability)
+        if confidence < min_confidence:
+            return None
+        return {
+            "is_travel_related": probability >= 0.5,
+            "confidence": round(confidence, 3),
+            "reason": "Phân loại bằng mô hình intent"
+        }
+
+
+def load_training_data(session_factory) -> Tuple[List[str], List[int]]:
+    """
+    Tin nhắn và nhãn (1: du lịch, 0: không) từ lịch sử chat: câu bị từ chối được lưu với
+    extracted_features {"preferences": "non_travel_query"}; tin nhắn trùng lấy nhãn xuất hiện nhiều nhất
+    """
+    from models import ChatHistory
+
+    votes = {}
+    with session_factory() as db:
+        for message, features in db.query(ChatHistory.user_message, ChatHistory.extracted_features):
+            try:
+                features = json.loads(features) if features else None
+            except ValueError:
+                continue
+            if not isinstance(features, dict) or not message or not message.strip():
+                continue
+            label = 0 if features.get('preferences') == 'non_travel_query' else 1
+            votes.setdefault(normalize_text(message).strip(), Counter())[label] += 1
+    messages = list(votes)
+    return messages, [votes[message].most_common(1)[0][0] for message in messages]
+
+
+def fit_pipeline(messages: Sequence[str], labels: Sequence[int], C: float = 10.0):
+    """TF-IDF n-gram ký tự + LogisticRegression (cân bằng lớp vì câu bị từ chối ít hơn nhiều)"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    pipeline = make_pipeline(
+        TfidfVectorizer(analyzer='char_wb', ngram_range=NGRAM_RANGE, lowercase=False, sublinear_tf=True),
+        LogisticRegression(C=C, class_weight='balanced', max_iter=1000)
+    )
+    return pipeline.fit([normalize_text(message) for message in messages], labels)
+
+
+def export_classifier(pipeline, metadata: Dict) -> IntentClassifier:
+    """Chuyển pipeline scikit-learn đã fit thành IntentClassifier (chỉ giữ n-gram có hệ số khác 0)"""
+    vectorizer, model = pipeline.steps[0][1], pipeline.steps[-1][1]
+    coef = model.coef_[0]
+    weights = {ngram: (float(vectorizer.idf_[index]), float(coef[index]))
+               for ngram, index in vectorizer.vocabulary_.items() if coef[index] != 0}
+    return IntentClassifier(weights, float(model.intercept_[0]), NGRAM_RANGE, metadata)
+
+
+def save_classifier(classifier: IntentClassifier, path: str):
+    artifact = dict(classifier.metadata)
+    artifact.update({
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'ngram_range': list(classifier.ngram_range),
+        'intercept': classifier.intercept,
+        'ngrams': [[ngram, idf, coef] for ngram, (idf, coef) in sorted(classifier.weights.items())]
+    })
+    # Ghi qua file tạm để app không đọc phải file ghi dở
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def _latency_us(predict, messages: Sequence[str], repeat: int = 20) -> Dict:
+    """Độ trễ mỗi tin nhắn (µs): p50, p99"""
+    samples = []
+    for _ in range(repeat):
+        for message in messages:
+            started = time.perf_counter()
+            predict(message)
+            samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {'p50_us': round(samples[len(samples) // 2], 1), 'p99_us': round(samples[int(len(samples) * 0.99)], 1)}
+
+
+def evaluate(messages: List[str], labels: List[int], min_confidence: float, folds: int = 5,
+             llm_topic_check=None) -> Dict:
+    """
+    So sánh độ chính xác và độ trễ bằng cross-validation (phân tầng theo nhãn):
+    - classifier: mọi tin nhắn, và riêng những tin nhắn đủ chắc chắn (không cần gọi LLM)
+    - rules: kiểm tra chủ đề bằng từ khóa (fallback hiện có)
+    - llm (tùy chọn): check_travel_topic thật trên cùng tập tin nhắn
+    """
+    from sklearn.model_selection import StratifiedKFold
+    from rule_extractor import RuleExtractor
+
+    folds = max(2, min(folds, min(Counter(labels).values())))
+    correct = confident = confident_correct = 0
+    classifiers = []
+    for train, test in StratifiedKFold(n_splits=folds, shuffle=True, random_state=0).split(messages, labels):
+        classifier = export_classifier(fit_pipeline([messages[i] for i in train], [labels[i] for i in train]), {})
+        classifiers.append(classifier)
+        for i in test:
+            probability = classifier.travel_probability(messages[i])
+            correct += (probability >= 0.5) == bool(labels[i])
+            if max(probability, 1.0 - probability) >= min_confidence:
+                confident += 1
+                confident_correct += (probability >= 0.5) == bool(labels[i])
+
+    rules = RuleExtractor(cache_size=0)
+    rule_correct = sum(rules.topic(message)['is_travel_related'] == bool(label)
+                       for message, label in zip(messages, labels))
+
+    report = {
+        'samples': len(messages),
+        'travel': sum(labels),
+        'non_travel': len(labels) - sum(labels),
+        'folds': folds,
+        'min_confidence': min_confidence,
+        'classifier': {
+            'accuracy': round(correct / len(messages), 4),
+            'coverage': round(confident / len(messages), 4),
+            'confident_accuracy': round(confident_correct / confident, 4) if confident else None,
+            **_latency_us(classifiers[-1].travel_probability, messages)
+        },
+        'rules': {
+            'accuracy': round(rule_correct / len(messages), 4),
+            **_latency_us(rules.topic, messages)
+        }
+    }
+    if llm_topic_check is not None:
+        llm_correct, samples = 0, []
+        for message, label in zip(messages, labels):
+            started = time.perf_counter()
+            result = llm_topic_check(message)
+            samples.append((time.perf_counter() - started) * 1e6)
+            llm_correct += bool(result.get('is_travel_related')) == bool(label)
+        samples.sort()
+        report['llm'] = {'accuracy': round(llm_correct / len(messages), 4),
+                         'p50_us': round(samples[len(samples) // 2], 1),
+                         'p99_us': round(samples[int(len(samples) * 0.99)], 1)}
+    return report
+
+
+def print_report(report: Dict):
+    print(f"Samples: {report['samples']} ({report['travel']} travel, {report['non_travel']} non-travel), "
+          f"{report['folds']}-fold cross-validation, min confidence {report['min_confidence']}")
+    print(f"{'method':<12}{'accuracy':>10}{'coverage':>10}{'p50 µs':>12}{'p99 µs':>12}")
+    classifier = report['classifier']
+    print(f"{'classifier':<12}{classifier['accuracy']:>10.3f}{classifier['coverage']:>10.3f}"
+          f"{classifier['p50_us']:>12.1f}{classifier['p99_us']:>12.1f}")
+    if classifier['confident_accuracy'] is not None:
+        print(f"{'  confident':<12}{classifier['confident_accuracy']:>10.3f}")
+    for name in ('rules', 'llm'):
+        if name in report:
+            row = report[name]
+            print(f"{name:<12}{row['accuracy']:>10.3f}{1.0:>10.3f}{row['p50_us']:>12.1f}{row['p99_us']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the travel intent classifier from chat history")
+    parser.add_argument("--db", default=None, help="database URL (default: the app database)")
+    parser.add_argument("--out", default=DEFAULT_MODEL_PATH, help="model artifact path")
+    parser.add_argument("--min-confidence", type=float, default=0.9,
+                        help="confidence above which the classifier answers without the LLM (for the report)")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    parser.add_argument("--compare-llm", action="store_true",
+                        help="also run the LLM topic check on every sample (needs OPENAI_API_KEY)")
+    args = parser.parse_args()
+
+    if args.db:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        session_factory = sessionmaker(bind=create_engine(args.db))
+    else:
+        from models import SessionLocal as session_factory
+
+    messages, labels = load_training_data(session_factory)
+    if len(set(labels)) < 2:
+        raise SystemExit("Chat history needs both travel and non-travel messages to train the classifier")
+
+    llm_topic_check = None
+    if args.compare_llm:
+        from chatbot import TravelChatbot
+        llm_topic_check = TravelChatbot().check_travel_topic
+
+    started = time.perf_counter()
+    report = evaluate(messages, labels, args.min_confidence, args.folds, llm_topic_check)
+    classifier = export_classifier(fit_pipeline(messages, labels), {
+        'created_at': time.time(),
+        'report': report
+    })
+    save_classifier(classifier, args.out)
+    print_report(report)
+    print(f"Wrote intent model {args.out}: {len(classifier.weights)} n-grams "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
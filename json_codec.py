@@ -0,0 +1,37 @@
+import json
+from typing import Any, Dict, Iterable
+
+try:
+    import orjson
+except ImportError:  # orjson không bắt buộc, dùng json chuẩn nếu chưa cài
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize sang JSON (UTF-8, không khoảng trắng), dùng orjson nếu có"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def join_array(fragments: Iterable[bytes]) -> bytes:
+    """Ghép các đoạn JSON đã serialize thành một mảng JSON"""
+    return b'[' + b','.join(fragments) + b']'
+
+
+def extend_object(fragment: bytes, fields: Dict[str, Any]) -> bytes:
+    """Thêm các trường vào cuối một object JSON đã serialize"""
+    if not fields:
+        return fragment
+    extra = dumps(fields)
+    return fragment[:-1] + (b',' if len(fragment) > 2 else b'') + extra[1:]
+
+
+def splice_object(obj: Dict[str, Any], raw_fields: Dict[str, bytes]) -> bytes:
+    """Serialize obj rồi ghép thêm các trường có giá trị là JSON đã serialize sẵn"""
+    payload = dumps(obj)
+    parts = [payload[:-1]]
+    for name, raw in raw_fields.items():
+        parts.append((b',' if len(parts) > 1 or len(payload) > 2 else b'') + dumps(name) + b':' + raw)
+    parts.append(b'}')
+    return b''.join(parts)
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from cache_utils import LRUCache
+from models import LLMCacheEntry, SessionLocal
+from search_index import fold_diacritics
+
+# Ký tự bị bỏ ở đầu/cuối tin nhắn khi chuẩn hóa ("đi biển tháng 6 ở đâu?" == "đi biển tháng 6 ở đâu")
+_EDGE_PUNCTUATION = ' \t\n?!.,;:…"\'()'
+
+
+def normalize_message(text: str, fold_accents: bool = False) -> str:
+    """
+    Chuẩn hóa tin nhắn làm key cache: chữ thường (casefold), gộp khoảng trắng, bỏ dấu câu ở hai đầu;
+    fold_accents=True thì bỏ luôn dấu tiếng Việt
+    """
+    if fold_accents:
+        return fold_diacritics(text)
+    text = re.sub(r'\s+', ' ', unicodedata.normalize('NFC', str(text)).casefold())
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+def prompt_version(request: Dict) -> str:
+    """Phiên bản prompt: hash của tham số gọi LLM (model, prompt, temperature...) dựng với placeholder"""
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class LLMResponseCache:
+    """
+    Cache kết quả gọi LLM theo tin nhắn đã chuẩn hóa, hai tầng:
+    - LRU trong process (nhanh, mất khi khởi động lại)
+    - bảng SQLite llm_cache (giữ lại qua các lần khởi động, giới hạn persistent_maxsize dòng)
+
+    Key gồm loại gọi (topic, extraction...), phiên bản prompt và tin nhắn đã chuẩn hóa nên sửa prompt
+    sẽ tự bỏ qua các kết quả cũ. Giá trị lưu dạng JSON, mỗi lần get trả về bản sao mới.
+    Lỗi database chỉ được log, không làm hỏng request.
+    """
+
+    # Số lần ghi giữa hai lần dọn bảng SQLite (xóa dòng hết hạn và dòng cũ nhất vượt giới hạn)
+    PRUNE_EVERY = 100
+
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = 7 * 24 * 3600,
+                 persistent_maxsize: int = 20000, fold_accents: bool = False, session_factory=SessionLocal):
+        self.ttl = ttl
+        self.persistent_maxsize = persistent_maxsize
+        self.fold_accents = fold_accents
+        self.session_factory = session_factory
+        # key -> (thời điểm hết hạn theo wall clock hoặc None, JSON string)
+        self._memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.persistent_hits = 0
+        self.persistent_errors = 0
+
+    def make_key(self, kind: str, version: str, message: str) -> str:
+        normalized = normalize_message(message, self.fold_accents)
+        return hashlib.sha256(f"{kind}\x00{version}\x00{normalized}".encode('utf-8')).hexdigest()
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._memory.pop(key)
+            return None
+        return value
+
+    def get(self, key: str) -> Any:
+        """Kết quả đã cache (LRU trước, rồi SQLite), None nếu không có hoặc đã hết hạn"""
+        value = self._memory_get(key)
+        if value is None:
+            value = self._persistent_get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, kind: str, value: Any):
+        """Lưu kết quả vào cả hai tầng"""
+        payload = self._memory_set(key, value)
+        self._persistent_set(key, kind, payload)
+
+    async def aget(self, key: str) -> Any:
+        """Như get nhưng truy vấn SQLite ngoài event loop"""
+        value = self._memory_get(key)
+        if value is None:
+            value = await asyncio.get_running_loop().run_in_executor(None, self._persistent_get, key)
+        return json.loads(value) if value is not None else None
+
+    async def aset(self, key: str, kind: str, value: Any):
+        """Như set nhưng ghi SQLite ngoài event loop"""
+        payload = self._memory_set(key, value)
+        await asyncio.get_running_loop().run_in_executor(None, self._persistent_set, key, kind, payload)
+
+    def _memory_set(self, key: str, value: Any) -> str:
+        payload = json.dumps(value, ensure_ascii=False)
+        self._memory.set(key, (time.time() + self.ttl if self.ttl else None, payload))
+        return payload
+
+    def _persistent_get(self, key: str) -> Optional[str]:
+        try:
+            with self.session_factory() as db:
+                entry = db.get(LLMCacheEntry, key)
+                if entry is None or (entry.expires_at is not None and entry.expires_at <= datetime.utcnow()):
+                    return None
+                expires_at, value = entry.expires_at, entry.value
+        except Exception as e:
+            self.persistent_errors += 1
+            print(f"LLM cache read error: {e}")
+            return None
+
+        self.persistent_hits += 1
+        # Đưa lên tầng LRU, giữ nguyên thời điểm hết hạn
+        remaining = (expires_at - datetime.utcnow()).total_seconds() if expires_at is not None else None
+        self._memory.set(key, (time.time() + remaining if remaining is not None else None, value))
+        return value
+
+    def _persistent_set(self, key: str, kind: str, payload: str):
+        if self.persistent_maxsize <= 0:
+            return
+        now = datetime.utcnow()
+        try:
+            with self.session_factory() as db:
+                db.merge(LLMCacheEntry(key=key, kind=kind, value=payload, created_at=now,
+                                       expires_at=now + timedelta(seconds=self.ttl) if self.ttl else None))
+                db.commit()
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % self.PRUNE_EVERY == 0
+                if prune:
+                    self._prune(db, now)
+        except Exception as e:
+            self.persistent_errors += 1
+            print(f"LLM cache write error: {e}")
+
+    def _prune(self, db, now: datetime):
+        """Xóa dòng hết hạn và các dòng cũ nhất vượt quá persistent_maxsize"""
+        db.query(LLMCacheEntry).filter(LLMCacheEntry.expires_at <= now).delete(synchronize_session=False)
+        excess = db.query(LLMCacheEntry).count() - self.persistent_maxsize
+        if excess > 0:
+            oldest = db.query(LLMCacheEntry.key).order_by(LLMCacheEntry.created_at).limit(excess)
+            db.query(LLMCacheEntry).filter(LLMCacheEntry.key.in_(oldest.scalar_subquery())) \
+                .delete(synchronize_session=False)
+        db.commit()
+
+    def clear(self):
+        """Xóa cả hai tầng"""
+        self._memory.clear()
+        try:
+            with self.session_factory() as db:
+                db.query(LLMCacheEntry).delete(synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            self.persistent_errors += 1
+            print(f"LLM cache clear error: {e}")
+
+    def stats(self) -> Dict:
+        """Thống kê tầng LRU cùng số hit/lỗi của tầng SQLite"""
+        stats = self._memory.stats()
+        stats.update({
+            'persistent_maxsize': self.persistent_maxsize,
+            'persistent_hits': self.persistent_hits,
+            'persistent_errors': self.persistent_errors,
+            'fold_accents': self.fold_accents
+        })
+        return stats
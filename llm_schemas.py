@@ -0,0 +1,129 @@
+import json
+from typing import Dict, List, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+
+class TravelPreferences(BaseModel):
+    """Preferences do LLM trích xuất; khoảng giá trị và trường thiếu được bổ sung sau bằng luật"""
+    model_config = ConfigDict(extra='ignore')
+
+    avgtemp_c: Optional[float] = None
+    maxwind_kph: Optional[float] = None
+    totalprecip_mm: Optional[float] = None
+    avghumidity: Optional[float] = None
+    cloud_cover_mean: Optional[float] = None
+    month: Optional[int] = None
+    region: Optional[str] = None
+    terrain: Optional[str] = None
+    preferences: Optional[str] = None
+
+
+class TopicCheck(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+    is_travel_related: bool
+    confidence: float
+    reason: str = ""
+
+
+class Analysis(TopicCheck):
+    preferences: Optional[TravelPreferences] = None
+
+
+class Followup(TopicCheck):
+    # Chỉ các trường thay đổi so với yêu cầu trước
+    changes: Optional[TravelPreferences] = None
+
+
+class BatchItem(TravelPreferences):
+    id: int
+
+
+# Schema của object JSON trả về theo loại gọi LLM
+SCHEMAS: Dict[str, Type[BaseModel]] = {
+    'topic': TopicCheck,
+    'extraction': TravelPreferences,
+    'analysis': Analysis,
+    'followup': Followup,
+}
+
+# Tham số response_format: yêu cầu LLM chỉ trả về một object JSON (JSON mode)
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+def _validate(schema: Type[BaseModel], value) -> Optional[Dict]:
+    """value đã kiểm tra theo schema (chỉ gồm các trường LLM trả về), None nếu sai schema"""
+    try:
+        return schema.model_validate(value).model_dump(exclude_unset=True)
+    except ValidationError as e:
+        print(f"Schema validation error ({schema.__name__}): {e.error_count()} errors, value: {value}")
+        return None
+
+
+def _load(content: str):
+    try:
+        return json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"JSON decode error: {e}, content: {content}")
+        return None
+
+
+def parse_response(kind: str, content: str) -> Optional[Dict]:
+    """Object JSON của câu trả lời loại kind đã kiểm tra theo schema, None nếu không hợp lệ"""
+    value = _load(content)
+    return _validate(SCHEMAS[kind], value) if value is not None else None
+
+
+def parse_batch_response(content: str, count: int) -> List[Optional[Dict]]:
+    """
+    Preferences của từng câu hỏi trong câu trả lời trích xuất theo lô ({"results": [...]}), xếp theo id
+    (1..count); phần tử thiếu hoặc sai schema là None, các phần tử khác vẫn dùng được
+    """
+    results = [None] * count
+    value = _load(content)
+    items = value.get('results') if isinstance(value, dict) else None
+    if not isinstance(items, list):
+        return results
+    for item in items:
+        item = _validate(BatchItem, item)
+        if item is not None and 1 <= item['id'] <= count:
+            results[item.pop('id') - 1] = item
+    return results
+
+
+class PromptStats:
+    """Số token (theo usage của API) và tỉ lệ lỗi parse JSON của từng loại gọi LLM"""
+
+    def __init__(self):
+        self._kinds: Dict[str, Dict] = {}
+
+    def _entry(self, kind: str) -> Dict:
+        return self._kinds.setdefault(kind, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                             'cached_tokens': 0, 'parsed': 0, 'parse_failures': 0})
+
+    def record_usage(self, kind: str, usage):
+        entry = self._entry(kind)
+        entry['calls'] += 1
+        if usage is None:
+            return
+        entry['prompt_tokens'] += usage.prompt_tokens or 0
+        entry['completion_tokens'] += usage.completion_tokens or 0
+        # Token của prefix provider đã cache (chỉ có ở API mới)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        entry['cached_tokens'] += getattr(details, 'cached_tokens', None) or 0
+
+    def record_parse(self, kind: str, ok: bool):
+        self._entry(kind)['parsed' if ok else 'parse_failures'] += 1
+
+    def stats(self) -> Dict:
+        report = {}
+        for kind, entry in self._kinds.items():
+            parses = entry['parsed'] + entry['parse_failures']
+            report[kind] = dict(
+                entry,
+                avg_prompt_tokens=entry['prompt_tokens'] / entry['calls'] if entry['calls'] else 0.0,
+                avg_completion_tokens=entry['completion_tokens'] / entry['calls'] if entry['calls'] else 0.0,
+                parse_failure_rate=entry['parse_failures'] / parses if parses else 0.0
+            )
+        return report
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Tin nhắn mẫu khi không truyền --messages: câu hỏi du lịch (nhiều mức chi tiết) và câu hỏi ngoài chủ đề
+SAMPLE_MESSAGES = [
+    "Tôi muốn đi biển miền Trung vào tháng 6",
+    "Gợi ý nơi du lịch mát mẻ, ít mưa vào tháng 12",
+    "Tháng 3 nên đi đâu ở miền Bắc để ngắm hoa?",
+    "Đi núi tháng 10, nhiệt độ khoảng 20 độ, gió nhẹ",
+    "Tìm thành phố ven biển nắng ấm, độ ẩm thấp cho kỳ nghỉ hè",
+    "Muốn đi Tây Nguyên vào mùa khô, chỗ nào đẹp?",
+    "Du lịch miền Tây tháng 9 có nên không?",
+    "Địa điểm nghỉ dưỡng trời ít mây, không mưa tháng 4",
+    "Giải phương trình bậc hai x^2 - 5x + 6 = 0",
+    "Ai là tổng thống Mỹ hiện nay?",
+    "Cách viết hàm đệ quy trong Python",
+    "xin chào",
+]
+
+PERCENTILES = (50, 95, 99)
+
+# Endpoint trả về Server-Sent Events thay vì JSON
+STREAM_ENDPOINTS = ("/chat/stream",)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Đọc header Server-Timing ("stage;dur=12.3, ...") thành {stage: ms}"""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def parse_sse(lines: List[str]) -> List[Tuple[str, object]]:
+    """Tách các dòng của luồng Server-Sent Events thành danh sách (event, data đã đọc JSON)"""
+    events = []
+    event, data = None, []
+    for line in lines + [""]:
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and (event is not None or data):
+            events.append((event or "message", json.loads("\n".join(data)) if data else None))
+            event, data = None, []
+    return events
+
+
+async def post_stream(client, endpoint: str, body: Dict, started: float) -> Tuple[int, Dict[str, float], bool]:
+    """
+    Gửi request tới endpoint SSE và đọc hết luồng; trả về (status, {first_token: ms}, success).
+    Thành công khi luồng kết thúc bằng sự kiện done và không có sự kiện error.
+    """
+    timings = {}
+    async with client.stream("POST", endpoint, json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, timings, False
+        lines = []
+        async for line in response.aiter_lines():
+            if "first_token" not in timings and line == "event: token":
+                timings["first_token"] = (time.perf_counter() - started) * 1000
+            lines.append(line)
+    names = [event for event, _ in parse_sse(lines)]
+    return response.status_code, timings, "error" not in names and names[-1:] == ["done"]
+
+
+def start_stub(port: int, latency_specs: List[str], error_rate: float, seed: Optional[int],
+               output_token_ms: float = 0.0, max_concurrency: Optional[int] = None) -> str:
+    """Chạy openai_stub trong thread nền, trả về base URL"""
+    import uvicorn
+    from openai_stub import StubConfig, create_app, parse_latency
+
+    config = StubConfig(parse_latency(latency_specs) or None, error_rate=error_rate, seed=seed,
+                        output_token_ms=output_token_ms, max_concurrency=max_concurrency)
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+class LoadResult:
+    """Kết quả đo: thời gian phía client và thời gian từng bước (Server-Timing) của mỗi request"""
+
+    def __init__(self):
+        self.client_ms: List[float] = []
+        self.stages: Dict[str, List[float]] = {}
+        self.statuses: Dict[int, int] = {}
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def add(self, status: int, client_ms: float, timings: Dict[str, float], success: bool):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not success:
+            self.failures += 1
+        self.client_ms.append(client_ms)
+        for stage, duration in timings.items():
+            self.stages.setdefault(stage, []).append(duration)
+
+    def summary(self) -> Dict:
+        rows = {'client': self.client_ms}
+        rows.update(self.stages)
+        return {
+            'requests': len(self.client_ms),
+            'failures': self.failures,
+            'statuses': self.statuses,
+            'elapsed_s': self.elapsed,
+            'throughput_rps': len(self.client_ms) / self.elapsed if self.elapsed else 0.0,
+            'latency_ms': {
+                stage: dict(count=len(values), mean=float(np.mean(values)),
+                            **{f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES})
+                for stage, values in rows.items() if values
+            }
+        }
+
+
+def print_summary(summary: Dict):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.2f} s: "
+          f"{summary['throughput_rps']:.1f} req/s, {summary['failures']} failed, statuses {summary['statuses']}")
+    print(f"{'stage':<14}{'count':>7}{'mean':>10}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES))
+    for stage, row in summary['latency_ms'].items():
+        print(f"{stage:<14}{row['count']:>7}{row['mean']:>10.1f}"
+              + "".join(f"{row['p' + str(p)]:>10.1f}" for p in PERCENTILES))
+    print("(ms; stages from the Server-Timing header or, for the stream endpoint, first_token measured "
+          "by the client; client = full round trip)")
+
+
+async def run_load(client, endpoint: str, messages: List[str], total: int, concurrency: int,
+                   extra_body: Dict, seed: Optional[int]) -> LoadResult:
+    """
+    Gửi total request tới endpoint với tối đa concurrency request đồng thời. Endpoint stream (SSE) được đọc
+    đến hết luồng; thời gian đến token đầu tiên đo phía client thay cho header Server-Timing
+    """
+    rng = random.Random(seed)
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(dict(extra_body, message=rng.choice(messages)))
+    result = LoadResult()
+
+    async def worker():
+        while not queue.empty():
+            body = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                if endpoint in STREAM_ENDPOINTS:
+                    status, timings, success = await post_stream(client, endpoint, body, started)
+                else:
+                    response = await client.post(endpoint, json=body)
+                    status, timings = response.status_code, parse_server_timing(response.headers.get("server-timing"))
+                    success = status == 200 and response.json().get("success", False)
+                result.add(status, (time.perf_counter() - started) * 1000, timings, success)
+            except Exception as e:
+                print(f"Request error: {e!r}")
+                result.add(0, (time.perf_counter() - started) * 1000, {}, False)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def run(args) -> Dict:
+    import httpx
+
+    messages = SAMPLE_MESSAGES
+    if args.messages:
+        with open(args.messages, encoding="utf-8") as f:
+            messages = [line.strip() for line in f if line.strip()]
+    extra_body = json.loads(args.body) if args.body else {}
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        # App chạy trong process: import sau khi đã đặt biến môi trường (OPENAI_BASE_URL, cache...)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest",
+                                   timeout=timeout)
+
+    async with client:
+        # Ẩn log từng request của app khi chạy trong process
+        quiet = contextlib.redirect_stdout(io.StringIO()) if not args.url and not args.verbose \
+            else contextlib.nullcontext()
+        with quiet:
+            if args.warmup:
+                await run_load(client, args.endpoint, messages, args.warmup, args.concurrency, extra_body, args.seed)
+            result = await run_load(client, args.endpoint, messages, args.requests, args.concurrency, extra_body,
+                                    args.seed)
+    return result.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoint and report per-stage latency")
+    parser.add_argument("--url", default=None,
+                        help="base URL of a running server (default: drive main.app in-process)")
+    parser.add_argument("--endpoint", default="/chat", choices=("/chat",) + STREAM_ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200, help="number of measured requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at the same time")
+    parser.add_argument("--warmup", type=int, default=0, help="requests sent before measuring")
+    parser.add_argument("--messages", default=None, help="file with one chat message per line")
+    parser.add_argument("--body", default=None,
+                        help='extra JSON fields for every request, e.g. \'{"response_mode": "template"}\'')
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request (seconds)")
+    parser.add_argument("--stub", action="store_true",
+                        help="start openai_stub in the background and point the in-process app at it")
+    parser.add_argument("--stub-port", type=int, default=8001)
+    parser.add_argument("--stub-latency", action="append", metavar="[KIND=]DIST:MEAN_MS[:SPREAD_MS]",
+                        help="stub latency distribution (see openai_stub.py --help)")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-output-token-ms", type=float, default=0.0,
+                        help="stub generation time per output word of non-streamed answers")
+    parser.add_argument("--stub-max-concurrency", type=int, default=None,
+                        help="stub requests processed at once, the rest queue (simulates a provider limit)")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="keep the LLM result cache on (off by default so repeated messages hit the LLM)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for message choice and the stub")
+    parser.add_argument("--json", default=None, help="also write the summary to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's per-request log")
+    args = parser.parse_args()
+
+    if args.stub:
+        os.environ["OPENAI_BASE_URL"] = start_stub(args.stub_port, args.stub_latency, args.stub_error_rate,
+                                                   args.seed, args.stub_output_token_ms, args.stub_max_concurrency)
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        print(f"OpenAI stub running at {os.environ['OPENAI_BASE_URL']}")
+    if not args.llm_cache:
+        os.environ["LLM_CACHE_ENABLED"] = "0"
+    if not args.url:
+        # App trong process ghi lịch sử chat (và cache LLM) vào file SQLite tạm, không vào travel_chatbot.db
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="loadtest_"),
+                                                                 "travel_chatbot.db")
+
+    summary = asyncio.run(run(args))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,108 @@
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
 from sqlalchemy.orm import Session
+import asyncio
+import hmac
 import json
+import os
+import time
 import uuid
-from datetime import datetime, timezone
-from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 
-from models import get_db, create_tables, ChatHistory
+from models import get_db, create_tables, ChatHistory, SessionLocal
 from chatbot import TravelChatbot
+from resilience import CircuitBreaker
+from session_store import SessionStore
+from intent_classifier import IntentClassifier
+from llm_cache import LLMResponseCache
+from chat_pipeline import ANALYSIS_MODES, RESPONSE_MODES, ChatPipeline, ChatSingleFlight
 from clustering import TravelRecommendationEngine
+import json_codec
+
+# Chu kỳ (giây) kiểm tra mtime của dataset để tự nạp lại, 0 để tắt
+DATASET_WATCH_INTERVAL = float(os.getenv("DATASET_WATCH_INTERVAL", "10"))
+# Token cho các endpoint quản trị; nếu không đặt thì các endpoint này bị tắt
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Cách phân tích tin nhắn: "separate" (kiểm tra chủ đề và trích xuất là hai lần gọi LLM) hoặc "combined" (một lần gọi)
+CHAT_ANALYSIS_MODE = os.getenv("CHAT_ANALYSIS_MODE", "separate")
+# Local-first: bỏ qua LLM khi phân tích bằng luật đạt confidence này (0-1), để trống để luôn hỏi LLM
+CHAT_LOCAL_FIRST_CONFIDENCE = float(os.environ["CHAT_LOCAL_FIRST_CONFIDENCE"]) \
+    if os.getenv("CHAT_LOCAL_FIRST_CONFIDENCE") else None
+# Mô hình intent (python intent_classifier.py) thay cho LLM kiểm tra chủ đề khi đủ chắc chắn
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.9"))
+# Cache kết quả LLM (kiểm tra chủ đề, trích xuất, từ chối) theo tin nhắn đã chuẩn hóa: LRU trong process + SQLite
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_DB_SIZE = int(os.getenv("LLM_CACHE_DB_SIZE", "20000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Bỏ dấu tiếng Việt khi chuẩn hóa key ("di bien" trùng "đi biển")
+LLM_CACHE_FOLD_ACCENTS = os.getenv("LLM_CACHE_FOLD_ACCENTS", "0") == "1"
+# Thời gian tối đa (giây) cho một tin nhắn chat, chia cho các lần gọi LLM; hết giờ thì dùng fallback. 0 để tắt
+CHAT_LATENCY_BUDGET = float(os.getenv("CHAT_LATENCY_BUDGET", "20")) or None
+# Server tương thích OpenAI thay cho api.openai.com (ví dụ stub cục bộ: python openai_stub.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Timeout (giây) và số lần retry của SDK OpenAI cho mỗi lần gọi
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+# Circuit breaker: số lần lỗi liên tiếp để ngắt mạch và thời gian (giây) trước khi gọi thử lại
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Cách viết phản hồi: "llm", "template" (không gọi LLM) hoặc "auto" (template khi tải cao hoặc LLM đang ngắt mạch)
+CHAT_RESPONSE_MODE = os.getenv("CHAT_RESPONSE_MODE", "llm")
+# Chế độ auto: số request chat đang xử lý đồng thời từ đó trở đi dùng template
+CHAT_TEMPLATE_LOAD_THRESHOLD = int(os.getenv("CHAT_TEMPLATE_LOAD_THRESHOLD", "16"))
+# Preferences của hội thoại nhiều lượt giữ trong bộ nhớ theo session_id: số session tối đa, thời gian (giây)
+# giữ session không có lượt du lịch mới
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Gộp các request /chat đồng thời có cùng tin nhắn (đã chuẩn hóa) vào một lần chạy pipeline
+CHAT_SINGLE_FLIGHT = os.getenv("CHAT_SINGLE_FLIGHT", "1") != "0"
+# Trích xuất preferences theo lô: số tin nhắn tối đa mỗi lần gọi LLM (1 để tắt) và thời gian (ms) chờ gom lô
+LLM_EXTRACTION_BATCH_SIZE = int(os.getenv("LLM_EXTRACTION_BATCH_SIZE", "1"))
+LLM_EXTRACTION_BATCH_WINDOW_MS = float(os.getenv("LLM_EXTRACTION_BATCH_WINDOW_MS", "10"))
+
+DATASET_VERSION_HEADER = "X-Dataset-Version"
+
+# Số request chat (/chat, /chat/stream) đang xử lý, dùng cho response_mode "auto"
+active_chats = 0
+
+async def reload_dataset(reason: str):
+    """Nạp lại dataset ngoài event loop; request đang chạy vẫn dùng snapshot cũ"""
+    # run_in_executor thay cho asyncio.to_thread (chỉ có từ Python 3.9)
+    state = await asyncio.get_running_loop().run_in_executor(None, recommendation_engine.reload)
+    print(f"Dataset reloaded ({reason}): version {state.version}, {len(state.df)} records")
+    return state
+
+async def watch_dataset(interval: float):
+    """Theo dõi mtime của CSV/snapshot và nạp lại khi có thay đổi"""
+    last_mtimes = recommendation_engine.source_mtimes()
+    while True:
+        await asyncio.sleep(interval)
+        mtimes = recommendation_engine.source_mtimes()
+        if mtimes == last_mtimes:
+            continue
+        try:
+            await reload_dataset("file change")
+            last_mtimes = mtimes
+        except Exception as e:
+            # Giữ snapshot cũ, thử lại ở lần kiểm tra sau (file có thể đang được ghi dở)
+            print(f"Dataset reload failed, keeping version {recommendation_engine.version}: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Travel Recommendation Chatbot started!")
     print("Loading recommendation engine...")
+    watcher = asyncio.create_task(watch_dataset(DATASET_WATCH_INTERVAL)) if DATASET_WATCH_INTERVAL > 0 else None
     yield
     # Shutdown
+    if watcher is not None:
+        watcher.cancel()
     print("Shutting down...")
 
 # Khởi tạo FastAPI app
@@ -29,8 +113,26 @@ templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Khởi tạo các components
-chatbot = TravelChatbot()
+llm_cache = LLMResponseCache(
+    maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL or None, persistent_maxsize=LLM_CACHE_DB_SIZE,
+    fold_accents=LLM_CACHE_FOLD_ACCENTS
+) if LLM_CACHE_ENABLED else None
+intent_classifier = None
+if os.path.exists(INTENT_MODEL_PATH):
+    try:
+        intent_classifier = IntentClassifier.load(INTENT_MODEL_PATH)
+        print(f"Loaded intent model {INTENT_MODEL_PATH}: {len(intent_classifier.weights)} n-grams")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Intent model not loaded, topic checks use the LLM: {e}")
+chatbot = TravelChatbot(cache=llm_cache, intent_classifier=intent_classifier,
+                        intent_min_confidence=INTENT_MIN_CONFIDENCE,
+                        llm_timeout=LLM_TIMEOUT, llm_max_retries=LLM_MAX_RETRIES,
+                        breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN),
+                        base_url=OPENAI_BASE_URL, extraction_batch_size=LLM_EXTRACTION_BATCH_SIZE,
+                        extraction_batch_window=LLM_EXTRACTION_BATCH_WINDOW_MS / 1000)
 recommendation_engine = TravelRecommendationEngine()
+session_store = SessionStore(maxsize=SESSION_MAX_SIZE, ttl=SESSION_TTL or None)
+chat_flight = ChatSingleFlight() if CHAT_SINGLE_FLIGHT else None
 
 # Tạo database tables
 create_tables()
@@ -40,6 +142,75 @@ async def home(request: Request):
     """Trang chủ"""
     return templates.TemplateResponse("index.html", {"request": request})
 
+def parse_chat_request(data: dict) -> tuple:
+    """
+    Đọc và kiểm tra body của /chat và /chat/stream: (message, session_id, rank_by, analysis_mode, response_mode)
+    """
+    user_message = data.get("message", "").strip()
+    session_id = data.get("session_id", str(uuid.uuid4()))
+    # Cách xếp hạng: "hci" (mặc định) hoặc "weather" (độ giống thời tiết mong muốn)
+    rank_by = data.get("ranking", "hci")
+    analysis_mode = data.get("analysis_mode", CHAT_ANALYSIS_MODE)
+    response_mode = data.get("response_mode", CHAT_RESPONSE_MODE)
+
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    if rank_by not in recommendation_engine.RANKING_MODES:
+        raise HTTPException(status_code=400, detail="ranking must be 'hci' or 'weather'")
+    if analysis_mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="analysis_mode must be 'separate' or 'combined'")
+    if response_mode not in RESPONSE_MODES + ("auto",):
+        raise HTTPException(status_code=400, detail="response_mode must be 'llm', 'template' or 'auto'")
+    return user_message, session_id, rank_by, analysis_mode, resolve_response_mode(response_mode)
+
+def resolve_response_mode(response_mode: str) -> str:
+    """Chế độ "auto": dùng template khi số request đang xử lý đạt ngưỡng hoặc circuit breaker không đóng"""
+    if response_mode != "auto":
+        return response_mode
+    if active_chats >= CHAT_TEMPLATE_LOAD_THRESHOLD or chatbot.breaker.state != chatbot.breaker.CLOSED:
+        return "template"
+    return "llm"
+
+@contextmanager
+def track_chat_load():
+    """Đếm request chat đang xử lý"""
+    global active_chats
+    active_chats += 1
+    try:
+        yield
+    finally:
+        active_chats -= 1
+
+def build_chat_record(pipeline: ChatPipeline, user_ip: str, session_id: str) -> ChatHistory:
+    """Bản ghi lịch sử chat từ kết quả pipeline"""
+    preferences = pipeline.preferences if pipeline.is_travel_related else {"preferences": "non_travel_query"}
+    return ChatHistory(
+        user_message=pipeline.user_message,
+        bot_response=pipeline.response,
+        extracted_features=json.dumps(preferences),
+        recommended_locations=pipeline.recommendations_json.decode("utf-8"),
+        user_ip=user_ip,
+        session_id=session_id
+    )
+
+def save_chat_record(chat_record: ChatHistory):
+    """Lưu bản ghi lịch sử chat bằng session riêng (dùng ngoài vòng đời request)"""
+    db = SessionLocal()
+    try:
+        db.add(chat_record)
+        db.commit()
+    finally:
+        db.close()
+
+def server_timing(timings: dict) -> str:
+    """Header Server-Timing từ thời gian các bước (ms): topic;dur=412.3, extract;dur=420.1, ..."""
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
+def sse_event(event: str, data) -> bytes:
+    """Một sự kiện Server-Sent Events; data là object (serialize sang JSON) hoặc bytes JSON dựng sẵn"""
+    payload = data if isinstance(data, bytes) else json_codec.dumps(data)
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + payload + b"\n\n"
+
 @app.post("/chat")
 async def chat_endpoint(
     request: Request,
@@ -47,59 +218,56 @@ async def chat_endpoint(
 ):
     """API endpoint cho chat"""
     try:
+        started = time.perf_counter()
         # Lấy dữ liệu từ request
         data = await request.json()
-        user_message = data.get("message", "").strip()
-        session_id = data.get("session_id", str(uuid.uuid4()))
-        
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
+        user_message, session_id, rank_by, analysis_mode, response_mode = parse_chat_request(data)
         
         # Xử lý user message với tính năng kiểm tra chủ đề
         print(f"Processing user message: {user_message}")
-        is_travel_related, result = chatbot.process_user_input(user_message)
+        # Giữ một snapshot dataset cho cả request
+        dataset = recommendation_engine.state
+        # Kiểm tra chủ đề, trích xuất, gợi ý và tạo phản hồi, mỗi bước chạy một lần
+        pipeline = ChatPipeline(chatbot, recommendation_engine, state=dataset, rank_by=rank_by, top_k=5,
+                                analysis_mode=analysis_mode, local_first_confidence=CHAT_LOCAL_FIRST_CONFIDENCE,
+                                budget=CHAT_LATENCY_BUDGET, response_mode=response_mode,
+                                session_store=session_store, session_id=session_id)
+        with track_chat_load():
+            if chat_flight is not None:
+                # Request giống hệt đang chạy: dùng chung kết quả, vẫn lưu lịch sử chat riêng bên dưới
+                await chat_flight.arun(pipeline, user_message)
+            else:
+                await pipeline.arun(user_message)
 
-        recommendations = []
-        preferences = {}
+        is_travel_related = pipeline.is_travel_related
+        recommendations = pipeline.recommendations
+        recommendations_json = pipeline.recommendations_json
+        bot_response = pipeline.response
 
         if is_travel_related:
-            # Nếu liên quan đến du lịch, result là preferences
-            preferences = result
+            preferences = pipeline.preferences
             print(f"Extracted preferences: {preferences}")
-
-            # Lấy recommendations
-            recommendations = recommendation_engine.get_recommendations(preferences, top_k=5)
             print(f"Found {len(recommendations)} recommendations")
-
-            # Tạo response cho du lịch
-            bot_response = chatbot.generate_response(user_message, recommendations)
         else:
-            # Nếu không liên quan đến du lịch, result là câu từ chối
-            bot_response = result
             print(f"Non-travel query, refusal response: {bot_response}")
             preferences = {"preferences": "non_travel_query"}
         
         # Lưu vào database
-        chat_record = ChatHistory(
-            user_message=user_message,
-            bot_response=bot_response,
-            extracted_features=json.dumps(preferences),
-            recommended_locations=json.dumps(recommendations),
-            user_ip=request.client.host,
-            session_id=session_id
-        )
-        db.add(chat_record)
+        db.add(build_chat_record(pipeline, request.client.host, session_id))
         db.commit()
         
-        return JSONResponse({
+        body = json_codec.splice_object({
             "success": True,
             "response": bot_response,
             "is_travel_related": is_travel_related,
-            "recommendations": recommendations,
             "preferences": preferences,
             "session_id": session_id,
-            "has_recommendations": len(recommendations) > 0
-        })
+            "has_recommendations": len(recommendations) > 0,
+            "dataset_version": dataset.version
+        }, {"recommendations": recommendations_json})
+        timings = dict(pipeline.timings, total=(time.perf_counter() - started) * 1000)
+        return Response(content=body, media_type="application/json",
+                        headers={DATASET_VERSION_HEADER: dataset.version, "Server-Timing": server_timing(timings)})
         
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
@@ -109,23 +277,236 @@ async def chat_endpoint(
             "response": "Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại sau."
         }, status_code=500)
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: Request):
+    """
+    API chat dạng Server-Sent Events: gửi preferences và recommendations ngay khi có,
+    sau đó phản hồi theo từng token; lịch sử chat được lưu khi phản hồi hoàn tất
+    """
+    try:
+        data = await request.json()
+        user_message, session_id, rank_by, analysis_mode, response_mode = parse_chat_request(data)
+    except HTTPException as e:
+        return JSONResponse({"success": False, "error": e.detail}, status_code=e.status_code)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    print(f"Processing user message (stream): {user_message}")
+    dataset = recommendation_engine.state
+    pipeline = ChatPipeline(chatbot, recommendation_engine, state=dataset, rank_by=rank_by, top_k=5,
+                            analysis_mode=analysis_mode, local_first_confidence=CHAT_LOCAL_FIRST_CONFIDENCE,
+                            budget=CHAT_LATENCY_BUDGET, response_mode=response_mode,
+                            session_store=session_store, session_id=session_id)
+    user_ip = request.client.host
+
+    async def events():
+        yield sse_event("meta", {"session_id": session_id, "dataset_version": dataset.version})
+        try:
+            with track_chat_load():
+                async for name, payload in pipeline.astream(user_message):
+                    if name == "analysis":
+                        yield sse_event("preferences", payload)
+                    elif name == "recommendations":
+                        yield sse_event("recommendations", json_codec.splice_object(
+                            {"has_recommendations": len(pipeline.recommendations) > 0}, {"recommendations": payload}
+                        ))
+                    else:
+                        yield sse_event("token", {"text": payload})
+
+            # Lưu lịch sử khi phản hồi đã sinh xong
+            await asyncio.get_running_loop().run_in_executor(
+                None, save_chat_record, build_chat_record(pipeline, user_ip, session_id))
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            yield sse_event("error", {"error": str(e), "response": "Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại sau."})
+            return
+
+        yield sse_event("done", {
+            "response": pipeline.response,
+            "is_travel_related": pipeline.is_travel_related,
+            "has_recommendations": len(pipeline.recommendations) > 0
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        DATASET_VERSION_HEADER: dataset.version
+    })
+
 @app.get("/api/clusters")
-async def get_clusters():
-    """API để lấy thông tin về các clusters"""
+async def get_clusters(request: Request):
+    """API để lấy thông tin về các clusters (payload dựng sẵn, hỗ trợ ETag / 304)"""
     try:
-        return {"success": True, "clusters": recommendation_engine.get_all_clusters_summary()}
+        dataset = recommendation_engine.state
+        etag = dataset.clusters_summary_etag
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=300", DATASET_VERSION_HEADER: dataset.version}
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+
+        body = b'{"success":true,"clusters":' + dataset.clusters_summary_json + b'}'
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
+@app.post("/api/recommendations/batch")
+async def batch_recommendations(request: Request):
+    """API gợi ý theo lô cho nhiều preferences có cấu trúc (không gọi LLM), trả về NDJSON"""
+    try:
+        data = await request.json()
+        profiles = data.get("preferences", [])
+        top_k = int(data.get("top_k", 5))
+
+        if not isinstance(profiles, list) or not profiles:
+            raise HTTPException(status_code=400, detail="preferences must be a non-empty list")
+        if not 1 <= top_k <= 50:
+            raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+    except HTTPException as e:
+        return JSONResponse({"success": False, "error": e.detail}, status_code=e.status_code)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    dataset = recommendation_engine.state
+
+    def generate_lines(chunk_size: int = 2048):
+        for start in range(0, len(profiles), chunk_size):
+            end = min(start + chunk_size, len(profiles))
+            valid_indices, valid_preferences, errors = [], [], {}
+            for index in range(start, end):
+                try:
+                    valid_preferences.append(chatbot._validate_preferences(profiles[index]))
+                    valid_indices.append(index)
+                except Exception as e:
+                    errors[index] = str(e)
+
+            results = dict(zip(valid_indices,
+                               recommendation_engine.recommend_batch(valid_preferences, top_k=top_k, state=dataset)))
+            # Dòng thứ i của NDJSON luôn là kết quả của profile thứ i (lỗi và kết quả xen kẽ theo thứ tự đầu vào)
+            for index in range(start, end):
+                if index in errors:
+                    yield json_codec.dumps({"index": index, "success": False, "error": errors[index]}) + b"\n"
+                else:
+                    yield json_codec.splice_object(
+                        {"index": index, "success": True}, {"recommendations": results[index].to_json()}
+                    ) + b"\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson",
+                             headers={DATASET_VERSION_HEADER: dataset.version})
+
 @app.get("/api/search/{location}")
 async def search_location(location: str):
     """API để tìm kiếm theo tên địa điểm"""
     try:
-        results = recommendation_engine.search_by_location(location, top_k=10)
-        return {"success": True, "results": results, "total": len(results)}
+        dataset = recommendation_engine.state
+        ranked = recommendation_engine.search(location, top_k=10, state=dataset)
+        body = json_codec.splice_object({"success": True, "total": len(ranked)}, {"results": ranked.to_json()})
+        return Response(content=body, media_type="application/json", headers={DATASET_VERSION_HEADER: dataset.version})
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+@app.get("/api/nearby")
+async def nearby(lat: float, lon: float, radius_km: float = 100.0,
+                 month: Optional[int] = None, limit: int = 10, sort: str = "hci"):
+    """API tìm địa điểm trong bán kính radius_km quanh (lat, lon), xếp theo hci hoặc khoảng cách"""
+    if month is not None and not 1 <= month <= 12:
+        return JSONResponse({"success": False, "error": "month must be between 1 and 12"}, status_code=400)
+    try:
+        dataset = recommendation_engine.state
+        ranked = recommendation_engine.find_nearby(lat, lon, radius_km, month=month, top_k=max(1, min(limit, 100)),
+                                                   sort_by=sort, state=dataset)
+        body = json_codec.splice_object({"success": True, "total": len(ranked)}, {"results": ranked.to_json()})
+        return Response(content=body, media_type="application/json", headers={DATASET_VERSION_HEADER: dataset.version})
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+@app.post("/api/plan")
+async def plan_trip(request: Request):
+    """
+    API lập lịch trình nhiều tháng: chọn (thành phố, tháng) có tổng hci cao nhất trong khoảng ngày,
+    giới hạn thời gian di chuyển giữa hai tháng liên tiếp
+    """
+    try:
+        data = await request.json()
+        start_date = date.fromisoformat(str(data["start_date"]))
+        end_date = date.fromisoformat(str(data["end_date"]))
+        max_travel_hours = data.get("max_travel_hours")
+        cities = data.get("cities") or None
+        if cities is not None and not isinstance(cities, list):
+            raise ValueError("cities must be a list of city names")
+        options = {
+            "cities": cities,
+            "region": data.get("region"),
+            "terrain": data.get("terrain"),
+            "max_travel_hours": float(max_travel_hours) if max_travel_hours is not None else None,
+            "travel_penalty_per_hour": float(data.get("travel_penalty_per_hour", 0.0)),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        message = f"Missing field: {e}" if isinstance(e, KeyError) else str(e)
+        return JSONResponse({"success": False, "error": message}, status_code=400)
+
+    dataset = recommendation_engine.state
+    try:
+        plan = recommendation_engine.plan_trip(start_date, end_date, state=dataset, **options)
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400,
+                            headers={DATASET_VERSION_HEADER: dataset.version})
     except Exception as e:
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
+    return JSONResponse({"success": True, **plan}, headers={DATASET_VERSION_HEADER: dataset.version})
+
+@app.get("/api/autocomplete")
+async def autocomplete(response: Response, q: str = "", limit: int = 8):
+    """API gợi ý tên thành phố theo tiền tố (không phân biệt dấu, chấp nhận gõ sai nhẹ)"""
+    try:
+        dataset = recommendation_engine.state
+        response.headers[DATASET_VERSION_HEADER] = dataset.version
+        suggestions = recommendation_engine.autocomplete(q, limit=max(1, min(limit, 50)), state=dataset)
+        return {"success": True, "query": q, "suggestions": suggestions}
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    API để xem thống kê cache của recommendation engine, cache kết quả LLM, session hội thoại, single-flight,
+    trích xuất theo lô và token/lỗi parse của từng loại prompt
+    """
+    return {
+        "success": True,
+        "recommendations": recommendation_engine.cache_stats(),
+        "llm": llm_cache.stats() if llm_cache is not None else None,
+        "sessions": session_store.stats(),
+        "single_flight": chat_flight.stats() if chat_flight is not None else None,
+        "extraction_batching": chatbot.extraction_batcher.stats() if chatbot.extraction_batcher is not None else None,
+        "prompts": chatbot.prompt_report()
+    }
+
+@app.post("/api/admin/reload")
+async def admin_reload(request: Request):
+    """API quản trị: nạp lại dataset không cần khởi động lại (cần header X-Admin-Token)"""
+    if not ADMIN_TOKEN:
+        return JSONResponse({"success": False, "error": "Admin endpoints are disabled (ADMIN_TOKEN not set)"}, status_code=403)
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse({"success": False, "error": "Invalid admin token"}, status_code=401)
+
+    previous_version = recommendation_engine.version
+    try:
+        dataset = await reload_dataset("admin request")
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e), "dataset_version": previous_version}, status_code=500)
+
+    return JSONResponse({
+        "success": True,
+        "previous_version": previous_version,
+        "dataset_version": dataset.version,
+        "records": len(dataset.df),
+        "source": dataset.data_source
+    }, headers={DATASET_VERSION_HEADER: dataset.version})
+
 @app.get("/api/history")
 async def get_chat_history(
     limit: int = 50,
@@ -165,7 +546,9 @@ async def health_check():
     return JSONResponse({
         "status": "healthy",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "dataset_version": recommendation_engine.version,
+        "llm_circuit": chatbot.breaker.stats()
     })
 
 if __name__ == "__main__":
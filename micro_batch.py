@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+
+class MicroBatcher:
+    """
+    Gom các lời gọi đồng thời thành lô: phần tử đầu tiên chờ tối đa window giây (hoặc đến khi đủ max_size
+    phần tử) rồi cả lô được xử lý bằng một lời gọi fn(items, timeout), kết quả thứ i trả về cho caller thứ i.
+    Timeout của lô là timeout nhỏ nhất trong lô (None nếu không caller nào đặt).
+    fn chạy trong task riêng: caller bị hủy không làm hủy lô của các caller khác. Chỉ dùng trong một event loop.
+    """
+
+    def __init__(self, fn: Callable[[List[Any], Optional[float]], Awaitable[Sequence[Any]]],
+                 max_size: int = 8, window: float = 0.01):
+        self.fn = fn
+        self.max_size = max_size
+        self.window = window
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self.failures = 0
+
+    async def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Kết quả của item trong lô; exception của fn được ném lại cho mọi caller trong lô"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, timeout, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Bỏ các caller đã bị hủy trong lúc chờ gom lô
+        batch = [entry for entry in self._pending if not entry[2].done()]
+        self._pending = []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.largest = max(self.largest, len(batch))
+        timeouts = [timeout for _, timeout, _ in batch if timeout is not None]
+        task = asyncio.ensure_future(self.fn([item for item, _, _ in batch], min(timeouts) if timeouts else None))
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._deliver(batch, done))
+
+    def _deliver(self, batch: List[tuple], task: asyncio.Task):
+        self._tasks.discard(task)
+        error = task.exception() if not task.cancelled() else None
+        results = list(task.result()) if not task.cancelled() and error is None else []
+        if error is not None:
+            self.failures += 1
+        for index, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index] if index < len(results) else None)
+
+    def stats(self) -> Dict:
+        return {
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'items': self.items,
+            'avg_size': self.items / self.batches if self.batches else 0.0,
+            'largest': self.largest,
+            'failures': self.failures
+        }
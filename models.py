@@ -4,8 +4,8 @@ from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
 
-# Database setup
-DATABASE_URL = "sqlite:///./travel_chatbot.db"
+# Database setup (DATABASE_URL trong môi trường thay cho file SQLite mặc định, ví dụ khi chạy test)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./travel_chatbot.db")
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -23,6 +23,16 @@ class ChatHistory(Base):
     user_ip = Column(String(50))
     session_id = Column(String(100))
 
+class LLMCacheEntry(Base):
+    """Model để lưu kết quả gọi LLM đã cache (tầng thứ hai, giữ lại qua các lần khởi động)"""
+    __tablename__ = "llm_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 của (loại gọi, phiên bản prompt, tin nhắn đã chuẩn hóa)
+    kind = Column(String(20), nullable=False)
+    value = Column(Text, nullable=False)  # JSON string của kết quả
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, index=True)
+
 def create_tables():
     """Tạo các bảng trong database"""
     Base.metadata.create_all(bind=engine)
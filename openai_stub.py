@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from rule_extractor import RuleExtractor
+
+# Loại prompt của TravelChatbot, nhận diện theo câu chữ trong system prompt và tin nhắn (kiểm tra theo thứ tự)
+PROMPT_KINDS = [
+    ('followup', 'Tin nhắn mới'),
+    ('analysis', 'Hãy làm hai việc'),
+    ('batch_extraction', 'câu hỏi độc lập'),
+    ('topic', 'phân tích chủ đề'),
+    ('extraction', 'Nhiệm vụ: trích xuất'),
+    ('refusal', 'không liên quan du lịch'),
+    ('response', 'Dựa trên yêu cầu du lịch'),
+]
+_QUESTION_PATTERNS = [re.compile(r'Câu hỏi: "(.*)"\s*$', re.M), re.compile(r"Câu hỏi: '(.*)' không liên quan"),
+                      re.compile(r'Dựa trên yêu cầu du lịch: "(.*)"\s*$', re.M),
+                      re.compile(r'Tin nhắn mới: "(.*)"\s*$', re.M)]
+# Các câu hỏi (id, tin nhắn) trong prompt trích xuất theo lô
+_BATCH_QUESTION_PATTERN = re.compile(r'^\s*(\d+)\. "(.*)"\s*$', re.M)
+
+# Giá trị thời tiết khi tin nhắn không nêu (giống preferences mặc định của chatbot)
+DEFAULT_WEATHER = {'avgtemp_c': 27, 'maxwind_kph': 15, 'totalprecip_mm': 10, 'avghumidity': 65,
+                   'cloud_cover_mean': 60}
+
+DEFAULT_REFUSAL = ("Xin lỗi, tôi chỉ có thể hỗ trợ các câu hỏi về du lịch Việt Nam. "
+                   "Bạn muốn đi đâu, vào tháng nào?")
+DEFAULT_RESPONSE = ("Chào bạn! Dựa trên yêu cầu của bạn, đây là những địa điểm có thời tiết phù hợp nhất. "
+                    "Mỗi nơi đều có khí hậu dễ chịu vào thời gian bạn chọn, rất thích hợp để nghỉ ngơi và "
+                    "khám phá. Bạn muốn biết thêm về địa điểm nào không?")
+
+
+class LatencyModel:
+    """
+    Phân phối độ trễ (ms) của một lần gọi: 'fixed', 'uniform' (mean ± spread),
+    'normal' (độ lệch chuẩn spread) hoặc 'lognormal' (trung bình mean, độ lệch chuẩn spread)
+    """
+
+    DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+    def __init__(self, distribution: str = 'fixed', mean_ms: float = 0.0, spread_ms: float = 0.0):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {self.DISTRIBUTIONS}")
+        self.distribution = distribution
+        self.mean_ms = mean_ms
+        self.spread_ms = spread_ms
+        if distribution == 'lognormal' and mean_ms > 0:
+            # Tham số của log(X) để X có đúng trung bình và độ lệch chuẩn yêu cầu
+            sigma2 = math.log(1 + (spread_ms / mean_ms) ** 2)
+            self._mu = math.log(mean_ms) - sigma2 / 2
+            self._sigma = sigma2 ** 0.5
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyModel':
+        """Đọc 'dist:mean[:spread]', ví dụ 'lognormal:800:300' hoặc 'fixed:50'"""
+        distribution, *values = spec.split(':')
+        values = [float(value) for value in values] + [0.0, 0.0]
+        return cls(distribution, values[0], values[1])
+
+    def sample(self, rng: random.Random) -> float:
+        """Độ trễ (giây)"""
+        if self.distribution == 'fixed' or self.mean_ms <= 0:
+            value = self.mean_ms
+        elif self.distribution == 'uniform':
+            value = rng.uniform(self.mean_ms - self.spread_ms, self.mean_ms + self.spread_ms)
+        elif self.distribution == 'normal':
+            value = rng.gauss(self.mean_ms, self.spread_ms)
+        else:
+            value = rng.lognormvariate(self._mu, self._sigma)
+        return max(0.0, value) / 1000
+
+    def __repr__(self):
+        return f"{self.distribution}:{self.mean_ms:g}:{self.spread_ms:g}"
+
+
+class StubConfig:
+    """
+    Cấu hình stub: độ trễ theo loại prompt (key 'default' cho các loại không đặt riêng),
+    độ trễ mỗi token khi stream, thời gian sinh mỗi token (từ) của câu trả lời không stream (cộng vào độ trễ,
+    để câu trả lời dài như trích xuất theo lô chậm hơn), số request xử lý đồng thời tối đa (giả lập giới hạn của
+    nhà cung cấp, request vượt quá phải xếp hàng), tỉ lệ lỗi và nội dung trả về cố định theo loại prompt
+    (ghi đè câu trả lời sinh từ luật)
+    """
+
+    def __init__(self, latency: Optional[Dict[str, LatencyModel]] = None, token_ms: float = 20.0,
+                 error_rate: float = 0.0, error_status: int = 500, canned: Optional[Dict] = None,
+                 seed: Optional[int] = None, output_token_ms: float = 0.0, max_concurrency: Optional[int] = None):
+        self.latency = latency or {'default': LatencyModel('lognormal', 300, 100)}
+        self.token_ms = token_ms
+        self.output_token_ms = output_token_ms
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.canned = canned or {}
+        self.rng = random.Random(seed)
+
+    def latency_for(self, kind: str) -> LatencyModel:
+        return self.latency.get(kind) or self.latency.get('default') or LatencyModel()
+
+
+def prompt_kind(content: str) -> str:
+    for kind, marker in PROMPT_KINDS:
+        if marker in content:
+            return kind
+    return 'response'
+
+
+def prompt_question(content: str) -> str:
+    """Tin nhắn của người dùng được chèn trong prompt"""
+    for pattern in _QUESTION_PATTERNS:
+        match = pattern.search(content)
+        if match:
+            return match.group(1)
+    return content
+
+
+class CannedResponder:
+    """Nội dung trả lời cho từng loại prompt: từ StubConfig.canned nếu có, nếu không thì suy ra bằng luật"""
+
+    def __init__(self, canned: Dict):
+        self.canned = canned
+        self.rules = RuleExtractor()
+
+    def _preferences(self, question: str) -> Dict:
+        extracted = self.rules.extract(question)
+        preferences = {field: extracted.get(field) for field in ('month', 'region', 'terrain')}
+        for field, default in DEFAULT_WEATHER.items():
+            preferences[field] = extracted.get(field) if extracted.get(field) is not None else default
+        preferences['preferences'] = 'du lịch'
+        return preferences
+
+    def content(self, kind: str, question: str) -> str:
+        if kind in self.canned:
+            value = self.canned[kind]
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        if kind == 'topic':
+            return json.dumps(self.rules.topic(question), ensure_ascii=False)
+        if kind == 'extraction':
+            return json.dumps(self._preferences(question), ensure_ascii=False)
+        if kind == 'batch_extraction':
+            return json.dumps({'results': [dict(id=int(index), **self._preferences(message))
+                                           for index, message in _BATCH_QUESTION_PATTERN.findall(question)]},
+                              ensure_ascii=False)
+        if kind == 'analysis':
+            result = self.rules.topic(question)
+            result['preferences'] = self._preferences(question) if result['is_travel_related'] else None
+            return json.dumps(result, ensure_ascii=False)
+        if kind == 'followup':
+            delta = {field: value for field, value in self.rules.extract(question).items() if value is not None}
+            result = self.rules.topic(question)
+            if delta:
+                result.update(is_travel_related=True, reason="Điều chỉnh yêu cầu trước đó")
+            result['changes'] = delta if result['is_travel_related'] else None
+            return json.dumps(result, ensure_ascii=False)
+        if kind == 'refusal':
+            return DEFAULT_REFUSAL
+        return DEFAULT_RESPONSE
+
+
+def _completion(model: str, content: str, prompt_tokens: int) -> Dict:
+    return {
+        'id': f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content.split()),
+                  'total_tokens': prompt_tokens + len(content.split())}
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: Dict, finish_reason: Optional[str] = None) -> bytes:
+    payload = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+               'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode('utf-8') + b"\n\n"
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    """App FastAPI giả lập POST /v1/chat/completions của OpenAI (có stream) và GET /stats"""
+    app = FastAPI(title="OpenAI stub")
+    responder = CannedResponder(config.canned)
+    slots = asyncio.Semaphore(config.max_concurrency) if config.max_concurrency else contextlib.nullcontext()
+    stats = {'requests': 0, 'errors': 0, 'by_kind': {}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get('model', 'stub')
+        # Hướng dẫn nằm ở system prompt, câu hỏi ở tin nhắn user: nhận diện trên toàn bộ các tin nhắn
+        content = "\n".join(message.get('content') or '' for message in body.get('messages') or [])
+        kind = prompt_kind(content)
+        stats['requests'] += 1
+        stats['by_kind'][kind] = stats['by_kind'].get(kind, 0) + 1
+
+        async with slots:
+            await asyncio.sleep(config.latency_for(kind).sample(config.rng))
+            if config.rng.random() < config.error_rate:
+                stats['errors'] += 1
+                return JSONResponse({'error': {'message': 'stub injected error', 'type': 'server_error',
+                                               'code': None, 'param': None}}, status_code=config.error_status)
+
+            text = responder.content(kind, content if kind == 'batch_extraction' else prompt_question(content))
+            if not body.get('stream'):
+                await asyncio.sleep(config.output_token_ms * len(text.split()) / 1000)
+                # Token ước lượng bằng số từ (stub không có tokenizer)
+                return JSONResponse(_completion(model, text, len(content.split())))
+
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+
+        async def chunks():
+            yield _chunk(completion_id, model, {'role': 'assistant', 'content': ''})
+            for token in re.findall(r'\S+\s*', text):
+                await asyncio.sleep(config.token_ms / 1000)
+                yield _chunk(completion_id, model, {'content': token})
+            yield _chunk(completion_id, model, {}, 'stop')
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def parse_latency(specs) -> Dict[str, LatencyModel]:
+    """Đọc các tham số --latency dạng '[kind=]dist:mean[:spread]'"""
+    latency = {}
+    for spec in specs or []:
+        kind, _, model = spec.rpartition('=')
+        latency[kind or 'default'] = LatencyModel.parse(model)
+    return latency
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat.completions stub for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", action="append", metavar="[KIND=]DIST:MEAN_MS[:SPREAD_MS]",
+                        help="latency distribution, per prompt kind (topic, extraction, batch_extraction, analysis, "
+                             "followup, refusal, response) or default; "
+                             "e.g. --latency lognormal:300:100 --latency response=fixed:900")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="delay between streamed tokens")
+    parser.add_argument("--output-token-ms", type=float, default=0.0,
+                        help="generation time per output word added to non-streamed answers")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="requests processed at once; further requests queue (provider concurrency limit)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected errors")
+    parser.add_argument("--canned", default=None,
+                        help="JSON file with fixed outputs per prompt kind (string or JSON object)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for latency and errors")
+    args = parser.parse_args()
+
+    canned = None
+    if args.canned:
+        with open(args.canned, encoding='utf-8') as f:
+            canned = json.load(f)
+    config = StubConfig(parse_latency(args.latency) or None, args.token_ms, args.error_rate, args.error_status,
+                        canned, args.seed, args.output_token_ms, args.max_concurrency)
+    print(f"OpenAI stub on http://{args.host}:{args.port}/v1 latency={config.latency} "
+          f"error_rate={config.error_rate}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LLMUnavailableError(Exception):
+    """Không gọi LLM: hết thời gian của request hoặc circuit breaker đang mở"""
+
+
+class Deadline:
+    """
+    Thời hạn của một request (theo time.monotonic), truyền qua các bước của pipeline.
+    Mỗi bước nhận một phần thời gian còn lại làm timeout cho lần gọi LLM của mình.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def share(self, fraction: float) -> float:
+        """Timeout cho một bước: fraction của thời gian còn lại"""
+        return self.remaining() * fraction
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+class CircuitBreaker:
+    """
+    Ngắt mạch khi upstream lỗi liên tiếp: sau failure_threshold lần lỗi liên tiếp thì mở mạch
+    (từ chối gọi) trong cool_down giây, sau đó cho một lần gọi thử (half-open):
+    thành công thì đóng mạch, lỗi thì mở lại. An toàn khi dùng từ nhiều thread.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, cool_down: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cool_down:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Có được gọi upstream không (khi half-open chỉ cho một lần gọi thử tại một thời điểm)"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Lần gọi bị hủy trước khi có kết quả: không tính thành công hay lỗi, cho phép gọi thử lại"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            retry_in: Optional[float] = None
+            if state == self.OPEN:
+                retry_in = round(max(0.0, self.cool_down - (time.monotonic() - self._opened_at)), 2)
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'cool_down': self.cool_down,
+                'retry_in': retry_in,
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,173 @@
+import random
+import zlib
+from typing import Dict, List, Optional
+
+from jinja2 import Environment, StrictUndefined
+
+# Mô tả thời tiết theo ngưỡng: (giá trị trên, mô tả) theo thứ tự tăng dần, dòng cuối là None
+TEMPERATURE_LEVELS = [(15, 'lạnh'), (20, 'se lạnh'), (24, 'mát mẻ'), (28, 'ấm áp'), (None, 'nắng nóng')]
+RAIN_LEVELS = [(1, 'hầu như không mưa'), (4, 'ít mưa'), (10, 'thỉnh thoảng có mưa'), (None, 'mưa khá nhiều')]
+WIND_LEVELS = [(10, 'gió nhẹ'), (18, 'gió vừa phải'), (None, 'gió khá mạnh')]
+HUMIDITY_LEVELS = [(70, 'không khí khô thoáng'), (82, 'độ ẩm dễ chịu'), (None, 'không khí khá ẩm')]
+CLOUD_LEVELS = [(60, 'nhiều nắng'), (80, 'có mây rải rác'), (None, 'trời nhiều mây')]
+
+# Cách gọi ngắn của các vùng trong dataset
+REGION_NAMES = {
+    'Đồng bằng sông Hồng': 'đồng bằng Bắc Bộ',
+    'Trung du và miền núi Bắc Bộ': 'vùng núi phía Bắc',
+    'Bắc Trung Bộ và Duyên hải miền Trung': 'miền Trung',
+    'Tây Nguyên': 'Tây Nguyên',
+    'Đông Nam Bộ': 'Đông Nam Bộ',
+    'Đồng bằng sông Cửu Long': 'miền Tây',
+}
+
+# Mùa theo vùng: miền Bắc có bốn mùa, miền Trung mưa vào cuối năm, phía Nam chia mùa khô / mùa mưa
+NORTH_SEASONS = {1: 'mùa đông', 2: 'mùa xuân', 3: 'mùa xuân', 4: 'mùa xuân', 5: 'mùa hè', 6: 'mùa hè',
+                 7: 'mùa hè', 8: 'mùa hè', 9: 'mùa thu', 10: 'mùa thu', 11: 'mùa thu', 12: 'mùa đông'}
+CENTRAL_SEASONS = {month: 'mùa khô' if 1 <= month <= 8 else 'mùa mưa' for month in range(1, 13)}
+SOUTH_SEASONS = {month: 'mùa mưa' if 5 <= month <= 11 else 'mùa khô' for month in range(1, 13)}
+REGION_SEASONS = {
+    'Đồng bằng sông Hồng': NORTH_SEASONS,
+    'Trung du và miền núi Bắc Bộ': NORTH_SEASONS,
+    'Bắc Trung Bộ và Duyên hải miền Trung': CENTRAL_SEASONS,
+    'Tây Nguyên': SOUTH_SEASONS,
+    'Đông Nam Bộ': SOUTH_SEASONS,
+    'Đồng bằng sông Cửu Long': SOUTH_SEASONS,
+}
+
+# Gợi ý hoạt động theo địa hình
+TERRAIN_ACTIVITIES = {
+    'ven biển': ['tắm biển', 'dạo biển lúc hoàng hôn', 'thưởng thức hải sản', 'lặn ngắm san hô'],
+    'miền núi': ['săn mây', 'trekking', 'ngắm ruộng bậc thang', 'cắm trại qua đêm'],
+    'đồng bằng': ['dạo phố', 'khám phá ẩm thực địa phương', 'đạp xe về làng quê', 'tham quan di tích'],
+}
+
+INTRO_TEMPLATES = [
+    "Chào bạn! {{ want }}, mình gợi ý {{ count }} địa điểm{{ scope }} đang có thời tiết rất hợp:",
+    "Với yêu cầu của bạn, đây là {{ count }} nơi đáng cân nhắc{{ scope }}:",
+    "Rất vui được giúp bạn lên kế hoạch! Mình đã chọn ra {{ count }} điểm đến{{ scope }} phù hợp nhất:",
+    "Bạn tham khảo {{ count }} gợi ý{{ scope }} dưới đây nhé, thời tiết ở đây khá đúng ý bạn:",
+]
+
+ITEM_TEMPLATES = [
+    "{{ i }}. **{{ place }}** ({{ region }}) - tháng {{ r.month }} là {{ season }}, "
+    "trời {{ temp }} khoảng {{ r.avgtemp_c | num }}°C, {{ rain }}, {{ wind }}. "
+    "Rất hợp để {{ activity }}.",
+    "{{ i }}. **{{ place }}**: tháng {{ r.month }} ({{ season }}) có nhiệt độ trung bình {{ r.avgtemp_c | num }}°C, "
+    "{{ clouds }}, {{ humidity }} ({{ r.avghumidity | num(0) }}%). Bạn có thể {{ activity }}.",
+    "{{ i }}. **{{ place }}** - tháng {{ r.month }} thời tiết {{ temp }}, {{ rain }} "
+    "(khoảng {{ r.totalprecip_mm | num }}mm/ngày), {{ wind }} ({{ r.maxwind_kph | num }}km/h). "
+    "Đây là dịp tốt để {{ activity }}.",
+    "{{ i }}. **{{ place }}** thuộc {{ region }}: tháng {{ r.month }} {{ temp }} ({{ r.avgtemp_c | num }}°C), "
+    "{{ clouds }} và {{ rain }}, lý tưởng cho những ai thích {{ activity }}.",
+]
+
+OUTRO_TEMPLATES = [
+    "Bạn muốn mình kể thêm về địa điểm nào, hay lên lịch trình chi tiết cho chuyến đi?",
+    "Nếu cần, mình có thể gợi ý thêm nơi ở, món ăn hoặc lịch trình cho điểm bạn thích nhất nhé!",
+    "Bạn thấy nơi nào hấp dẫn nhất? Mình sẵn sàng tư vấn thêm.",
+    "{{ tip }} Chúc bạn có chuyến đi thật vui!",
+]
+
+
+def describe(value: float, levels) -> str:
+    """Mô tả bằng lời cho một giá trị thời tiết theo bảng ngưỡng"""
+    for upper, label in levels:
+        if upper is None or value < upper:
+            return label
+    return levels[-1][1]
+
+
+def season_of(region: str, month: int) -> str:
+    """Tên mùa của tháng theo khí hậu vùng (mặc định bốn mùa kiểu miền Bắc)"""
+    return REGION_SEASONS.get(region, NORTH_SEASONS).get(int(month), f'tháng {month}')
+
+
+def _num(value: float, digits: int = 1) -> str:
+    return f"{float(value):.{digits}f}"
+
+
+class TemplateResponder:
+    """
+    Viết phản hồi giới thiệu địa điểm từ các Jinja template biên dịch sẵn, không gọi LLM.
+    Câu mở đầu, từng địa điểm và câu kết được chọn từ các nhóm template khác nhau; mô tả thời tiết
+    suy ra từ số liệu, mùa và cách gọi vùng theo region/month của từng gợi ý.
+    Lựa chọn template có seed theo câu hỏi và danh sách địa điểm nên cùng đầu vào cho cùng phản hồi.
+    """
+
+    def __init__(self, max_items: int = 5):
+        self.max_items = max_items
+        env = Environment(autoescape=False, undefined=StrictUndefined, keep_trailing_newline=False)
+        env.filters['num'] = _num
+        self.intros = [env.from_string(source) for source in INTRO_TEMPLATES]
+        self.items = [env.from_string(source) for source in ITEM_TEMPLATES]
+        self.outros = [env.from_string(source) for source in OUTRO_TEMPLATES]
+
+    @staticmethod
+    def _seed(user_input: str, recommendations: List[Dict]) -> int:
+        key = user_input + '\x00' + '\x00'.join(str(rec.get('city')) for rec in recommendations)
+        return zlib.crc32(key.encode('utf-8'))
+
+    @staticmethod
+    def _scope(recommendations: List[Dict]) -> str:
+        """Phạm vi chung của các gợi ý (cùng vùng, cùng tháng) để đưa vào câu mở đầu"""
+        regions = {rec['region'] for rec in recommendations}
+        months = {rec['month'] for rec in recommendations}
+        scope = ''
+        if len(regions) == 1:
+            scope += f" ở {REGION_NAMES.get(next(iter(regions)), next(iter(regions)))}"
+        if len(months) == 1:
+            scope += f" vào tháng {next(iter(months))}"
+        return scope
+
+    @staticmethod
+    def _want(recommendations: List[Dict]) -> str:
+        terrains = {rec.get('terrain') for rec in recommendations}
+        if terrains == {'ven biển'}:
+            return "Nếu bạn muốn đi biển"
+        if terrains == {'miền núi'}:
+            return "Nếu bạn muốn lên núi"
+        return "Dựa trên yêu cầu của bạn"
+
+    @staticmethod
+    def _tip(recommendations: List[Dict]) -> str:
+        first = recommendations[0]
+        if first['totalprecip_mm'] >= 10:
+            return "Nhớ mang theo áo mưa vì đang vào mùa mưa."
+        if first['avgtemp_c'] >= 28:
+            return "Đừng quên kem chống nắng và nước uống nhé."
+        if first['avgtemp_c'] < 20:
+            return "Bạn nhớ mang thêm áo ấm vì trời khá lạnh."
+        return "Thời tiết khá dễ chịu nên bạn chỉ cần hành lý gọn nhẹ."
+
+    def _item_context(self, i: int, rec: Dict, rng: random.Random) -> Dict:
+        activities = TERRAIN_ACTIVITIES.get(rec.get('terrain'), TERRAIN_ACTIVITIES['đồng bằng'])
+        # Thành phố trùng tên tỉnh (Lào Cai, Sơn La...) chỉ ghi một lần
+        place = rec['city'] if rec['city'] == rec['province'] else f"{rec['city']}, {rec['province']}"
+        return {
+            'i': i,
+            'r': rec,
+            'place': place,
+            'region': REGION_NAMES.get(rec['region'], rec['region']),
+            'season': season_of(rec['region'], rec['month']),
+            'temp': describe(rec['avgtemp_c'], TEMPERATURE_LEVELS),
+            'rain': describe(rec['totalprecip_mm'], RAIN_LEVELS),
+            'wind': describe(rec['maxwind_kph'], WIND_LEVELS),
+            'humidity': describe(rec['avghumidity'], HUMIDITY_LEVELS),
+            'clouds': describe(rec['cloud_cover_mean'], CLOUD_LEVELS),
+            'activity': rng.choice(activities),
+        }
+
+    def render(self, user_input: str, recommendations: List[Dict], seed: Optional[int] = None) -> str:
+        """Phản hồi hoàn chỉnh cho các địa điểm gợi ý (recommendations không rỗng)"""
+        recommendations = recommendations[:self.max_items]
+        rng = random.Random(self._seed(user_input, recommendations) if seed is None else seed)
+
+        intro = rng.choice(self.intros).render(count=len(recommendations), scope=self._scope(recommendations),
+                                               want=self._want(recommendations))
+        # Xoay vòng template cho các địa điểm để hai dòng liền nhau không cùng cấu trúc
+        offset = rng.randrange(len(self.items))
+        lines = [self.items[(offset + i) % len(self.items)].render(**self._item_context(i + 1, rec, rng))
+                 for i, rec in enumerate(recommendations)]
+        outro = rng.choice(self.outros).render(tip=self._tip(recommendations))
+        return intro + "\n\n" + "\n\n".join(lines) + "\n\n" + outro
@@ -0,0 +1,207 @@
+import re
+from typing import Dict, Optional, Sequence, Tuple
+
+from cache_utils import LRUCache
+
+# Từ khóa liên quan đến du lịch - mở rộng và chi tiết hơn
+TRAVEL_KEYWORDS = [
+    # Từ khóa du lịch chung (cụ thể hơn)
+    r'du\s*lịch', r'đi\s*chơi', r'nghỉ\s*dưỡng', r'tham\s*quan', r'tour',
+    r'địa\s*điểm\s*du\s*lịch', r'nơi\s*du\s*lịch', r'điểm\s*đến',
+
+    # Địa danh và vùng miền
+    r'thành\s*phố', r'tỉnh', r'vùng', r'khu\s*vực',
+    r'miền\s*bắc', r'miền\s*trung', r'miền\s*nam', r'tây\s*nguyên',
+    r'bắc\s*bộ', r'trung\s*bộ', r'nam\s*bộ',
+
+    # Địa hình và cảnh quan
+    r'biển', r'núi', r'đồng\s*bằng', r'ven\s*biển', r'bãi\s*biển',
+    r'leo\s*núi', r'tắm\s*biển', r'ngắm\s*cảnh', r'phong\s*cảnh',
+
+    # Thời tiết và khí hậu cho du lịch
+    r'thời\s*tiết.*du\s*lịch', r'khí\s*hậu.*du\s*lịch',
+    r'thời\s*tiết.*tháng', r'khí\s*hậu.*tháng',
+    r'mát\s*mẻ', r'nóng.*du\s*lịch', r'lạnh.*du\s*lịch',
+    r'mùa\s*khô', r'mùa\s*mưa', r'mùa\s*xuân', r'mùa\s*hè', r'mùa\s*thu', r'mùa\s*đông',
+
+    # Tên địa danh cụ thể
+    r'hà\s*nội', r'sài\s*gòn', r'tp\s*hồ\s*chí\s*minh', r'đà\s*nẵng',
+    r'huế', r'nha\s*trang', r'hạ\s*long', r'sapa', r'đà\s*lạt',
+    r'phú\s*quốc', r'cần\s*thơ', r'hội\s*an', r'vũng\s*tàu',
+
+    # Hoạt động du lịch
+    r'khách\s*sạn', r'resort', r'homestay', r'lưu\s*trú',
+    r'ăn\s*uống.*du\s*lịch', r'món\s*ngon.*địa\s*phương', r'đặc\s*sản', r'ẩm\s*thực.*du\s*lịch',
+    r'lễ\s*hội', r'văn\s*hóa.*du\s*lịch', r'truyền\s*thống.*du\s*lịch',
+
+    # Từ khóa gợi ý cụ thể về du lịch
+    r'gợi\s*ý.*du\s*lịch', r'gợi\s*ý.*địa\s*điểm', r'khuyên.*du\s*lịch',
+    r'nên\s*đi.*đâu', r'đi\s*đâu.*du\s*lịch', r'ở\s*đâu.*du\s*lịch',
+    r'muốn\s*đi.*biển', r'muốn\s*đi.*núi', r'muốn\s*đi.*du\s*lịch'
+]
+
+# Từ khóa ngắn cần có context (chỉ chấp nhận khi có từ khóa khác)
+SHORT_KEYWORDS = [
+    r'\btháng\b', r'\bmùa\b', r'\bgió\b', r'\bđộ\s*ẩm\b', r'\bnhiệt\s*độ\b',
+    r'\bthời\s*tiết\b', r'\bkhí\s*hậu\b'
+]
+
+# Tháng theo thứ tự ưu tiên (12, 11, 10 trước để "tháng mười hai" không bị hiểu là tháng 10)
+MONTH_PATTERNS = {
+    12: [r'tháng\s*12\b', r'tháng\s*mười\s*hai\b'],
+    11: [r'tháng\s*11\b', r'tháng\s*mười\s*một\b'],
+    10: [r'tháng\s*10\b', r'tháng\s*mười\b(?!\s*(một|hai))'],
+    1: [r'tháng\s*1\b', r'tháng\s*một\b'], 2: [r'tháng\s*2\b', r'tháng\s*hai\b'],
+    3: [r'tháng\s*3\b', r'tháng\s*ba\b'], 4: [r'tháng\s*4\b', r'tháng\s*tư\b'],
+    5: [r'tháng\s*5\b', r'tháng\s*năm\b'], 6: [r'tháng\s*6\b', r'tháng\s*sáu\b'],
+    7: [r'tháng\s*7\b', r'tháng\s*bảy\b'], 8: [r'tháng\s*8\b', r'tháng\s*tám\b'],
+    9: [r'tháng\s*9\b', r'tháng\s*chín\b']
+}
+
+_NUMBER = r'(\d+(?:\.\d+)?)'
+
+# Thuộc tính thời tiết: (khoảng hợp lệ, pattern số + đơn vị theo thứ tự, [(pattern từ khóa, giá trị)] theo thứ tự)
+WEATHER_RULES = {
+    'avgtemp_c': ((15, 35),
+                  [_NUMBER + r'\s*(?:độ|°)\s*c?\b', r'nhiệt\s*độ\s*' + _NUMBER],
+                  [(r'mát\s*mẻ|lạnh', 20.0), (r'nóng|ấm\s*áp', 30.0), (r'ôn\s*hòa|dễ\s*chịu', 25.0)]),
+    'maxwind_kph': ((5, 30),
+                    [_NUMBER + r'\s*km/h\b', r'gió\s*' + _NUMBER],
+                    [(r'không\s*thích\s*gió|ít\s*gió', 6.0), (r'gió\s*nhẹ', 8.0), (r'gió\s*mạnh', 25.0)]),
+    'avghumidity': ((50, 90),
+                    [_NUMBER + r'\s*%\b', r'độ\s*ẩm\s*' + _NUMBER],
+                    [(r'khô\s*ráo|khô', 55.0), (r'ẩm\s*ướt|ẩm', 80.0), (r'vừa\s*phải', 70.0)]),
+    'totalprecip_mm': ((0, 30),
+                       [_NUMBER + r'\s*mm\b', r'mưa\s*' + _NUMBER],
+                       [(r'không\s*mưa', 0.0), (r'ít\s*mưa|khô\s*ráo', 10.0),
+                        (r'mưa\s*vừa|bình\s*thường', 20.0), (r'mưa\s*nhiều|mùa\s*mưa', 30.0)]),
+    'cloud_cover_mean': ((0, 100),
+                         [_NUMBER + r'\s*%\s*mây', r'mây\s*' + _NUMBER],
+                         [(r'trời\s*quang|ít\s*mây', 20.0), (r'nhiều\s*mây|u\s*ám', 80.0),
+                          (r'mây\s*vừa|bình\s*thường', 50.0)])
+}
+
+# Vùng miền và địa hình theo thứ tự ưu tiên
+REGION_PATTERNS = {
+    "Tây Nguyên": [r'tây\s*nguyên', r'đà\s*lạt'],
+    "Đồng bằng sông Hồng": [r'hà\s*nội', r'hải\s*phòng', r'miền\s*bắc'],
+    "Đồng bằng sông Cửu Long": [r'cần\s*thơ', r'miền\s*nam', r'miền\s*tây'],
+    "Bắc Trung Bộ và Duyên hải miền Trung": [r'miền\s*trung', r'huế', r'đà\s*nẵng', r'nha\s*trang']
+}
+
+TERRAIN_PATTERNS = {
+    "ven biển": [r'biển', r'bãi\s*biển', r'tắm\s*biển'],
+    "miền núi": [r'núi', r'leo\s*núi', r'vùng\s*núi'],
+    "đồng bằng": [r'đồng\s*bằng', r'nông\s*thôn']
+}
+
+# Các trường preferences mà luật trích xuất được
+EXTRACTED_FIELDS = ('month', *WEATHER_RULES, 'region', 'terrain')
+
+
+class RuleMatcher:
+    """
+    Danh sách luật regex biên dịch sẵn một lần; scan chạy re.search của từng luật trên cùng một chuỗi.
+    """
+
+    def __init__(self, rules: Sequence[Tuple[str, str]]):
+        self._rules = [(name, re.compile(pattern)) for name, pattern in rules]
+
+    def scan(self, text: str) -> Dict[str, Tuple[Optional[str], ...]]:
+        """Các luật khớp -> (đoạn khớp, các nhóm con của luật)"""
+        found = {}
+        for name, regex in self._rules:
+            match = regex.search(text)
+            if match is not None:
+                found[name] = (match.group(0),) + match.groups()
+        return found
+
+
+class RuleExtractor:
+    """
+    Kiểm tra chủ đề và trích xuất preferences bằng luật, không gọi LLM.
+
+    Toàn bộ từ khóa chủ đề, tháng, thuộc tính thời tiết, vùng miền và địa hình được biên dịch sẵn trong một
+    RuleMatcher; mỗi tin nhắn chỉ được chuyển chữ thường và quét một lần (kết quả quét được cache).
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        rules = [('travel', '|'.join(TRAVEL_KEYWORDS)), ('short', '|'.join(SHORT_KEYWORDS))]
+        rules += [(f'month:{month}', '|'.join(patterns)) for month, patterns in MONTH_PATTERNS.items()]
+        for field, (_, number_patterns, keyword_rules) in WEATHER_RULES.items():
+            rules += [(f'{field}:number:{i}', pattern) for i, pattern in enumerate(number_patterns)]
+            rules += [(f'{field}:keyword:{i}', pattern) for i, (pattern, _) in enumerate(keyword_rules)]
+        rules += [(f'region:{region}', '|'.join(patterns)) for region, patterns in REGION_PATTERNS.items()]
+        rules += [(f'terrain:{terrain}', '|'.join(patterns)) for terrain, patterns in TERRAIN_PATTERNS.items()]
+        self.matcher = RuleMatcher(rules)
+        self._scans = LRUCache(maxsize=cache_size)
+
+    def _scan(self, user_input: str) -> Tuple[Dict, int]:
+        """(luật khớp, số từ) của tin nhắn đã chuyển chữ thường"""
+        result = self._scans.get(user_input)
+        if result is None:
+            text = user_input.lower().strip()
+            result = (self.matcher.scan(text), len(text.split()))
+            self._scans.set(user_input, result)
+        return result
+
+    def topic(self, user_input: str) -> Dict:
+        """
+        Kiểm tra chủ đề bằng từ khóa; chỉ chấp nhận câu có từ khóa du lịch rõ ràng
+        """
+        found, word_count = self._scan(user_input)
+
+        # Nếu có từ khóa du lịch chính rõ ràng
+        if 'travel' in found:
+            return {
+                "is_travel_related": True,
+                "confidence": 0.8,
+                "reason": "Chứa từ khóa du lịch rõ ràng"
+            }
+
+        # Nếu chỉ có từ khóa ngắn và câu đủ dài (có thể là về du lịch)
+        if 'short' in found and word_count >= 4:
+            return {
+                "is_travel_related": True,
+                "confidence": 0.6,
+                "reason": "Có từ khóa liên quan, có thể về du lịch"
+            }
+
+        # Nếu câu quá ngắn (dưới 3 từ)
+        if word_count < 3:
+            return {
+                "is_travel_related": False,
+                "confidence": 0.9,
+                "reason": "Câu quá ngắn, cần nói rõ hơn về du lịch"
+            }
+
+        # Nếu câu dài nhưng không có từ khóa du lịch
+        return {
+            "is_travel_related": False,
+            "confidence": 0.7,
+            "reason": "Không chứa từ khóa du lịch"
+        }
+
+    def extract(self, user_input: str) -> Dict:
+        """
+        Giá trị các trường preferences tìm được trong tin nhắn (None nếu không có)
+        """
+        found, _ = self._scan(user_input)
+        values = dict.fromkeys(EXTRACTED_FIELDS)
+
+        values['month'] = next((month for month in MONTH_PATTERNS if f'month:{month}' in found), None)
+
+        for field, ((low, high), number_patterns, keyword_rules) in WEATHER_RULES.items():
+            # Số + đơn vị trước (lần xuất hiện đầu tiên của từng pattern), rồi đến từ khóa
+            for i in range(len(number_patterns)):
+                match = found.get(f'{field}:number:{i}')
+                if match is not None and low <= float(match[1]) <= high:
+                    values[field] = float(match[1])
+                    break
+            else:
+                values[field] = next((value for i, (_, value) in enumerate(keyword_rules)
+                                      if f'{field}:keyword:{i}' in found), None)
+
+        values['region'] = next((region for region in REGION_PATTERNS if f'region:{region}' in found), None)
+        values['terrain'] = next((terrain for terrain in TERRAIN_PATTERNS if f'terrain:{terrain}' in found), None)
+        return values
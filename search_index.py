@@ -0,0 +1,262 @@
+import bisect
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from cache_utils import LRUCache
+
+
+def fold_diacritics(text: str) -> str:
+    """
+    Chuẩn hóa chuỗi để tìm kiếm: bỏ dấu tiếng Việt, đ -> d, chữ thường, gộp khoảng trắng
+    """
+    text = unicodedata.normalize('NFD', str(text).lower())
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = text.replace('đ', 'd')
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _lower_collapsed(text: str) -> str:
+    """Chữ thường, gộp khoảng trắng (giữ nguyên dấu)"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', str(text).lower())).strip()
+
+
+def _banded_distances(a: str, b: str, max_distance: int) -> Optional[List[int]]:
+    """
+    Dòng cuối của bảng Levenshtein giữa a và b (khoảng cách từ a tới từng tiền tố b[:j]), chỉ tính các ô
+    trong dải |i - j| <= max_distance; ô ngoài dải và ô vượt ngưỡng là max_distance + 1.
+    None nếu mọi ô của một dòng đều vượt ngưỡng (dừng sớm)
+    """
+    limit = max_distance + 1
+    previous = [min(j, limit) for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        current = [limit] * (len(b) + 1)
+        current[0] = min(i, limit)
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != b[j - 1]), limit)
+        if min(current) >= limit:
+            return None
+        previous = current
+    return previous
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Khoảng cách Levenshtein giữa a và b, dừng sớm và trả về max_distance + 1 khi vượt ngưỡng
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    row = _banded_distances(a, b, max_distance)
+    return row[-1] if row is not None else max_distance + 1
+
+
+def bounded_prefix_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Khoảng cách Levenshtein nhỏ nhất giữa a và một tiền tố khác rỗng của b (một lần tính bảng cho mọi
+    độ dài tiền tố), max_distance + 1 khi vượt ngưỡng
+    """
+    row = _banded_distances(a, b[:len(a) + max_distance], max_distance)
+    return min(row[1:], default=max_distance + 1) if row is not None else max_distance + 1
+
+
+class LocationSearchIndex:
+    """
+    Index tìm kiếm địa điểm không phân biệt dấu, hỗ trợ gõ sai chính tả và autocomplete.
+
+    Mỗi "term" là tên thành phố hoặc tỉnh đã bỏ dấu. Index gồm:
+    - posting list n-gram (1-3 ký tự) -> term, dùng cho tìm kiếm chuỗi con
+    - danh sách hậu tố theo từ đã sắp xếp, dùng bisect để tìm theo tiền tố
+    - danh sách dòng (theo thứ tự đầu vào) và thành phố của từng term
+    """
+
+    NGRAM_SIZE = 3
+
+    def __init__(self, names: Sequence[str], provinces: Sequence[str],
+                 cities: Optional[List[Dict]] = None, cache_size: int = 4096):
+        """
+        names, provinces: tên và tỉnh của từng dòng (thứ tự dòng được giữ nguyên trong kết quả)
+        cities: thông tin hiển thị của từng thành phố cho autocomplete, khóa 'city'
+        """
+        self._terms = []
+        self._term_ids = {}
+        self._term_rows = []
+        self._term_cities = []
+        self._term_is_name = []
+        self._term_variants = []
+
+        city_index = {}
+        self._cities = []
+        for city in cities or []:
+            city_index[city['city']] = len(self._cities)
+            self._cities.append(city)
+
+        for row, (name, province) in enumerate(zip(names, provinces)):
+            if name not in city_index:
+                city_index[name] = len(self._cities)
+                self._cities.append({'city': name, 'province': province})
+            for text, is_name in ((name, True), (province, False)):
+                term_id = self._add_term(fold_diacritics(text), is_name)
+                self._term_variants[term_id].add(_lower_collapsed(text))
+                self._term_rows[term_id].append(row)
+                self._term_cities[term_id].add(city_index[name])
+
+        self._term_rows = [np.array(rows, dtype=np.int64) for rows in self._term_rows]
+
+        # N-gram -> term ids (tìm chuỗi con)
+        self._ngrams = {}
+        for term_id, term in enumerate(self._terms):
+            for n in range(1, self.NGRAM_SIZE + 1):
+                for i in range(len(term) - n + 1):
+                    self._ngrams.setdefault(term[i:i + n], set()).add(term_id)
+
+        # Hậu tố bắt đầu từ mỗi từ -> tìm theo tiền tố bằng bisect
+        suffixes = []
+        for term_id, term in enumerate(self._terms):
+            for match in re.finditer(r'\S+', term):
+                suffixes.append((term[match.start():], term_id, match.start() == 0))
+        suffixes.sort()
+        self._suffix_keys = [suffix for suffix, _, _ in suffixes]
+        self._suffix_entries = [(term_id, at_start) for _, term_id, at_start in suffixes]
+
+        self._autocomplete_cache = LRUCache(maxsize=cache_size)
+        self._search_cache = LRUCache(maxsize=cache_size)
+
+    def _add_term(self, term: str, is_name: bool) -> int:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = len(self._terms)
+            self._term_ids[term] = term_id
+            self._terms.append(term)
+            self._term_rows.append([])
+            self._term_cities.append(set())
+            self._term_variants.append(set())
+            self._term_is_name.append(is_name)
+        else:
+            self._term_is_name[term_id] = self._term_is_name[term_id] or is_name
+        return term_id
+
+    def _substring_terms(self, query: str) -> List[int]:
+        """Các term chứa query như chuỗi con"""
+        if len(query) <= self.NGRAM_SIZE:
+            return sorted(self._ngrams.get(query, ()))
+
+        candidates = None
+        for i in range(len(query) - self.NGRAM_SIZE + 1):
+            posting = self._ngrams.get(query[i:i + self.NGRAM_SIZE])
+            if not posting:
+                return []
+            candidates = set(posting) if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        return sorted(term_id for term_id in candidates if query in self._terms[term_id])
+
+    def _prefix_terms(self, query: str) -> Dict[int, bool]:
+        """Các term có một từ bắt đầu bằng query -> True nếu khớp ngay đầu term"""
+        matches = {}
+        start = bisect.bisect_left(self._suffix_keys, query)
+        for i in range(start, len(self._suffix_keys)):
+            if not self._suffix_keys[i].startswith(query):
+                break
+            term_id, at_start = self._suffix_entries[i]
+            matches[term_id] = matches.get(term_id, False) or at_start
+        return matches
+
+    def _fuzzy_terms(self, query: str) -> Dict[int, int]:
+        """Các term gần đúng với query (cả term hoặc tiền tố của một từ) -> khoảng cách"""
+        # Query ngắn chỉ cho sai 1 ký tự: sai 2 ký tự trên 5 ký tự thì gần như mọi tên ngắn đều khớp
+        max_distance = 1 if len(query) <= 5 else 2
+        # Lọc theo bigram: mỗi lần sửa làm mất tối đa 2 bigram của query, nên term khớp trong ngưỡng
+        # chứa ít nhất (số bigram của query - 2 * max_distance) bigram của query
+        shared = {}
+        for i in range(len(query) - 1):
+            for term_id in self._ngrams.get(query[i:i + 2], ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+        min_shared = max(1, len(query) - 1 - 2 * max_distance)
+
+        matches = {}
+        for term_id, count in shared.items():
+            if count < min_shared:
+                continue
+            term = self._terms[term_id]
+            best = bounded_edit_distance(query, term, max_distance)
+            for match in re.finditer(r'\S+', term):
+                if best == 0:
+                    break
+                best = min(best, bounded_prefix_distance(query, term[match.start():], max_distance))
+            if best <= max_distance:
+                matches[term_id] = best
+        return matches
+
+    def _accent_exact_terms(self, query: str, term_ids: List[int]) -> List[int]:
+        """Nếu query có dấu, ưu tiên các term khớp đúng dấu (giữ độ chính xác như trước)"""
+        lowered = _lower_collapsed(query)
+        if lowered == fold_diacritics(query):
+            return term_ids
+        exact = [term_id for term_id in term_ids
+                 if any(lowered in variant for variant in self._term_variants[term_id])]
+        return exact or term_ids
+
+    def search_rows(self, query: str) -> np.ndarray:
+        """
+        Các dòng có tên hoặc tỉnh khớp với query (chuỗi con, không phân biệt dấu),
+        nếu không có thì dùng các term gần đúng có khoảng cách nhỏ nhất (term xa hơn bị bỏ, không chỉ xếp sau).
+        Trả về chỉ số dòng tăng dần (mảng chỉ đọc, được cache theo query như autocomplete).
+        """
+        key = _lower_collapsed(query)
+        rows = self._search_cache.get(key)
+        if rows is not None:
+            return rows
+
+        folded = fold_diacritics(query)
+        term_ids = self._accent_exact_terms(query, self._substring_terms(folded)) if folded else []
+        if folded and not term_ids:
+            fuzzy = self._fuzzy_terms(folded)
+            best = min(fuzzy.values(), default=None)
+            term_ids = [term_id for term_id, distance in fuzzy.items() if distance == best]
+        if term_ids:
+            rows = np.unique(np.concatenate([self._term_rows[term_id] for term_id in term_ids]))
+        else:
+            rows = np.array([], dtype=np.int64)
+        rows.setflags(write=False)
+        self._search_cache.set(key, rows)
+        return rows
+
+    def autocomplete(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Gợi ý thành phố (không trùng lặp) theo thứ tự: tên bắt đầu bằng query, một từ trong tên
+        bắt đầu bằng query, tỉnh khớp tiền tố, chuỗi con, rồi gần đúng
+        """
+        folded = fold_diacritics(query)
+        if not folded:
+            return []
+
+        key = (folded, limit)
+        cached = self._autocomplete_cache.get(key)
+        if cached is not None:
+            return [dict(suggestion) for suggestion in cached]
+
+        city_rank = {}
+
+        def add(term_id: int, rank: tuple):
+            for city_id in self._term_cities[term_id]:
+                if city_id not in city_rank or rank < city_rank[city_id]:
+                    city_rank[city_id] = rank
+
+        for term_id, at_start in self._prefix_terms(folded).items():
+            if self._term_is_name[term_id]:
+                add(term_id, (0 if at_start else 1, 0))
+            else:
+                add(term_id, (2, 0))
+        for term_id in self._substring_terms(folded):
+            add(term_id, (3, 0))
+        if not city_rank:
+            for term_id, distance in self._fuzzy_terms(folded).items():
+                add(term_id, (4, distance))
+
+        ordered = sorted(city_rank, key=lambda city_id: (city_rank[city_id], self._cities[city_id]['city']))
+        suggestions = [dict(self._cities[city_id]) for city_id in ordered[:limit]]
+        self._autocomplete_cache.set(key, suggestions)
+        return [dict(suggestion) for suggestion in suggestions]
@@ -0,0 +1,41 @@
+import copy
+from typing import Dict, Optional
+
+from cache_utils import LRUCache
+
+# Các trường preferences được giữ qua các lượt chat
+SESSION_FIELDS = ('avgtemp_c', 'maxwind_kph', 'totalprecip_mm', 'avghumidity', 'cloud_cover_mean',
+                  'month', 'region', 'terrain', 'preferences')
+
+
+def merge_preferences(previous: Dict, delta: Dict) -> Dict:
+    """Preferences mới: giá trị của previous, ghi đè bởi các trường có giá trị (khác None) trong delta"""
+    merged = dict(previous)
+    merged.update({field: value for field, value in delta.items()
+                   if field in SESSION_FIELDS and value is not None})
+    return merged
+
+
+class SessionStore:
+    """
+    Preferences đã gộp của mỗi cuộc hội thoại (theo session_id), giữ trong bộ nhớ:
+    giới hạn maxsize session (LRU), session không có lượt du lịch mới trong ttl giây thì bị xóa.
+    Lượt sau chỉ cần trích xuất phần thay đổi (delta) rồi gộp vào preferences đã lưu.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = 30 * 60):
+        self._sessions = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict]:
+        """Preferences đã gộp của session (bản sao), None nếu chưa có hoặc đã hết hạn"""
+        if not session_id:
+            return None
+        preferences = self._sessions.get(session_id)
+        return copy.deepcopy(preferences) if preferences is not None else None
+
+    def set(self, session_id: Optional[str], preferences: Dict):
+        if session_id:
+            self._sessions.set(session_id, {field: preferences.get(field) for field in SESSION_FIELDS})
+
+    def stats(self) -> Dict:
+        return self._sessions.stats()
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời cùng key: lời gọi đầu tiên (leader) chạy fn, các lời gọi đến khi fn chưa xong
+    chờ và nhận cùng kết quả (hoặc cùng exception). Key được xóa khi fn xong nên lời gọi sau đó chạy lại.
+    fn chạy trong task riêng: caller bị hủy (client ngắt kết nối) không làm hủy kết quả của các caller khác.
+    Chỉ dùng trong một event loop.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Kết quả của fn cho key và True nếu dùng chung kết quả của một lời gọi đang chạy"""
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Lấy exception để không bị cảnh báo khi mọi caller đã bị hủy
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(self._in_flight),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced
+        }
@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 của nội dung file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_snapshot_path(csv_path: str) -> str:
+    """Đường dẫn snapshot mặc định nằm cạnh file CSV: df_ranking.csv -> df_ranking.snapshot"""
+    return os.path.splitext(csv_path)[0] + ".snapshot"
+
+
+def build_snapshot(csv_path: str, snapshot_path: str, scaler_features: List[str]) -> dict:
+    """
+    Ghi snapshot nhị phân dạng cột của file CSV:
+    - cột số (int/float/bool) -> mảng độ rộng cố định <cột>.npy
+    - cột chuỗi -> mã int32 <cột>.codes.npy, danh sách giá trị trong manifest
+    - tham số StandardScaler của scaler_features trong manifest
+    """
+    df = pd.read_csv(csv_path)
+    os.makedirs(snapshot_path, exist_ok=True)
+
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+            np.save(os.path.join(snapshot_path, f"{column}.npy"), np.ascontiguousarray(series.to_numpy()))
+            columns.append({"name": column, "kind": "numeric", "dtype": str(series.dtype)})
+        else:
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            np.save(os.path.join(snapshot_path, f"{column}.codes.npy"), codes.astype(np.int32))
+            columns.append({"name": column, "kind": "text", "categories": [str(value) for value in categories]})
+
+    scaler = StandardScaler().fit(df[scaler_features])
+    stat = os.stat(csv_path)
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.time(),
+        "rows": int(len(df)),
+        "columns": columns,
+        "source": {"path": os.path.abspath(csv_path), "size": stat.st_size, "mtime": stat.st_mtime,
+                   "sha256": file_sha256(csv_path)},
+        "scaler": {
+            "features": list(scaler_features),
+            "mean": scaler.mean_.tolist(),
+            "var": scaler.var_.tolist(),
+            "scale": scaler.scale_.tolist(),
+            "n_samples_seen": int(scaler.n_samples_seen_),
+        },
+    }
+
+    # Ghi manifest sau cùng (qua file tạm) để snapshot chỉ hợp lệ khi đã ghi đủ các cột
+    manifest_path = os.path.join(snapshot_path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def is_snapshot_fresh(snapshot_path: str, csv_path: Optional[str]) -> bool:
+    """
+    Snapshot dùng được nếu có manifest đúng phiên bản và CSV nguồn (nếu còn) không thay đổi:
+    cùng kích thước và mtime với lúc tạo snapshot, hoặc (khi mtime khác, ví dụ file được chép lại
+    hay checkout) cùng sha256
+    """
+    manifest_path = os.path.join(snapshot_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return False
+    if csv_path is None or not os.path.exists(csv_path):
+        return True
+    stat = os.stat(csv_path)
+    source = manifest.get("source", {})
+    if stat.st_size != source.get("size"):
+        return False
+    return stat.st_mtime == source.get("mtime") or file_sha256(csv_path) == source.get("sha256")
+
+
+def load_snapshot(snapshot_path: str) -> Tuple[pd.DataFrame, StandardScaler]:
+    """
+    Nạp snapshot bằng memory-map: các cột số dùng chung trang bộ nhớ giữa các worker,
+    cột chuỗi được giải mã từ mã đã lưu
+    """
+    with open(os.path.join(snapshot_path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    data = {}
+    for column in manifest["columns"]:
+        name = column["name"]
+        if column["kind"] == "numeric":
+            data[name] = np.load(os.path.join(snapshot_path, f"{name}.npy"), mmap_mode="r")
+        else:
+            # Giải mã từ điển thành chuỗi thường (mã -1 -> giá trị thiếu ở cuối bảng tra)
+            codes = np.load(os.path.join(snapshot_path, f"{name}.codes.npy"), mmap_mode="r")
+            values = np.array(column["categories"] + [None], dtype=object)
+            data[name] = values[codes]
+    df = pd.DataFrame(data, copy=False)
+
+    # Khôi phục StandardScaler đã fit từ tham số trong manifest
+    params = manifest["scaler"]
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(params["mean"])
+    scaler.var_ = np.array(params["var"])
+    scaler.scale_ = np.array(params["scale"])
+    scaler.n_samples_seen_ = params["n_samples_seen"]
+    scaler.n_features_in_ = len(params["features"])
+    scaler.feature_names_in_ = np.array(params["features"], dtype=object)
+    return df, scaler
+
+
+def main():
+    from clustering import TravelRecommendationEngine
+
+    parser = argparse.ArgumentParser(description="Build binary columnar snapshot of the ranking dataset")
+    parser.add_argument("--csv", default="df_ranking.csv", help="source CSV file")
+    parser.add_argument("--out", default=None, help="snapshot directory (default: <csv name>.snapshot)")
+    args = parser.parse_args()
+
+    out = args.out or default_snapshot_path(args.csv)
+    started = time.perf_counter()
+    manifest = build_snapshot(args.csv, out, TravelRecommendationEngine.FEATURES)
+    print(f"Wrote snapshot {out}: {manifest['rows']} rows, {len(manifest['columns'])} columns "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -61,39 +61,12 @@ async function sendMessage() {
     addMessageToChat(message, 'user');
     
     try {
-        // Send request to backend
-        const response = await fetch('/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: message,
-                session_id: sessionId
-            })
-        });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            // Add bot response to chat với style phù hợp
-            addMessageToChat(data.response, 'bot', data.is_travel_related);
-
-            // Update recommendations và map chỉ khi có gợi ý du lịch
-            if (data.is_travel_related && data.has_recommendations) {
-                updateRecommendations(data.recommendations);
-                updateMap(data.recommendations);
-            } else if (data.is_travel_related && !data.has_recommendations) {
-                // Trường hợp liên quan du lịch nhưng không tìm được gợi ý
-                clearRecommendations();
-            } else {
-                // Trường hợp không liên quan du lịch - hiển thị hướng dẫn
-                showTravelGuidance();
-            }
+        // Stream phản hồi (SSE); trình duyệt không hỗ trợ đọc stream thì dùng /chat
+        if (window.ReadableStream && window.TextDecoder) {
+            await streamMessage(message);
         } else {
-            addMessageToChat('Xin lỗi, đã có lỗi xảy ra: ' + data.error, 'bot', false);
+            await sendMessageOnce(message);
         }
-        
     } catch (error) {
         console.error('Error:', error);
         addMessageToChat('Xin lỗi, không thể kết nối đến server. Vui lòng thử lại sau.', 'bot');
@@ -103,6 +76,130 @@ async function sendMessage() {
     }
 }
 
+// Gửi tin nhắn qua /chat và hiển thị khi có phản hồi đầy đủ
+async function sendMessageOnce(message) {
+    const response = await fetch('/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            message: message,
+            session_id: sessionId
+        })
+    });
+    
+    const data = await response.json();
+    
+    if (data.success) {
+        // Add bot response to chat với style phù hợp
+        addMessageToChat(data.response, 'bot', data.is_travel_related);
+        showResultPanel(data.is_travel_related, data.has_recommendations, data.recommendations);
+    } else {
+        addMessageToChat('Xin lỗi, đã có lỗi xảy ra: ' + data.error, 'bot', false);
+    }
+}
+
+// Gửi tin nhắn qua /chat/stream: hiển thị gợi ý ngay khi có, phản hồi hiện dần theo từng token
+async function streamMessage(message) {
+    const response = await fetch('/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify({
+            message: message,
+            session_id: sessionId
+        })
+    });
+    
+    if (response.ok && !response.body) {
+        // Không đọc được stream: gửi lại qua /chat
+        await sendMessageOnce(message);
+        return;
+    }
+    if (!response.ok) {
+        const data = await response.json();
+        addMessageToChat('Xin lỗi, đã có lỗi xảy ra: ' + data.error, 'bot', false);
+        return;
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let isTravelRelated = true;
+    let botMessage = null;
+    let botText = '';
+    
+    const handleEvent = (event, data) => {
+        if (event === 'preferences') {
+            isTravelRelated = data.is_travel_related;
+            if (!isTravelRelated) {
+                showTravelGuidance();
+            }
+        } else if (event === 'recommendations') {
+            showResultPanel(true, data.has_recommendations, data.recommendations);
+        } else if (event === 'token') {
+            if (!botMessage) {
+                botMessage = addMessageToChat('', 'bot', isTravelRelated);
+            }
+            botText += data.text;
+            setMessageText(botMessage, botText);
+        } else if (event === 'done') {
+            if (!botMessage) {
+                botMessage = addMessageToChat('', 'bot', data.is_travel_related);
+            }
+            setMessageText(botMessage, data.response);
+        } else if (event === 'error') {
+            addMessageToChat('Xin lỗi, đã có lỗi xảy ra: ' + data.error, 'bot', false);
+        }
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Mỗi sự kiện SSE kết thúc bằng một dòng trống
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (data) {
+                handleEvent(event, JSON.parse(data));
+            }
+        }
+    }
+}
+
+// Update recommendations/map panel after a chat response
+function showResultPanel(isTravelRelated, hasRecommendations, recommendations) {
+    // Update recommendations và map chỉ khi có gợi ý du lịch
+    if (isTravelRelated && hasRecommendations) {
+        updateRecommendations(recommendations);
+        updateMap(recommendations);
+    } else if (isTravelRelated && !hasRecommendations) {
+        // Trường hợp liên quan du lịch nhưng không tìm được gợi ý
+        clearRecommendations();
+    } else {
+        // Trường hợp không liên quan du lịch - hiển thị hướng dẫn
+        showTravelGuidance();
+    }
+}
+
 // Show/hide loading state
 function showLoadingState(loading) {
     const sendButton = document.getElementById('sendButtonText');
@@ -139,13 +236,21 @@ function addMessageToChat(message, sender, isTravelRelated = true) {
 
     messageDiv.innerHTML = `
         <div class="message-content">
-            <strong>${sender === 'user' ? 'Bạn' : 'Chatbot'}:</strong> ${message}
+            <strong>${sender === 'user' ? 'Bạn' : 'Chatbot'}:</strong> <span class="message-text">${message}</span>
         </div>
         <div class="message-time">${currentTime}</div>
     `;
 
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
+}
+
+// Update text of a message đang được stream
+function setMessageText(messageDiv, text) {
+    messageDiv.querySelector('.message-text').textContent = text;
+    const chatMessages = document.getElementById('chatMessages');
+    chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
 // Update recommendations list
@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Database SQLite tạm, đặt trước khi module nào import models: test không ghi vào travel_chatbot.db của repo
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="travel_chatbot_test_"),
+                                                         "travel_chatbot.db")
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """Recommendation engine trên dataset đi kèm repo (đường dẫn dataset tương đối với thư mục gốc)"""
+    from clustering import TravelRecommendationEngine
+
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        yield TravelRecommendationEngine()
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient của app (main đọc templates, static và dataset theo đường dẫn tương đối)"""
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ.setdefault("DATASET_WATCH_INTERVAL", "0")
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        from fastapi.testclient import TestClient
+        import main
+
+        with TestClient(main.app) as test_client:
+            yield test_client
+    finally:
+        os.chdir(cwd)
+
+
+class LLMStub:
+    """openai_stub chạy nền: base_url cho TravelChatbot và số request đã nhận theo loại prompt"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    def calls(self) -> dict:
+        with urllib.request.urlopen(self.base_url[:-len("/v1")] + "/stats") as response:
+            return json.load(response)["by_kind"]
+
+
+@pytest.fixture(scope="session")
+def llm_stub():
+    """Server giả lập OpenAI (openai_stub, trả lời theo luật, độ trễ cố định 50 ms) cho cả phiên test"""
+    from loadtest import start_stub
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return LLMStub(start_stub(port, ["fixed:50"], 0.0, 0))
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def admin_token(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret-token")
+    return "secret-token"
+
+
+def test_reload_rejects_wrong_or_missing_token(client, admin_token):
+    for headers in ({"X-Admin-Token": "secret-tokeN"}, {"X-Admin-Token": ""}, {}):
+        response = client.post("/api/admin/reload", headers=headers)
+        assert response.status_code == 401
+
+
+def test_reload_accepts_admin_token(client, admin_token):
+    response = client.post("/api/admin/reload", headers={"X-Admin-Token": admin_token})
+
+    assert response.status_code == 200
+    assert response.json()["success"]
@@ -0,0 +1,18 @@
+import json
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_lines_follow_input_order_with_invalid_profile_in_the_middle(client):
+    profiles = [{"avgtemp_c": 25, "month": 6}, {"avgtemp_c": 20}, "not a profile",
+                {"avgtemp_c": "hot"}, {"avgtemp_c": 30, "month": 12}]
+    response = client.post("/api/recommendations/batch", json={"preferences": profiles, "top_k": 3})
+
+    assert response.status_code == 200
+    lines = ndjson(response)
+    assert [line["index"] for line in lines] == list(range(len(profiles)))
+    assert [line["success"] for line in lines] == [True, True, False, False, True]
+    assert all(len(line["recommendations"]) == 3 for line in lines if line["success"])
+    assert all(line["error"] for line in lines if not line["success"])
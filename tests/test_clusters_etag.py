@@ -0,0 +1,39 @@
+import os
+
+import pandas as pd
+
+
+def test_matching_if_none_match_returns_304(client):
+    first = client.get("/api/clusters")
+    etag = first.headers["etag"]
+
+    assert first.status_code == 200
+    assert first.json()["clusters"]
+    not_modified = client.get("/api/clusters", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert client.get("/api/clusters", headers={"If-None-Match": '"other", ' + etag}).status_code == 304
+    assert client.get("/api/clusters", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_etag_changes_after_reload(client, tmp_path):
+    import main
+
+    engine = main.recommendation_engine
+    original_path = engine.data_path
+    etag = client.get("/api/clusters").headers["etag"]
+
+    # Dataset khác: bỏ một phần các dòng không phải centroid
+    df = pd.read_csv(original_path)
+    changed = df.drop(df[df["is_centroid"] != True].index[::2])
+    changed_path = os.path.join(tmp_path, "df_ranking.csv")
+    changed.to_csv(changed_path, index=False)
+    try:
+        engine.reload(changed_path)
+        response = client.get("/api/clusters", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+    finally:
+        engine.reload(original_path)
+    assert client.get("/api/clusters").headers["etag"] == etag
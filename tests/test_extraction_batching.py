@@ -0,0 +1,51 @@
+import asyncio
+import os
+
+MESSAGES = [
+    "Tôi muốn đi biển miền Trung vào tháng 6",
+    "Gợi ý nơi du lịch mát mẻ, ít mưa vào tháng 12",
+    "Đi núi tháng 10, nhiệt độ khoảng 20 độ, gió nhẹ",
+    "Tìm thành phố ven biển nắng ấm, độ ẩm thấp cho kỳ nghỉ hè",
+    "Muốn đi Tây Nguyên vào mùa khô, chỗ nào đẹp?",
+    "Du lịch miền Tây tháng 9 có nên không?",
+    "Tôi muốn đi biển miền Trung vào tháng 6",
+    "Địa điểm nghỉ dưỡng trời ít mây, không mưa tháng 4",
+]
+
+
+def extract_all(llm_stub, batch_size):
+    """Preferences trích xuất đồng thời cho MESSAGES với kích thước lô batch_size (1 là không gom lô)"""
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    chatbot = TravelChatbot(base_url=llm_stub.base_url, extraction_batch_size=batch_size,
+                            extraction_batch_window=0.05)
+
+    async def run():
+        return await asyncio.gather(*(chatbot.aextract_travel_preferences(message) for message in MESSAGES))
+
+    return chatbot, asyncio.run(run())
+
+
+def test_batched_extraction_matches_single_calls(llm_stub):
+    before = llm_stub.calls()
+    _, single = extract_all(llm_stub, 1)
+    middle = llm_stub.calls()
+    chatbot, batched = extract_all(llm_stub, 8)
+    after = llm_stub.calls()
+
+    assert batched == single
+    assert [preferences['month'] for preferences in single[:3]] == [6, 12, 10]
+    assert middle.get('extraction', 0) - before.get('extraction', 0) == len(MESSAGES)
+    # Cả lô trong một lần gọi; tin nhắn trùng chỉ gửi một lần
+    assert after.get('batch_extraction', 0) - middle.get('batch_extraction', 0) == 1
+    assert chatbot.extraction_batcher.stats()['batches'] == 1
+    assert chatbot.prompt_stats.stats()['batch_extraction']['parse_failures'] == 0
+
+
+def test_batches_split_by_max_size_keep_input_order(llm_stub):
+    _, single = extract_all(llm_stub, 1)
+    chatbot, batched = extract_all(llm_stub, 3)
+
+    assert batched == single
+    assert chatbot.extraction_batcher.stats()['batches'] == 3
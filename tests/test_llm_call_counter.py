@@ -0,0 +1,35 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+
+def _response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(content)))],
+                           usage=None)
+
+
+def test_batched_extraction_call_is_split_across_requests(monkeypatch):
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import LLMCallCounter, TravelChatbot
+
+    chatbot = TravelChatbot(extraction_batch_size=4, extraction_batch_window=0.05)
+
+    async def fake_acomplete(request, timeout=None, kind=None, counter=None):
+        if counter is not None:
+            counter.add()
+        return _response({"results": [{"id": 1, "month": 6}, {"id": 2, "month": 12}]})
+
+    monkeypatch.setattr(chatbot, "_acomplete", fake_acomplete)
+
+    async def run():
+        first, second = LLMCallCounter(), LLMCallCounter()
+        results = await asyncio.gather(chatbot.aextract_travel_preferences("đi biển tháng 6", None, first),
+                                       chatbot.aextract_travel_preferences("đi núi tháng 12", None, second))
+        return results, first, second
+
+    results, first, second = asyncio.run(run())
+
+    assert [result["month"] for result in results] == [6, 12]
+    assert chatbot.extraction_batcher.batches == 1
+    assert first.calls == second.calls == 0.5
@@ -0,0 +1,16 @@
+from loadtest import parse_sse
+
+
+def test_parse_sse_reads_events_in_order():
+    lines = ['event: meta', 'data: {"session_id": "s1"}', '',
+             'event: token', 'data: {"text": "Xin"}', '',
+             'event: done', 'data: {"response": "Xin chào"}', '']
+
+    assert parse_sse(lines) == [("meta", {"session_id": "s1"}), ("token", {"text": "Xin"}),
+                                ("done", {"response": "Xin chào"})]
+
+
+def test_parse_sse_keeps_last_event_without_trailing_blank_line():
+    lines = ['event: error', 'data: {"error": "boom", "response": "Xin lỗi"}']
+
+    assert parse_sse(lines) == [("error", {"error": "boom", "response": "Xin lỗi"})]
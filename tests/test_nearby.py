@@ -0,0 +1,61 @@
+import math
+
+import pandas as pd
+import pytest
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+
+def brute_force(lat, lon, radius_km, month):
+    """(city, month) -> khoảng cách của mọi dòng trong bán kính, duyệt toàn bộ dataset"""
+    df = pd.read_csv("df_ranking.csv")
+    found = {}
+    for row in df.itertuples():
+        distance = haversine(lat, lon, row.lat, row.lon)
+        if distance <= radius_km and (month is None or row.month == month):
+            found[(row.name, int(row.month))] = distance
+    return found
+
+
+@pytest.mark.parametrize("lat, lon, radius_km, month", [
+    (16.05, 108.2, 150, 6),
+    (21.03, 105.85, 40, None),
+    (10.78, 106.7, 300, 1),
+    (12.0, 109.0, 5, 3),
+])
+def test_nearby_matches_brute_force_haversine(client, lat, lon, radius_km, month):
+    expected = brute_force(lat, lon, radius_km, month)
+    params = {"lat": lat, "lon": lon, "radius_km": radius_km, "limit": 100}
+    if month is not None:
+        params["month"] = month
+
+    by_hci = client.get("/api/nearby", params=params).json()
+    by_distance = client.get("/api/nearby", params=dict(params, sort="distance")).json()
+
+    assert len(expected) <= 100
+    for body in (by_hci, by_distance):
+        assert body["total"] == len(expected)
+        assert {(row["city"], row["month"]): row["distance_km"] for row in body["results"]} == \
+            pytest.approx({key: round(distance, 3) for key, distance in expected.items()}, abs=1e-3)
+    scores = [row["score"] for row in by_hci["results"]]
+    assert scores == sorted(scores, reverse=True)
+    distances = [row["distance_km"] for row in by_distance["results"]]
+    assert distances == sorted(distances)
+
+
+def test_nearby_limit_keeps_highest_hci_and_closest(client):
+    df = pd.read_csv("df_ranking.csv")
+    df = df[df["month"] == 7]
+    distances = [haversine(21.03, 105.85, lat, lon) for lat, lon in zip(df["lat"], df["lon"])]
+    inside = df.assign(distance=distances).query("distance <= 500")
+    params = {"lat": 21.03, "lon": 105.85, "radius_km": 500, "month": 7, "limit": 5}
+
+    by_hci = client.get("/api/nearby", params=params).json()["results"]
+    by_distance = client.get("/api/nearby", params=dict(params, sort="distance")).json()["results"]
+
+    assert [row["score"] for row in by_hci] == pytest.approx(sorted(inside["hci"], reverse=True)[:5])
+    assert [row["distance_km"] for row in by_distance] == pytest.approx(sorted(inside["distance"])[:5], abs=1e-3)
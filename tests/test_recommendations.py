@@ -0,0 +1,21 @@
+import random
+
+
+def random_profiles(count, seed=0):
+    rng = random.Random(seed)
+    return [{'avgtemp_c': rng.uniform(15, 35), 'maxwind_kph': rng.uniform(5, 30),
+             'totalprecip_mm': rng.uniform(0, 30), 'avghumidity': rng.uniform(50, 90),
+             'cloud_cover_mean': rng.uniform(0, 100), 'month': rng.choice([None, 3, 7]),
+             'region': None, 'terrain': None} for _ in range(count)]
+
+
+def test_batch_matches_single_recommendations(engine):
+    # Các profile này từng cho kết quả khác nhau giữa recommend (đã làm tròn) và recommend_batch (giá trị gốc)
+    profiles = [
+        {'avgtemp_c': 21.3235, 'maxwind_kph': 10.3381, 'totalprecip_mm': 21.5197, 'avghumidity': 50.0943,
+         'cloud_cover_mean': 82.2731, 'month': 7, 'region': None, 'terrain': None},
+        {'avgtemp_c': 26.0353, 'maxwind_kph': 24.8629, 'totalprecip_mm': 5.11, 'avghumidity': 83.0578,
+         'cloud_cover_mean': 0.8076, 'month': 3, 'region': None, 'terrain': None},
+    ] + random_profiles(500)
+    batch = engine.recommend_batch(profiles, top_k=5)
+    assert [engine.recommend(profile, 5).ranks for profile in profiles] == [result.ranks for result in batch]
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, Deadline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake)
+    return fake
+
+
+def test_breaker_opens_then_half_opens_then_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cool_down=10.0)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 10.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Chỉ một lần gọi thử tại một thời điểm
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    assert breaker.stats()["trips"] == 1
+
+
+def test_failed_trial_reopens_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cool_down=5.0)
+    breaker.record_failure()
+    clock.now += 5.0
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["retry_in"] == 5.0
+
+
+def test_deadline_shares_remaining_time(clock):
+    deadline = Deadline(10.0)
+    clock.now += 4.0
+
+    assert deadline.remaining() == pytest.approx(6.0)
+    assert deadline.share(0.5) == pytest.approx(3.0)
+    clock.now += 7.0
+    assert deadline.expired
+
+
+def hanging_chatbot():
+    """TravelChatbot có client async không bao giờ trả lời"""
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    async def create(**request):
+        await asyncio.sleep(60)
+
+    chatbot = TravelChatbot()
+    chatbot.async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return chatbot
+
+
+def test_request_over_deadline_gets_fallback(engine):
+    from chat_pipeline import ChatPipeline
+
+    chatbot = hanging_chatbot()
+    message = "Tôi muốn đi biển miền Trung vào tháng 6"
+    pipeline = ChatPipeline(chatbot, engine, budget=1.0, analysis_mode='combined')
+
+    started = time.perf_counter()
+    asyncio.run(pipeline.arun(message))
+
+    assert time.perf_counter() - started < 1.5
+    # Phân tích và phản hồi đều dùng fallback bằng luật / phản hồi soạn sẵn
+    assert pipeline.topic_result == chatbot.rules.topic(message)
+    assert pipeline.is_travel_related
+    assert pipeline.preferences["month"] == 6
+    assert pipeline.recommendations
+    assert pipeline.response == chatbot._get_default_response(pipeline.recommendations)
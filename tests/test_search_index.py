@@ -0,0 +1,46 @@
+import pytest
+
+
+def top_city(engine, query):
+    results = engine.search_by_location(query, top_k=5)
+    return results[0]['city'] if results else None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("da nag", "Đà Nẵng"),
+    ("hanoi", "Hà Nội"),
+    ("nha trag", "Nha Trang"),
+    ("Đà Nẵng", "Đà Nẵng"),
+    ("vung tau", "Vũng Tàu"),
+])
+def test_misspelled_query_ranks_closest_city_first(engine, query, expected):
+    assert top_city(engine, query) == expected
+
+
+def test_fuzzy_results_keep_only_best_distance(engine):
+    names = {row['city'] for row in engine.search_by_location("da nag", top_k=50)}
+    assert names == {"Đà Nẵng"}
+
+
+def test_unknown_place_returns_no_distant_matches(engine):
+    # Sa Pa không có trong dataset: không trả về các thành phố chỉ gần giống (Phủ Lý, Đà Lạt, Cà Mau...)
+    assert engine.search_by_location("sa pa", top_k=5) == []
+
+
+def test_bounded_distances():
+    from search_index import bounded_edit_distance, bounded_prefix_distance
+
+    assert bounded_edit_distance("nha trag", "nha trang", 2) == 1
+    assert bounded_edit_distance("hanoi", "ha noi", 1) == 1
+    assert bounded_edit_distance("sa pa", "ca mau", 2) == 3
+    assert bounded_prefix_distance("da nag", "da nang", 2) == 1
+    assert bounded_prefix_distance("vung", "vung tau", 1) == 0
+    assert bounded_prefix_distance("x", "yz", 1) == 1
+
+
+def test_search_rows_are_cached_read_only(engine):
+    index = engine.state.search_index
+    rows = index.search_rows("nha trag")
+
+    assert index.search_rows("Nha  Trag") is rows
+    assert not rows.flags.writeable
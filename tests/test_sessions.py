@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from session_store import SessionStore, merge_preferences
+
+
+def test_merge_keeps_previous_fields_and_ignores_empty_or_unknown_ones():
+    previous = {'month': 6, 'region': 'Tây Nguyên', 'avgtemp_c': 22.0}
+    delta = {'month': 12, 'region': None, 'unknown': 'x'}
+
+    assert merge_preferences(previous, delta) == {'month': 12, 'region': 'Tây Nguyên', 'avgtemp_c': 22.0}
+    assert previous['month'] == 6
+
+
+@pytest.fixture(scope="module")
+def chatbot():
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    return TravelChatbot()
+
+
+def turn(chatbot, engine, store, session_id, message):
+    """Một lượt chat chỉ dùng luật (local-first) và phản hồi template, không gọi LLM"""
+    from chat_pipeline import ChatPipeline
+
+    return ChatPipeline(chatbot, engine, session_store=store, session_id=session_id, local_first_confidence=0.5,
+                        response_mode='template').run(message)
+
+
+def test_preferences_are_merged_across_turns(chatbot, engine):
+    store = SessionStore()
+    first = turn(chatbot, engine, store, 'a', "Tôi muốn đi biển miền Trung vào tháng 6")
+    assert first.previous_preferences is None
+    assert (first.preferences['month'], first.preferences['terrain']) == (6, 'ven biển')
+
+    second = turn(chatbot, engine, store, 'a', "còn tháng 12 thì sao?")
+    assert second.previous_preferences['month'] == 6
+    assert second.preference_delta == {'month': 12}
+    assert second.preferences['month'] == 12
+    assert second.preferences['terrain'] == 'ven biển'
+    assert second.preferences['region'] == first.preferences['region']
+    assert all(row['month'] == 12 for row in second.recommendations)
+
+    third = turn(chatbot, engine, store, 'a', "nhiệt độ khoảng 25 độ nhé")
+    assert third.preferences['avgtemp_c'] == 25
+    assert third.preferences['month'] == 12
+    assert store.get('a')['avgtemp_c'] == 25
+
+
+def test_off_topic_turn_keeps_session_and_sessions_are_separate(chatbot, engine):
+    store = SessionStore()
+    turn(chatbot, engine, store, 'a', "Tôi muốn đi biển miền Trung vào tháng 6")
+    saved = store.get('a')
+
+    refused = turn(chatbot, engine, store, 'a', "giải phương trình bậc hai giúp tôi")
+    other = turn(chatbot, engine, store, 'b', "còn tháng 12 thì sao?")
+
+    assert not refused.is_travel_related
+    assert store.get('a') == saved
+    assert other.previous_preferences is None
@@ -0,0 +1,69 @@
+import asyncio
+import os
+from collections import Counter
+
+
+def make_chatbot(llm_stub, **options):
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    return TravelChatbot(base_url=llm_stub.base_url, **options)
+
+
+def delta(before, after):
+    return {kind: count - before.get(kind, 0) for kind, count in after.items() if count != before.get(kind, 0)}
+
+
+def test_identical_concurrent_requests_run_the_pipeline_once(llm_stub, engine):
+    from chat_pipeline import ChatPipeline, ChatSingleFlight
+    from session_store import SessionStore
+
+    chatbot = make_chatbot(llm_stub)
+    store = SessionStore()
+    flight = ChatSingleFlight()
+    messages = ["Tôi muốn đi biển miền Trung vào tháng 6"] * 6 + ["  tôi muốn đi biển miền trung vào tháng 6! "] * 2
+
+    async def run():
+        pipelines = [ChatPipeline(chatbot, engine, session_store=store, session_id=f"s{i}")
+                     for i in range(len(messages))]
+        await asyncio.gather(*(flight.arun(pipeline, message) for pipeline, message in zip(pipelines, messages)))
+        return pipelines
+
+    before = llm_stub.calls()
+    pipelines = asyncio.run(run())
+    calls = delta(before, llm_stub.calls())
+
+    # Một lần chạy pipeline: kiểm tra chủ đề, trích xuất và tạo phản hồi, mỗi bước một lần gọi
+    assert calls == {'topic': 1, 'extraction': 1, 'response': 1}
+    assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 7, 'saved_llm_calls': 21.0}
+    assert len({pipeline.response for pipeline in pipelines}) == 1
+    assert Counter('coalesced' in pipeline.timings for pipeline in pipelines) == {True: 7, False: 1}
+    # Mỗi request vẫn có session và tin nhắn của riêng mình
+    assert all(store.get(f"s{i}")['month'] == 6 for i in range(len(messages)))
+    assert [pipeline.user_message for pipeline in pipelines] == messages
+
+
+def test_requests_with_different_session_state_are_not_coalesced(llm_stub, engine):
+    from chat_pipeline import ChatPipeline, ChatSingleFlight
+    from session_store import SessionStore
+
+    chatbot = make_chatbot(llm_stub)
+    store = SessionStore()
+    flight = ChatSingleFlight()
+
+    async def run():
+        # Lượt đầu của session "old", rồi cùng một câu tiếp nối từ session cũ và một session mới
+        await flight.arun(ChatPipeline(chatbot, engine, session_store=store, session_id="old"),
+                          "Tôi muốn đi biển miền Trung vào tháng 6")
+        pipelines = [ChatPipeline(chatbot, engine, session_store=store, session_id=session_id)
+                     for session_id in ("new", "old")]
+        await asyncio.gather(*(flight.arun(pipeline, "còn tháng 12 thì sao?") for pipeline in pipelines))
+        return pipelines
+
+    fresh, followup = asyncio.run(run())
+
+    assert flight.stats()['leaders'] == 3
+    assert flight.stats()['coalesced'] == 0
+    assert followup.previous_preferences['month'] == 6
+    assert followup.preferences['month'] == 12
+    assert fresh.previous_preferences is None
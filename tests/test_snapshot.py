@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from snapshot import build_snapshot, is_snapshot_fresh
+
+FEATURES = ["avgtemp_c", "avghumidity"]
+
+
+def write_csv(path, temperatures):
+    pd.DataFrame({"city": ["A", "B"], "avgtemp_c": temperatures, "avghumidity": [70.0, 80.0]}).to_csv(path,
+                                                                                                      index=False)
+
+
+def test_same_size_csv_restored_with_older_mtime_is_stale(tmp_path):
+    csv_path, snapshot_path = str(tmp_path / "data.csv"), str(tmp_path / "data.snapshot")
+    write_csv(csv_path, [21.5, 30.0])
+    build_snapshot(csv_path, snapshot_path, FEATURES)
+    assert is_snapshot_fresh(snapshot_path, csv_path)
+
+    # Cùng kích thước, nội dung khác, mtime cũ hơn lúc tạo snapshot (như cp -p hoặc git checkout)
+    mtime = os.stat(csv_path).st_mtime
+    write_csv(csv_path, [22.5, 31.0])
+    os.utime(csv_path, (mtime - 3600, mtime - 3600))
+
+    assert not is_snapshot_fresh(snapshot_path, csv_path)
+
+
+def test_touched_csv_with_same_content_is_fresh(tmp_path):
+    csv_path, snapshot_path = str(tmp_path / "data.csv"), str(tmp_path / "data.snapshot")
+    write_csv(csv_path, [21.5, 30.0])
+    build_snapshot(csv_path, snapshot_path, FEATURES)
+
+    mtime = os.stat(csv_path).st_mtime
+    os.utime(csv_path, (mtime + 60, mtime + 60))
+
+    assert is_snapshot_fresh(snapshot_path, csv_path)
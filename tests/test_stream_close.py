@@ -0,0 +1,74 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+
+class FakeStream:
+    """Stream chat completion giả: trả các đoạn text, chờ mãi sau đoạn cuối nếu hang=True"""
+
+    def __init__(self, texts, hang=False):
+        self.texts = list(texts)
+        self.hang = hang
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.texts:
+            text = self.texts.pop(0)
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+        if self.hang:
+            await asyncio.sleep(60)
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+def make_chatbot(monkeypatch, stream):
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    chatbot = TravelChatbot()
+
+    async def fake_acomplete(request, timeout=None, kind=None, counter=None):
+        return stream
+
+    monkeypatch.setattr(chatbot, "_acomplete", fake_acomplete)
+    return chatbot
+
+
+async def collect(chatbot, timeout=None):
+    return [text async for text in chatbot._astream_completion({}, "fallback", "test", timeout)]
+
+
+def test_stream_is_closed_when_it_ends(monkeypatch):
+    stream = FakeStream(["Xin ", "chào"])
+    chatbot = make_chatbot(monkeypatch, stream)
+
+    assert asyncio.run(collect(chatbot)) == ["Xin ", "chào"]
+    assert stream.closed
+
+
+def test_stream_is_closed_on_timeout_mid_stream(monkeypatch):
+    stream = FakeStream(["Xin "], hang=True)
+    chatbot = make_chatbot(monkeypatch, stream)
+
+    assert asyncio.run(collect(chatbot, timeout=0.3)) == ["Xin "]
+    assert stream.closed
+
+
+def test_stream_is_closed_when_the_consumer_stops_early(monkeypatch):
+    stream = FakeStream(["Xin ", "chào", "bạn"])
+    chatbot = make_chatbot(monkeypatch, stream)
+
+    async def first_token():
+        tokens = chatbot._astream_completion({}, "fallback", "test")
+        text = await tokens.__anext__()
+        # Client SSE ngắt kết nối: generator bị đóng giữa chừng
+        await tokens.aclose()
+        return text
+
+    assert asyncio.run(first_token()) == "Xin "
+    assert stream.closed
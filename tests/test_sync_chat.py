@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def chatbot(llm_stub):
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    from chatbot import TravelChatbot
+
+    return TravelChatbot(base_url=llm_stub.base_url)
+
+
+def counted(llm_stub, fn):
+    before = llm_stub.calls()
+    result = fn()
+    after = llm_stub.calls()
+    return result, {kind: count - before.get(kind, 0) for kind, count in after.items()
+                    if count != before.get(kind, 0)}
+
+
+def test_sync_flow_reuses_analysis(chatbot, engine, llm_stub):
+    message = "Tôi muốn đi núi miền Bắc vào tháng 10"
+
+    def run():
+        analysis = chatbot.process_user_input(message)
+        recommendations = engine.recommend(analysis[1], top_k=3).to_dicts()
+        return chatbot.generate_response(message, recommendations, analysis)
+
+    response, calls = counted(llm_stub, run)
+
+    assert response
+    # Kiểm tra chủ đề và trích xuất chỉ chạy một lần
+    assert calls == {'topic': 1, 'extraction': 1, 'response': 1}
+
+
+def test_generate_response_without_analysis_does_not_extract(chatbot, engine, llm_stub):
+    message = "Gợi ý nơi du lịch mát mẻ, ít mưa vào tháng 12"
+    recommendations = engine.get_recommendations({'avgtemp_c': 20, 'maxwind_kph': 10, 'avghumidity': 75,
+                                                  'month': 12}, top_k=3)
+
+    response, calls = counted(llm_stub, lambda: chatbot.chat(message, recommendations))
+
+    assert response
+    assert calls == {'topic': 1, 'response': 1}
+
+
+def test_refusal_from_analysis_is_returned_without_new_calls(chatbot, llm_stub):
+    message = "Giải phương trình bậc hai x^2 - 5x + 6 = 0"
+    analysis = chatbot.process_user_input(message)
+
+    response, calls = counted(llm_stub, lambda: chatbot.generate_response(message, None, analysis))
+
+    assert analysis[0] is False
+    assert response == analysis[1]
+    assert calls == {}
@@ -0,0 +1,95 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from trip_planner import TripPlanner
+
+CITIES = [
+    {'city': 'Hà Nội', 'province': 'Hà Nội', 'region': 'Bắc', 'terrain': 'đồng bằng', 'lat': 21.03, 'lon': 105.85},
+    {'city': 'Hạ Long', 'province': 'Quảng Ninh', 'region': 'Bắc', 'terrain': 'ven biển', 'lat': 20.95, 'lon': 107.08},
+    {'city': 'Đà Nẵng', 'province': 'Đà Nẵng', 'region': 'Trung', 'terrain': 'ven biển', 'lat': 16.05, 'lon': 108.2},
+    {'city': 'Đà Lạt', 'province': 'Lâm Đồng', 'region': 'Nam', 'terrain': 'núi', 'lat': 11.94, 'lon': 108.44},
+]
+
+
+def make_planner(seed):
+    rng = np.random.default_rng(seed)
+    tensor = np.empty((len(CITIES), 12, 2))
+    tensor[:, :, 0] = rng.uniform(15, 35, (len(CITIES), 12))
+    tensor[:, :, 1] = rng.uniform(20, 90, (len(CITIES), 12))
+    tensor[0, 5, 1] = np.nan
+    return TripPlanner(tensor, ['avgtemp_c', 'hci'], CITIES)
+
+
+def brute_force(planner, months, mask, max_travel_hours, penalty):
+    """Điểm và lịch trình tốt nhất khi duyệt mọi chuỗi thành phố"""
+    hci_id = planner.tensor_features.index('hci')
+    best_score, best_path = -np.inf, None
+    for path in itertools.product(np.flatnonzero(mask), repeat=len(months)):
+        score = 0.0
+        for step, (city_id, month) in enumerate(zip(path, months)):
+            hci = planner.tensor[city_id, month - 1, hci_id]
+            if np.isnan(hci):
+                score = -np.inf
+                break
+            score += hci
+            if step:
+                hours = planner.travel_hours[path[step - 1], city_id]
+                if max_travel_hours is not None and hours > max_travel_hours and path[step - 1] != city_id:
+                    score = -np.inf
+                    break
+                score -= penalty * hours
+        if score > best_score:
+            best_score, best_path = score, [int(city_id) for city_id in path]
+    return best_score, best_path
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_matches_brute_force(seed):
+    rng = random.Random(seed)
+    planner = make_planner(seed)
+    months = [(rng.randint(1, 12) + offset - 1) % 12 + 1 for offset in range(rng.randint(1, 5))]
+    max_travel_hours = rng.choice([None, 5.0, 12.0, 20.0])
+    penalty = rng.choice([0.0, 0.5, 2.0])
+    mask = planner.candidate_mask()
+
+    expected_score, expected_path = brute_force(planner, months, mask, max_travel_hours, penalty)
+    plan = planner.plan(months, mask, max_travel_hours, penalty)
+
+    assert plan['total_score'] == pytest.approx(expected_score)
+    assert [stop['city'] for stop in plan['itinerary']] == [CITIES[city_id]['city'] for city_id in expected_path]
+    assert [stop['month'] for stop in plan['itinerary']] == months
+
+
+def test_plan_respects_candidate_mask_and_travel_limit():
+    planner = make_planner(0)
+    mask = planner.candidate_mask(cities=['ha noi', 'Đà Lạt'])
+
+    # Hà Nội - Đà Lạt xa hơn 12 giờ: lịch trình phải ở lại một thành phố
+    plan = planner.plan([1, 2, 3], mask, max_travel_hours=12.0)
+
+    assert len({stop['city'] for stop in plan['itinerary']}) == 1
+    assert plan['total_travel_km'] == 0.0
+    with pytest.raises(ValueError):
+        planner.candidate_mask(cities=['Sa Pa'])
+
+
+def test_plan_endpoint_returns_optimal_itinerary(client):
+    import main
+
+    planner = main.recommendation_engine.state.trip_planner
+    cities = ['Hà Nội', 'Đà Nẵng', 'Đà Lạt']
+    body = {"start_date": "2025-05-10", "end_date": "2025-08-01", "cities": cities, "max_travel_hours": 20}
+
+    response = client.post("/api/plan", json=body)
+
+    assert response.status_code == 200
+    plan = response.json()
+    mask = planner.candidate_mask(cities=cities)
+    expected_score, expected_path = brute_force(planner, [5, 6, 7, 8], mask, 20.0, 0.0)
+    assert plan['months'] == [5, 6, 7, 8]
+    assert plan['total_score'] == pytest.approx(expected_score)
+    assert [stop['city'] for stop in plan['itinerary']] == [planner.cities[city_id]['city']
+                                                            for city_id in expected_path]
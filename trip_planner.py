@@ -0,0 +1,117 @@
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from geo_index import pairwise_haversine_km
+from search_index import fold_diacritics
+
+
+def month_sequence(start: date, end: date, max_months: int = 24) -> List[int]:
+    """Các tháng (1-12) từ tháng của start đến tháng của end, kể cả hai đầu"""
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+    count = (end.year - start.year) * 12 + (end.month - start.month) + 1
+    if count > max_months:
+        raise ValueError(f"Date range must span at most {max_months} months")
+    return [(start.month - 1 + offset) % 12 + 1 for offset in range(count)]
+
+
+class TripPlanner:
+    """
+    Lập lịch trình nhiều tháng trên tensor [city, month, feature].
+
+    Mỗi tháng trong lịch trình chọn một thành phố; điểm lịch trình là tổng hci của các (city, month)
+    đã chọn trừ phạt di chuyển. Chặng di chuyển giữa hai tháng liên tiếp phải nằm trong giới hạn
+    thời gian (ước lượng từ khoảng cách lat/lon). Lời giải tối ưu tìm bằng quy hoạch động (Viterbi),
+    mỗi bước là một phép toán trên ma trận (city, city).
+    """
+
+    # Hệ số quãng đường đường bộ so với đường chim bay và tốc độ di chuyển trung bình (km/h)
+    ROAD_DETOUR_FACTOR = 1.3
+    TRAVEL_SPEED_KPH = 50.0
+
+    def __init__(self, tensor: np.ndarray, tensor_features: Sequence[str], cities: List[Dict]):
+        """
+        tensor: mảng (số thành phố, 12, số feature), NaN ở ô không có dữ liệu
+        cities: thông tin từng thành phố theo thứ tự trục 0 của tensor (city, province, region, terrain, lat, lon)
+        """
+        self.tensor = tensor
+        self.tensor_features = list(tensor_features)
+        self.cities = cities
+        self._hci = tensor[:, :, self.tensor_features.index('hci')]
+        self._regions = np.array([city['region'] for city in cities], dtype=object)
+        self._terrains = np.array([city['terrain'] for city in cities], dtype=object)
+        self._city_ids = {fold_diacritics(city['city']): city_id for city_id, city in enumerate(cities)}
+
+        distance_km = pairwise_haversine_km([city['lat'] for city in cities], [city['lon'] for city in cities])
+        self.travel_km = distance_km * self.ROAD_DETOUR_FACTOR
+        self.travel_hours = self.travel_km / self.TRAVEL_SPEED_KPH
+
+    def candidate_mask(self, cities: Optional[Sequence[str]] = None, region: Optional[str] = None,
+                       terrain: Optional[str] = None) -> np.ndarray:
+        """Mặt nạ thành phố ứng viên theo danh sách tên (không phân biệt dấu), region và terrain"""
+        mask = np.ones(len(self.cities), dtype=bool)
+        if cities:
+            ids = [self._city_ids.get(fold_diacritics(name)) for name in cities]
+            unknown = [name for name, city_id in zip(cities, ids) if city_id is None]
+            if unknown:
+                raise ValueError(f"Unknown cities: {', '.join(map(str, unknown))}")
+            mask[:] = False
+            mask[ids] = True
+        if region is not None:
+            mask &= self._regions == region
+        if terrain is not None:
+            mask &= self._terrains == terrain
+        if not mask.any():
+            raise ValueError("No candidate cities match the given constraints")
+        return mask
+
+    def plan(self, months: Sequence[int], mask: np.ndarray, max_travel_hours: Optional[float] = None,
+             travel_penalty_per_hour: float = 0.0) -> Dict:
+        """
+        Chuỗi (city, month) có tổng điểm lớn nhất; ở lại cùng thành phố luôn được phép
+        """
+        months = np.asarray(months, dtype=np.int64)
+        # Điểm (số tháng, số thành phố); thành phố bị loại hoặc thiếu dữ liệu -> -inf
+        scores = self._hci[:, months - 1].T.copy()
+        scores[:, ~mask] = -np.inf
+        scores[np.isnan(scores)] = -np.inf
+
+        # Điểm chuyển chặng (từ, đến): phạt theo giờ di chuyển, -inf nếu vượt giới hạn
+        transition = -travel_penalty_per_hour * self.travel_hours
+        if max_travel_hours is not None:
+            transition = np.where(self.travel_hours <= max_travel_hours, transition, -np.inf)
+        np.fill_diagonal(transition, 0.0)
+
+        best = scores[0]
+        backpointers = np.zeros((len(months), len(self.cities)), dtype=np.int64)
+        for step in range(1, len(months)):
+            candidates = best[:, np.newaxis] + transition
+            backpointers[step] = np.argmax(candidates, axis=0)
+            best = candidates[backpointers[step], np.arange(len(self.cities))] + scores[step]
+
+        if not np.isfinite(best.max()):
+            raise ValueError("No feasible itinerary for the given months and constraints")
+
+        path = [int(np.argmax(best))]
+        for step in range(len(months) - 1, 0, -1):
+            path.append(int(backpointers[step, path[-1]]))
+        path.reverse()
+
+        itinerary = []
+        for step, (city_id, month) in enumerate(zip(path, months)):
+            stop = dict(self.cities[city_id])
+            stop['month'] = int(month)
+            for feature_id, feature in enumerate(self.tensor_features):
+                stop['score' if feature == 'hci' else feature] = float(self.tensor[city_id, month - 1, feature_id])
+            previous = path[step - 1] if step else city_id
+            stop['travel_km'] = round(float(self.travel_km[previous, city_id]), 1)
+            stop['travel_hours'] = round(float(self.travel_hours[previous, city_id]), 2)
+            itinerary.append(stop)
+
+        return {
+            'itinerary': itinerary,
+            'total_score': float(best.max()),
+            'total_travel_km': round(sum(stop['travel_km'] for stop in itinerary), 1)
+        }